@@ -13,6 +13,17 @@ class DBConfig:
     database_engine = "mysql"  # 数据库引擎，支持 mysql, postgresql, oracle, sqlite3
 
 
+class ReplicaDBConfig:
+    """
+    从库配置 (可选)，host 为空时不配置从库，数据库引擎与 DBConfig 相同
+    """
+    host = ""
+    port = 3306
+    database = "xxx"
+    username = "xxx"
+    password = "xxx"
+
+
 class OssConfig:
     """
     阿里云 OSS 服务相关的配置文件
@@ -94,6 +94,21 @@ DATABASES = {
     }
 }
 
+# 从库 (可选)，配置 config.ReplicaDBConfig 后，ETL 可设置 read_alias = "replica" 从从库查询
+if getattr(getattr(config, "ReplicaDBConfig", None), "host", ""):
+    DATABASES["replica"] = {
+        "ENGINE": f"django.db.backends.{config.DBConfig.database_engine}",
+        "NAME": config.ReplicaDBConfig.database,
+        "USER": config.ReplicaDBConfig.username,
+        "PASSWORD": config.ReplicaDBConfig.password,
+        "HOST": config.ReplicaDBConfig.host,
+        "PORT": config.ReplicaDBConfig.port,
+        # 测试时不创建从库，使用 default 的测试数据库
+        "TEST": {
+            "MIRROR": "default",
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
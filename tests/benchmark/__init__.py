@@ -0,0 +1,33 @@
+"""
+性能基准测试，使用独立的 Django 配置 (默认为内存 sqlite) 和 tests/benchmark/config.py，无需项目根目录的 config.py
+
+运行方式：python -m tests.benchmark.bench_snapshot
+         python -m tests.benchmark.bench_etl --help
+"""
+import sys
+
+import django
+from django.conf import settings
+
+
+def setup(database: dict = None):
+    """
+    初始化基准测试使用的 Django 配置
+    :param database: default 数据库的配置，默认为内存 sqlite
+    """
+    if settings.configured:
+        return
+    # etl_base 通过 import config 读取配置，替换为基准测试的配置
+    from tests.benchmark import config
+
+    sys.modules["config"] = config
+    if database is None:
+        database = {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    config.DBConfig.database_engine = database["ENGINE"].rsplit(".", 1)[-1]
+    settings.configure(
+        INSTALLED_APPS=["tests.benchmark"],
+        DATABASES={"default": database},
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=False,
+    )
+    django.setup()
@@ -0,0 +1,108 @@
+"""
+快照对比的基准测试：逐字段构建字典并对比 (原实现) 与 ModelSnapshot 的耗时
+
+运行方式：python -m tests.benchmark.bench_snapshot [记录数]
+"""
+import sys
+import time
+from datetime import datetime
+from itertools import chain
+
+from tests.benchmark import setup
+
+setup()
+
+from tests.benchmark.models import WIDTH, WideRecord  # noqa: E402
+from tests.etl.snapshot import ModelSnapshot  # noqa: E402
+
+
+def legacy_to_dict(obj) -> dict:
+    opts = obj._meta
+    data = {}
+    for f in chain(opts.concrete_fields, opts.private_fields):
+        data[f.name] = f.value_from_object(obj)
+    for f in opts.many_to_many:
+        data[f.name] = [i.id for i in f.value_from_object(obj)]
+    return data
+
+
+def legacy_diff(record, origin_data: dict, changed_data: dict) -> list:
+    changed_fields = []
+    for field_name, field_value in origin_data.items():
+        if field_value != changed_data[field_name]:
+            _field_meta = record._meta.get_field(field_name)
+            if hasattr(_field_meta, "auto_now") and _field_meta.auto_now is True:
+                raise Exception(f"{field_name} 已发生变化")
+            changed_fields.append(field_name)
+    return changed_fields
+
+
+def rule(record):
+    record.name_0 += "_x"
+    record.count_1 += 1
+
+
+def legacy(records: list) -> int:
+    changed = 0
+    for record in records:
+        origin_data = legacy_to_dict(record)
+        rule(record)
+        changed_data = legacy_to_dict(record)
+        changed += len(legacy_diff(record, origin_data, changed_data))
+    return changed
+
+
+def compiled(records: list) -> int:
+    changed = 0
+    snapshot = ModelSnapshot.of(WideRecord)
+    for record in records:
+        origin_values = snapshot.capture(record)
+        rule(record)
+        changed_values = snapshot.capture(record)
+        for i in snapshot.diff(origin_values, changed_values):
+            if i in snapshot.auto_now_indexes:
+                raise Exception(f"{snapshot.names[i]} 已发生变化")
+            changed += 1
+        # 归档时仍需要字典
+        snapshot.to_dict(origin_values)
+        snapshot.to_dict(changed_values)
+    return changed
+
+
+def make_records(count: int) -> list:
+    now = datetime.now()
+    records = []
+    for i in range(count):
+        values = dict(id=i + 1, updated=now)
+        for j in range(WIDTH):
+            values[f"name_{j}"] = f"name{i}"
+            values[f"count_{j}"] = i
+            values[f"note_{j}"] = "note" * 10
+            values[f"extra_{j}"] = {"k": i}
+        records.append(WideRecord(**values))
+    return records
+
+
+def bench(func, count: int) -> (float, int):
+    records = make_records(count)
+    start = time.perf_counter()
+    changed = func(records)
+    return time.perf_counter() - start, changed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    field_count = len(WideRecord._meta.concrete_fields)
+    print(f"记录数: {count} 字段数: {field_count}")
+    results = {}
+    for func in (legacy, compiled):
+        elapsed, changed = bench(func, count)
+        results[func.__name__] = elapsed
+        print(
+            f"{func.__name__:>8}: {elapsed:.3f}s {elapsed / count * 1e6:.1f}us/条 变更字段 {changed}"
+        )
+    print(f"加速比: {results['legacy'] / results['compiled']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# 基准测试使用的配置，代替项目根目录的 config.py，不连接生产数据库，不上传 OSS
+
+
+class DBConfig:
+    """
+    数据库配置，只用于归档路径，连接信息由 tests.benchmark.setup() 配置
+    """
+    host = ""
+    port = 0
+    database = "benchmark"
+    username = ""
+    password = ""
+    database_engine = "sqlite3"
+
+
+class OssConfig:
+    """
+    OSS 配置，基准测试不上传
+    """
+
+    auto_upload_oss = False
+    access_id = "benchmark"
+    access_key = "benchmark"
+    oss_endpoint = "http://localhost"
+    oss_bucket_name = "benchmark"
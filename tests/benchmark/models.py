@@ -0,0 +1,56 @@
+from django.db import models
+
+# 宽表的字段数量，每种类型各 WIDTH 个字段
+WIDTH = 10
+
+
+def _wide_fields(width: int, module: str, db_table: str, auto_now: bool = True) -> dict:
+    fields = dict(
+        __module__=module,
+        Meta=type("Meta", (), {"db_table": db_table}),
+    )
+    if auto_now:
+        fields["updated"] = models.DateTimeField(auto_now=True)
+    for i in range(width):
+        fields[f"name_{i}"] = models.CharField(max_length=64, default="")
+        fields[f"count_{i}"] = models.IntegerField(default=0)
+        fields[f"note_{i}"] = models.TextField(null=True)
+        fields[f"extra_{i}"] = models.JSONField(null=True)
+    return fields
+
+
+# 基准测试使用的宽表
+WideRecord = type("WideRecord", (models.Model,), _wide_fields(WIDTH, __name__, "wide_record"))
+
+
+class BenchTag(models.Model):
+    """
+    多对多字段关联的标签
+    """
+
+    name = models.CharField(max_length=64, default="")
+
+    class Meta:
+        db_table = "bench_tag"
+
+
+_bench_models = {}  # (宽度, 是否有多对多字段, 是否有 auto_now 字段) -> 模型
+
+
+def bench_model(width: int, m2m: bool = False, auto_now: bool = True):
+    """
+    ETL 基准测试使用的宽表，每种类型各 width 个字段，m2m 为 True 时带有关联 BenchTag 的多对多字段 tags，
+    auto_now 为 False 时没有 auto_now 字段 updated
+    同样的参数只创建一次模型
+    """
+    key = (width, m2m, auto_now)
+    model = _bench_models.get(key)
+    if model is not None:
+        return model
+    suffix = f"{'_m2m' if m2m else ''}{'' if auto_now else '_plain'}"
+    name = f"BenchRecord{width}{'M2M' if m2m else ''}{'' if auto_now else 'Plain'}"
+    fields = _wide_fields(width, __name__, f"bench_record_{width}{suffix}", auto_now)
+    if m2m:
+        fields["tags"] = models.ManyToManyField(BenchTag, related_name="+")
+    model = _bench_models[key] = type(name, (models.Model,), fields)
+    return model
@@ -0,0 +1,282 @@
+import gzip
+import json
+import locale
+import os
+import re
+import zlib
+
+from tests.etl import Logger
+
+# 归档行中的 record_id，归档行由 json.dumps 生成，键的顺序固定
+RECORD_ID_PATTERN = re.compile(rb'"record_id": (\d+)')
+
+# 归档文件后缀，.txt.gz 为压缩归档，由多个独立的 gzip 块组成
+ARCHIVE_EXTENSIONS = (".txt.gz", ".txt")
+
+# 逆序读取索引文件、按位置读取普通归档文件时，每次读取的块大小
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def archive_encoding() -> str:
+    """
+    归档文件的编码，与 open() 的默认编码一致
+    """
+    return locale.getpreferredencoding(False)
+
+
+def is_compressed(archive_file: str) -> bool:
+    """
+    是否为压缩归档文件
+    """
+    return archive_file.endswith(".gz")
+
+
+def split_archive_name(archive_file: str) -> (str, str):
+    """
+    拆分归档文件名与后缀，如 db@table__origin.txt.gz -> (db@table__origin, .txt.gz)
+    """
+    for ext in ARCHIVE_EXTENSIONS:
+        if archive_file.endswith(ext):
+            return archive_file[: -len(ext)], ext
+    return os.path.splitext(archive_file)
+
+
+def open_archive(archive_file: str):
+    """
+    以文本方式打开归档文件，压缩归档透明解压
+    """
+    if is_compressed(archive_file):
+        return gzip.open(archive_file, "rt", encoding=archive_encoding())
+    return open(archive_file, "r", encoding=archive_encoding())
+
+
+def iter_gzip_members(f):
+    """
+    逐块读取由多个 gzip 块组成的文件
+    :return: (gzip 块的字节偏移, 解压后的内容) 迭代器
+    """
+    offset = f.tell()
+    pending = b""
+    while True:
+        decompressor = zlib.decompressobj(wbits=31)
+        chunks = []
+        consumed = 0
+        data, pending = pending, b""
+        while not decompressor.eof:
+            if not data:
+                data = f.read(1024 * 1024)
+                if not data:
+                    if consumed:
+                        raise Exception(f"归档文件 {f.name} 的 gzip 块不完整，偏移 {offset}")
+                    return
+            chunks.append(decompressor.decompress(data))
+            consumed += len(data) - len(decompressor.unused_data)
+            data = b""
+        pending = decompressor.unused_data
+        yield offset, b"".join(chunks)
+        offset += consumed
+
+
+class ArchiveIndex:
+    """
+    归档文件的记录偏移索引：record_id -> 归档行的位置
+    普通归档文件的位置为字节偏移，压缩归档文件的位置为 (gzip 块的字节偏移, 块内行号)。
+    索引文件与归档文件同名，后缀为 .offsets，每行为 "record_id 位置 写入后的归档文件大小"，
+    最后一行的文件大小与归档文件不一致时，视为索引过期，重新扫描归档文件构建。
+    """
+
+    def __init__(self, archive_file: str):
+        self.archive_file = archive_file
+        self.index_file = f"{split_archive_name(archive_file)[0]}.offsets"
+        self._offsets = None  # record_id -> [位置, ...]，按写入顺序排列
+
+    def is_valid(self) -> bool:
+        """
+        索引文件是否与归档文件一致
+        """
+        size = 0
+        if os.path.exists(self.archive_file):
+            size = os.path.getsize(self.archive_file)
+        if not os.path.exists(self.index_file):
+            return size == 0
+        indexed_size = 0
+        with open(self.index_file, "rb") as f:
+            # 只需要读取最后一行
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            f.seek(max(end - 256, 0))
+            lines = f.read().splitlines()
+            if lines:
+                indexed_size = int(lines[-1].split(b" ")[2])
+        return indexed_size == size
+
+    def rebuild(self):
+        """
+        扫描归档文件，重新构建索引文件
+        """
+        count = 0
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, "w") as out:
+            for position, line, end in self._scan():
+                record_id = self.parse_record_id(line)
+                out.write(f"{record_id} {self.format_position(position)} {end}\n")
+                count += 1
+        os.replace(tmp_file, self.index_file)
+        # 已加载的索引随之失效，需要时从索引文件重新加载
+        self._offsets = None
+        Logger.info(f"归档偏移索引构建完成：{self.index_file} 共 {count} 行")
+
+    def load(self) -> dict:
+        """
+        加载索引，索引过期时重新构建
+        :return: record_id -> [位置, ...]
+        """
+        if self._offsets is not None:
+            return self._offsets
+        if not self.is_valid():
+            self.rebuild()
+
+        offsets = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r") as f:
+                for line in f:
+                    record_id, position, _ = line.split(" ")
+                    offsets.setdefault(int(record_id), []).append(
+                        self.parse_position(position)
+                    )
+        self._offsets = offsets
+        return offsets
+
+    def add(self, record_id: int, position):
+        """
+        写入归档行后，同步更新已加载的索引
+        """
+        if self._offsets is not None:
+            self._offsets.setdefault(record_id, []).append(position)
+
+    def offsets(self, record_id: int) -> list:
+        """
+        记录在归档文件中的所有位置，按写入顺序排列
+        """
+        return self.load().get(record_id, [])
+
+    def reverse_offsets(self):
+        """
+        归档文件所有行的位置，按写入顺序逆序排列
+        索引文件按写入顺序追加，从文件末尾按块向前读取，不需要加载整个索引
+        """
+        if not self.is_valid():
+            self.rebuild()
+        if not os.path.exists(self.index_file):
+            return
+        for line in self._reverse_lines(self.index_file):
+            yield self.parse_position(line.split(b" ")[1].decode())
+
+    def read(self, positions, reverse: bool = False):
+        """
+        按位置读取归档行，压缩归档文件按 gzip 块解压，相邻的行只解压一次，
+        普通归档文件按块读取，同一块中的行只读取一次
+        :param reverse: 位置是否按写入顺序逆序排列，决定普通归档文件按位置向前还是向后读取块
+        """
+        encoding = archive_encoding()
+        member_offset, member_lines = None, None
+        block_start, block = 0, b""
+        with open(self.archive_file, "rb") as f:
+            for position in positions:
+                if isinstance(position, tuple):
+                    offset, line_no = position
+                    if offset != member_offset:
+                        f.seek(offset)
+                        _, data = next(iter_gzip_members(f))
+                        member_offset, member_lines = offset, data.splitlines()
+                    yield member_lines[line_no].decode(encoding)
+                    continue
+
+                start = position - block_start
+                end = block.find(b"\n", start) if 0 <= start < len(block) else -1
+                if end < 0:
+                    # 不在当前块中，读取包含该行的新块：逆序时块以该行结尾，否则块以该行开头
+                    block_start = max(position - READ_BLOCK_SIZE, 0) if reverse else position
+                    f.seek(block_start)
+                    block = f.read(position - block_start) if reverse else f.read(READ_BLOCK_SIZE)
+                    if reverse or not block.endswith(b"\n"):
+                        block += f.readline()
+                    start = position - block_start
+                    end = block.find(b"\n", start)
+                    if end < 0:
+                        # 最后一行没有换行符
+                        end = len(block)
+                yield block[start : end + 1].decode(encoding)
+
+    @staticmethod
+    def _reverse_lines(file: str):
+        """
+        从文件末尾按块向前读取
+        :return: 逆序的行迭代器，忽略空行
+        """
+        with open(file, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            rest = b""
+            while position > 0:
+                size = min(READ_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + rest).split(b"\n")
+                # 第一行可能不完整，与前一块一起处理
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line
+            if rest.strip():
+                yield rest
+
+    def _scan(self):
+        """
+        顺序扫描归档文件
+        :return: (位置, 归档行, 该行写入后的归档文件大小) 迭代器
+        """
+        with open(self.archive_file, "rb") as f:
+            if is_compressed(self.archive_file):
+                members = iter_gzip_members(f)
+                member = next(members, None)
+                while member is not None:
+                    offset, data = member
+                    member = next(members, None)
+                    end = member[0] if member is not None else os.fstat(f.fileno()).st_size
+                    for line_no, line in enumerate(data.splitlines()):
+                        if line.strip():
+                            yield (offset, line_no), line, end
+                return
+
+            offset = 0
+            for line in f:
+                end = offset + len(line)
+                if line.strip():
+                    yield offset, line, end
+                offset = end
+
+    @staticmethod
+    def format_position(position) -> str:
+        """
+        位置写入索引文件的格式，压缩归档文件为 "gzip 块的字节偏移:块内行号"
+        """
+        if isinstance(position, tuple):
+            return f"{position[0]}:{position[1]}"
+        return str(position)
+
+    @staticmethod
+    def parse_position(position: str):
+        if ":" in position:
+            offset, line_no = position.split(":")
+            return int(offset), int(line_no)
+        return int(position)
+
+    @staticmethod
+    def parse_record_id(line: bytes) -> int:
+        """
+        解析归档行中的 record_id
+        """
+        match = RECORD_ID_PATTERN.search(line)
+        if match:
+            return int(match.group(1))
+        return int(json.loads(line)["record_id"])
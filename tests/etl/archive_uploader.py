@@ -0,0 +1,292 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from queue import Queue
+
+import oss2
+
+from tests.etl import Logger
+
+
+class OssTransport:
+    """
+    阿里云 OSS 上传
+    """
+
+    def __init__(self, bucket: oss2.Bucket, checkpoint_dir: str):
+        self.bucket = bucket
+        self.checkpoint_dir = checkpoint_dir  # 断点续传记录的存储目录
+
+    def init_upload(self, key: str) -> str:
+        """
+        初始化分片上传
+        :return: upload_id
+        """
+        return self.bucket.init_multipart_upload(key).upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        上传一个分片
+        :return: etag
+        """
+        return self.bucket.upload_part(key, upload_id, part_number, data).etag
+
+    def complete_upload(self, key: str, upload_id: str, parts: list):
+        """
+        完成分片上传
+        :param parts: [(分片序号, etag), ...]
+        """
+        self.bucket.complete_multipart_upload(
+            key, upload_id, [oss2.models.PartInfo(n, etag) for n, etag in parts]
+        )
+
+    def abort_upload(self, key: str, upload_id: str):
+        self.bucket.abort_multipart_upload(key, upload_id)
+
+    def upload_file(self, key: str, file: str):
+        """
+        上传整个文件，大文件自动断点续传
+        """
+        oss2.resumable_upload(
+            self.bucket,
+            key,
+            file,
+            store=oss2.ResumableStore(root=self.checkpoint_dir),
+            num_threads=4,
+        )
+
+    def url(self, key: str) -> str:
+        return f"oss://{self.bucket.bucket_name}/{key}"
+
+
+class LocalTransport:
+    """
+    本地目录模拟 OSS 上传，用于测试
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def init_upload(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        with open(os.path.join(self._upload_dir(upload_id), f"{part_number:05d}"), "wb") as f:
+            f.write(data)
+        return f"{upload_id}-{part_number}"
+
+    def complete_upload(self, key: str, upload_id: str, parts: list):
+        upload_dir = self._upload_dir(upload_id)
+        target = self._object_file(key)
+        with open(f"{target}.tmp", "wb") as out:
+            for part_number, _ in sorted(parts):
+                with open(os.path.join(upload_dir, f"{part_number:05d}"), "rb") as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(f"{target}.tmp", target)
+        shutil.rmtree(upload_dir)
+
+    def abort_upload(self, key: str, upload_id: str):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def upload_file(self, key: str, file: str):
+        target = self._object_file(key)
+        shutil.copyfile(file, f"{target}.tmp")
+        os.replace(f"{target}.tmp", target)
+
+    def url(self, key: str) -> str:
+        return self._object_file(key)
+
+    def _upload_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, ".uploads", upload_id)
+
+    def _object_file(self, key: str) -> str:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+class ArchiveUploader:
+    """
+    归档文件后台分片上传
+    归档文件只追加写入，每页提交后调用 poll()，已写满一个分片的内容由后台线程上传，
+    清洗结束时调用 finish() 上传剩余内容并完成上传，异常退出时调用 close() 停止后台线程。
+    上传进度记录在清单文件中，每行 (每个归档文件) 包含 upload_id 和已上传的分片，中断后重新运行时从已上传的位置继续。
+    """
+
+    def __init__(self, transport, manifest_file: str, part_size: int, retry: int = 3):
+        self.transport = transport
+        self.manifest_file = manifest_file
+        self.part_size = part_size
+        self.retry = retry  # 分片上传失败时的重试次数
+        self._manifest = self._load_manifest()  # 归档文件路径 -> 上传进度
+        self._offsets = {}  # 归档文件路径 -> 已提交上传的位置
+        self._queue = Queue()
+        self._lock = threading.RLock()
+        self._thread = None
+        self._closing = False  # 正在停止后台线程，队列中未上传的分片不再上传
+        self._error = None
+
+    def track(self, archive_file: str, key: str):
+        """
+        登记需要上传的归档文件，已在清单中且未完成的上传继续使用原来的 upload_id
+        """
+        if archive_file in self._offsets:
+            return
+        size = os.path.getsize(archive_file) if os.path.exists(archive_file) else 0
+        upload = self._manifest.get(archive_file)
+        if upload is not None and upload["size"] > size:
+            # 归档文件被重新生成，之前的上传作废
+            Logger.warning(f"归档文件 {archive_file} 小于已上传的大小，重新上传")
+            if not upload["completed"]:
+                self.transport.abort_upload(upload["key"], upload["upload_id"])
+            upload = None
+        if upload is not None and upload["completed"]:
+            if upload["size"] == size:
+                Logger.info(f"归档文件 {archive_file} 已上传，跳过")
+                return
+            # 上传完成后归档文件又追加了内容，作为新的文件上传
+            upload = None
+        if upload is None:
+            upload = dict(key=key, upload_id=None, size=0, parts=[], completed=False)
+            with self._lock:
+                self._manifest[archive_file] = upload
+        elif upload["size"]:
+            Logger.info(f"归档文件 {archive_file} 从 {upload['size']} 字节处继续上传")
+        self._offsets[archive_file] = upload["size"]
+
+    def poll(self, final: bool = False):
+        """
+        将已写满的分片放入上传队列
+        :param final: 是否为最后一次，最后一次时不足一个分片的内容也会上传
+        """
+        self._raise_error()
+        for archive_file, offset in self._offsets.items():
+            size = os.path.getsize(archive_file) if os.path.exists(archive_file) else 0
+            while size - offset >= self.part_size or (final and size > offset):
+                end = min(offset + self.part_size, size)
+                self._put((archive_file, offset, end))
+                offset = end
+            self._offsets[archive_file] = offset
+
+    def finish(self) -> list:
+        """
+        上传剩余内容，等待后台线程上传完成，并完成所有上传
+        :return: 本次完成上传的对象 key
+        """
+        try:
+            self.poll(final=True)
+            self._queue.join()
+            self._raise_error()
+        finally:
+            self.close()
+
+        keys = []
+        for archive_file in self._offsets:
+            upload = self._manifest[archive_file]
+            if not upload["parts"]:
+                if not os.path.exists(archive_file):
+                    continue
+                # 空文件无法分片上传
+                self.transport.upload_file(upload["key"], archive_file)
+            else:
+                self.transport.complete_upload(
+                    upload["key"], upload["upload_id"], upload["parts"]
+                )
+            upload["completed"] = True
+            self._save_manifest()
+            keys.append(upload["key"])
+        self._offsets.clear()
+        return keys
+
+    def close(self):
+        """
+        停止后台线程：正在上传的分片完成后退出，队列中未上传的分片丢弃，关闭后不能再使用。
+        未完成的上传记录在清单中，重新运行时从已上传的位置继续。
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._closing = True
+        self._queue.put(None)
+        thread.join()
+        self._thread = None
+
+    def _put(self, task: tuple):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ArchiveUploader", daemon=True)
+            self._thread.start()
+        self._queue.put(task)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                # close() 放入的结束标记
+                self._queue.task_done()
+                return
+            archive_file, offset, end = task
+            try:
+                if self._error is None and not self._closing:
+                    self._upload_part(archive_file, offset, end)
+            except Exception as e:
+                Logger.error(f"归档文件 {archive_file} 分片上传失败 [{offset}, {end}): {e}")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _upload_part(self, archive_file: str, offset: int, end: int):
+        upload = self._manifest[archive_file]
+        if upload["upload_id"] is None:
+            upload["upload_id"] = self.transport.init_upload(upload["key"])
+            self._save_manifest()
+        with open(archive_file, "rb") as f:
+            f.seek(offset)
+            data = f.read(end - offset)
+        part_number = len(upload["parts"]) + 1
+
+        for i in range(self.retry + 1):
+            try:
+                etag = self.transport.upload_part(
+                    upload["key"], upload["upload_id"], part_number, data
+                )
+                break
+            except Exception as e:
+                if i == self.retry:
+                    raise
+                Logger.warning(f"归档文件 {archive_file} 分片 {part_number} 上传失败，{2 ** i} 秒后重试: {e}")
+                time.sleep(2**i)
+
+        with self._lock:
+            upload["parts"].append((part_number, etag))
+            upload["size"] = end
+            self._save_manifest()
+        Logger.info(f"归档文件 {archive_file} 分片 {part_number} 上传完成，已上传 {end} 字节")
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise Exception(f"归档文件后台上传失败: {self._error}")
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file, "r") as f:
+            manifest = json.load(f)
+        for upload in manifest.values():
+            upload["parts"] = [tuple(part) for part in upload["parts"]]
+        return manifest
+
+    def _save_manifest(self):
+        """
+        写入清单文件，先写临时文件再替换，避免中断时清单文件损坏
+        """
+        tmp_file = f"{self.manifest_file}.tmp"
+        with self._lock, open(tmp_file, "w") as f:
+            json.dump(self._manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+            os.replace(tmp_file, self.manifest_file)
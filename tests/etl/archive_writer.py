@@ -0,0 +1,141 @@
+import gzip
+import os
+
+from tests.etl import Logger
+from tests.etl.archive_index import archive_encoding, is_compressed
+
+
+class ArchiveWriter:
+    """
+    归档文件写入器
+    整个运行期间持有归档文件的句柄，写入的行先放入缓冲区，在分页提交数据库之前统一刷盘，
+    避免每写一行都打开、关闭一次文件。
+    .gz 归档文件每次刷盘写入一个独立的 gzip 块，每个块都可以单独解压。
+    """
+
+    def __init__(self):
+        self._files = {}  # 归档文件路径 -> 文件句柄
+        self._buffers = {}  # 归档文件路径 -> [(待写入的行, 刷盘回调), ...]
+        self._sizes = {}  # 归档文件路径 -> 已写入的文件大小
+        self._marks = None  # 事务开始后写入过的文件 -> 事务开始前的文件大小，参照 begin()
+        self._no_fsync = set()  # 刷盘时不同步到磁盘的文件 (可重建的索引文件)
+        self._encoding = archive_encoding()
+
+    def write(self, archive_file: str, line: str, on_flush=None, fsync: bool = True):
+        """
+        写入一行到缓冲区，调用 flush() 后才会写入文件
+        :param on_flush: 刷盘回调 on_flush(位置, 写入后的文件大小)，可在回调中继续写入其他文件 (如索引文件)
+        :param fsync: 刷盘时该文件是否同步到磁盘，与归档文件大小不一致时会重建的索引文件无需同步
+        :return: 该行在文件中的位置，普通文件为字节偏移，.gz 文件为 (gzip 块的字节偏移, 块内行号)
+        """
+        if not fsync:
+            self._no_fsync.add(archive_file)
+        lines = self._buffers.setdefault(archive_file, [])
+        if is_compressed(archive_file):
+            position = (self._size(archive_file), len(lines))
+        else:
+            position = self._size(archive_file) + sum(
+                len(data) for data, _ in lines
+            )
+        lines.append((f"{line}\n".encode(self._encoding), on_flush))
+        return position
+
+    def flush(self, fsync: bool = True):
+        """
+        将缓冲区写入文件，刷盘回调写入的内容 (如索引文件) 在同一次刷盘中写入
+        :param fsync: 是否同步到磁盘，提交数据库之前应同步，确保归档不落后于数据库
+        """
+        while any(self._buffers.values()):
+            for archive_file in list(self._buffers):
+                lines = self._buffers[archive_file]
+                if not lines:
+                    continue
+                self._buffers[archive_file] = []
+                self._flush_file(archive_file, lines, fsync)
+
+    def discard(self):
+        """
+        丢弃缓冲区中尚未写入文件的行
+        """
+        count = sum(len(lines) for lines in self._buffers.values())
+        if count:
+            Logger.warning(f"丢弃未写入归档文件的数据：共 {count} 行")
+        self._buffers.clear()
+
+    def begin(self):
+        """
+        开始一个事务：之后写入的内容可以通过 rollback() 撤销
+        """
+        self.flush(fsync=False)
+        self._marks = {}
+
+    def commit(self):
+        """
+        结束事务，之后写入的内容不再可以撤销
+        """
+        self._marks = None
+
+    def rollback(self):
+        """
+        撤销事务开始后写入的内容：丢弃缓冲区，已写入的文件截断到事务开始前的大小
+        """
+        self.discard()
+        marks, self._marks = self._marks or {}, None
+        for archive_file, size in marks.items():
+            f = self._open(archive_file)
+            f.truncate(size)
+            f.flush()
+            self._sizes[archive_file] = size
+            Logger.warning(f"归档文件已回滚到 {size} 字节：{archive_file}")
+
+    def close(self):
+        """
+        刷盘并关闭所有文件句柄
+        """
+        try:
+            self.flush()
+        finally:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    def _flush_file(self, archive_file: str, lines: list, fsync: bool):
+        start = self._size(archive_file)
+        if self._marks is not None:
+            self._marks.setdefault(archive_file, start)
+        data = b"".join(line for line, _ in lines)
+        if is_compressed(archive_file):
+            data = gzip.compress(data)
+        f = self._open(archive_file)
+        f.write(data)
+        f.flush()
+        if fsync and archive_file not in self._no_fsync:
+            os.fsync(f.fileno())
+        end = start + len(data)
+        self._sizes[archive_file] = end
+
+        offset = start
+        for line_no, (line, on_flush) in enumerate(lines):
+            if on_flush is not None:
+                if is_compressed(archive_file):
+                    on_flush((start, line_no), end)
+                else:
+                    on_flush(offset, end)
+            offset += len(line)
+
+    def _size(self, archive_file: str) -> int:
+        size = self._sizes.get(archive_file)
+        if size is None:
+            size = 0
+            if os.path.exists(archive_file):
+                size = os.path.getsize(archive_file)
+            self._sizes[archive_file] = size
+        return size
+
+    def _open(self, archive_file: str):
+        f = self._files.get(archive_file)
+        if f is None:
+            # 以二进制追加，确保记录的字节偏移与文件一致
+            f = open(archive_file, "ab")
+            self._files[archive_file] = f
+        return f
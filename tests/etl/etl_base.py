@@ -1,19 +1,49 @@
 import enum
+import functools
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
-import shutil
+import sys
+import threading
 import time
 import traceback
 import unittest
+import zipfile
+from contextlib import contextmanager
 from datetime import datetime
-from itertools import chain
+from queue import Empty, Full, Queue
 
 import oss2
-from django.db import models
-from django.db.models import Max
+from django.db import connections, models, transaction
+from django.db.models import ExpressionWrapper, Max, Prefetch, Value
+from django.db.models.sql import UpdateQuery
+
+try:
+    import numpy
+except ImportError:  # 可选依赖，rule_columns 使用 NumPy 数组时需要安装
+    numpy = None
 
 import config
 from tests.etl import Logger
+from tests.etl.archive_index import (
+    ArchiveIndex,
+    archive_encoding,
+    is_compressed,
+    open_archive,
+    split_archive_name,
+)
+from tests.etl.archive_uploader import ArchiveUploader, OssTransport
+from tests.etl.archive_writer import ArchiveWriter
+from tests.etl.field_tracer import FieldTracer
+from tests.etl.page_profiler import MODES as PROFILE_MODES
+from tests.etl.page_profiler import PageProfiler
+from tests.etl.page_tuner import PageSizeTuner
+from tests.etl.query_counter import QueryCounter
+from tests.etl.run_metrics import RunMetrics
+from tests.etl.snapshot import ModelSnapshot
+from tests.etl.throttle import ThrottleController
 
 """
 Tip:
@@ -21,11 +51,6 @@ Tip:
 """
 
 
-# ETL(Extract-Transform-Load) 即抽取-转换-加载队列数量 todo 一期仅用单线程，未来再用队列异步提交
-# extract_queue = Queue(100)
-# transform_queue = Queue(100)
-# load_queue = Queue(100)
-
 auth = oss2.Auth(config.OssConfig.access_id, config.OssConfig.access_key)
 # bucket = oss2.Bucket(auth, "http://oss-cn-hangzhou.aliyuncs.com", "xyi-mobile")
 bucket = oss2.Bucket(
@@ -33,17 +58,59 @@ bucket = oss2.Bucket(
 )
 
 
+def _queue_put(queue: Queue, item, stop: threading.Event) -> bool:
+    """
+    放入队列，队列已满时等待，直到放入成功或者流水线停止
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _queue_get(queue: Queue, stop: threading.Event):
+    """
+    从队列取出，队列为空时等待，流水线停止后返回 None
+    """
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            continue
+    return None
+
+
 def to_origin_dict(obj: models.Model) -> dict:
     """
     orm 对象转为完整的字典，临时 提供给未实现软删除的类使用，未来所有表都继承了 SoftDeleteBaseModel 后，这里将删除。
     """
-    opts = obj._meta
-    data = {}
-    for f in chain(opts.concrete_fields, opts.private_fields):
-        data[f.name] = f.value_from_object(obj)
-    for f in opts.many_to_many:
-        data[f.name] = [i.id for i in f.value_from_object(obj)]
-    return data
+    # 多对多字段查询时通过 m2m_prefetches() 预加载的，直接读取缓存，不再查询
+    snapshot = ModelSnapshot.of(obj.__class__)
+    return snapshot.to_dict(snapshot.capture(obj))
+
+
+def m2m_prefetches(queryset: models.QuerySet, names: tuple = None) -> models.QuerySet:
+    """
+    预加载多对多字段，一页数据每个多对多字段只查询一次，供 to_origin_dict 使用
+    预加载完整的关联对象：清洗规则与快照读取同一个预加载缓存，只加载主键时，规则读取关联对象的其他字段会逐个查询。
+    已通过 prefetch_related 预加载的字段保持不变。
+    :param names: 需要预加载的多对多字段名，None 表示所有多对多字段
+    """
+    seen = {
+        lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+        for lookup in queryset._prefetch_related_lookups
+    }
+    prefetches = [
+        f.name
+        for f in queryset.model._meta.many_to_many
+        if f.name not in seen and (names is None or f.name in names)
+    ]
+    if not prefetches:
+        return queryset
+    return queryset.prefetch_related(*prefetches)
 
 
 class ArchiveSceneEnum(enum.Enum):
@@ -63,8 +130,8 @@ class ETLBase(unittest.TestCase):
     变更历史归档：只记录变更的字段在清洗前后的值。
     归档数据恢复：基于原始数据或者变更历史将数据重写都数据库。
     归档文件上传：清洗完成或者恢复完成后，将归档文件打包上传到 OSS 中。
-    批量提交： todo：
-    队列 + 多线程异步清洗： todo
+    批量提交：如果 bulk_update_mode 属性值为 True，每页变更的记录只按变更的字段执行一次 bulk_update。
+    队列 + 多线程异步清洗：如果 pipeline_mode 属性值为 True，抽取、转换、加载三个阶段由多个线程通过队列并行处理。
     预检查模式：如果 pre_check_mode 属性值为 True，则只运行清洗过程，但不提交到数据库，以便于提前找出脏数据或者清洗规则的错误。
     """
 
@@ -72,13 +139,60 @@ class ETLBase(unittest.TestCase):
     archive_dir = None  # 必填，归档目录，不同的清洗任务，请放在不同的目录
     pre_check_mode = False  # 可选，是否为预检查模式 (只在本地验证清洗逻辑，不提交到数据库)
     page_size = 100  # 可选，分页尺寸
-
-    # worker: int  # 多线程数量 todo 一期仅用单线程
+    fields = None  # 可选，清洗规则使用的字段，查询和对比只加载这些字段 (主键和 auto_now 字段自动加入)，默认为所有字段
+    archive_full_row = True  # 可选，设置 fields 后，__origin.txt 等是否仍记录完整数据 (每页额外查询一次完整数据)
+    trace_fields = False  # 可选，自动识别清洗规则写入的字段，预热后只对比这些字段，逐条提交时只更新变更的字段
+    trace_warmup = 100  # 可选，自动识别写入字段的预热记录数，预热期间仍对比所有字段
+    rule_mode = "record"  # 可选，清洗规则的调用方式：record 逐条调用 rule()，batch 每页调用一次 rule_batch()，columns 每页调用一次 rule_columns()
+    pushdown_mode = False  # 可选，SQL 下推模式：按 pushdown_updates() 的表达式在数据库中分批执行 UPDATE，不再逐条调用 rule()
+    rule_columns_numpy = False  # 可选，rule_columns() 的列是否为 NumPy 数组 (需要安装 numpy)，默认为 list
+    adaptive_page_size = False  # 可选，自适应分页尺寸 (从 page_size 开始，根据每页耗时自动调整)
+    min_page_size = 10  # 可选，自适应分页尺寸的下限
+    max_page_size = 5000  # 可选，自适应分页尺寸的上限
+    target_page_seconds = 1.0  # 可选，自适应分页尺寸的目标每页耗时 (秒)
+    max_page_bytes = 32 * 1024 * 1024  # 可选，自适应分页尺寸时每页数据的大致上限 (字节)
+    bulk_update_mode = False  # 可选，批量提交模式 (每页变更的记录，按变更的字段执行一次 bulk_update)
+    commit_size = None  # 可选，每个事务提交的记录数，默认逐条提交时为 1，批量提交时为整页
+    change_field_index_sidecar = True  # 可选，是否将字段变更的去重索引持久化到 __change_field.idx 文件
+    pipeline_mode = False  # 可选，流水线模式 (抽取、转换、加载三个阶段多线程并行)
+    worker = 4  # 可选，流水线模式下，转换阶段的线程数量
+    queue_size = 10  # 可选，流水线模式下，阶段之间队列的长度 (页数)
+    shard_count = 1  # 可选，多进程分片数量，大于 1 时按 id 范围拆分分片，每个分片一个进程
+    resume_mode = False  # 可选，断点续跑模式 (从 __checkpoint.json 记录的位置继续清洗)
+    recover_chunk_size = 1000  # 可选，数据恢复时每批处理的归档数据条数
+    archive_offset_index = True  # 可选，写入归档时同步维护记录偏移索引 (*.offsets)，用于逆序恢复和按 id 查找
+    archive_format = "txt"  # 可选，归档文件格式，txt 为文本，gz 为 gzip 压缩 (每次刷盘写入一个独立的 gzip 块)
+    stream_upload = False  # 可选，清洗期间由后台线程分片上传归档文件，不再打包 zip (需开启 OssConfig.auto_upload_oss)
+    upload_part_size = 10 * 1024 * 1024  # 可选，后台分片上传的分片大小 (字节)，OSS 要求不小于 100KB
+    upload_transport = None  # 可选，归档上传方式，默认上传到 OSS，可替换为 LocalTransport(本地目录) 用于测试
+    metrics_report = True  # 可选，是否输出运行指标报告 (__metrics_*.json、__metrics_*.prom)：各阶段耗时、吞吐量和预计剩余时间
+    metrics_interval = 5.0  # 可选，运行指标报告的刷新间隔 (秒)
+    max_queries_per_page = None  # 可选，每页 SQL 查询数的上限，超出时预检查模式下报错停止，正式运行时输出警告
+    profile_mode = None  # 可选，按页的性能剖析：cprofile 使用 cProfile，sample 为低开销的采样剖析，结果写入归档目录 (__profile_page*.prof / .collapsed)，默认不开启
+    profile_every = 10  # 可选，性能剖析时每隔多少页剖析一页 (从第 1 页开始)
+    profile_window = None  # 可选，性能剖析的时间窗口 (开始秒数, 结束秒数)，相对于清洗开始的时间，设置后剖析窗口内开始的所有页，不再按 profile_every 选取
+    profile_interval = 0.005  # 可选，采样剖析的采样间隔 (秒)
+    throttle_write_seconds = None  # 可选，限流：每页写入数据库耗时的目标 (秒)，超出时增加页间暂停 (或缩小分页尺寸)，低于目标的一半时逐步恢复
+    throttle_page_size = False  # 可选，限流时优先缩小分页尺寸 (不低于 min_page_size)，已是最小分页尺寸时再增加页间暂停
+    throttle_max_pause = 30.0  # 可选，限流时页间暂停的上限 (秒)
+    replica_lag_probe = None  # 可选，主从延迟探针，返回延迟秒数的可调用对象 (探针实例或方法)，如 MySQLReplicaLag("replica")、PostgreSQLReplicaLag()
+    max_replica_lag = 5.0  # 可选，主从延迟的上限 (秒)，超出时增加页间暂停，并暂停清洗直到延迟恢复
+    replica_lag_interval = 5.0  # 可选，检查主从延迟的最小间隔 (秒)
+    max_replica_lag_wait = 600.0  # 可选，主从延迟超过上限时暂停清洗的最长时间 (秒)，超出时报错停止 (可以断点续跑)，None 表示一直等待
+    max_rows_per_second = None  # 可选，每秒处理记录数的上限，多进程分片时为所有分片的总和
+    max_queries_per_second = None  # 可选，每秒 SQL 查询数的上限，多进程分片时为所有分片的总和
+    read_alias = None  # 可选，查询使用的数据库别名 (如从库 "replica")：统计 id 范围和数据量、分页查询、恢复时查询记录，默认与 write_alias 相同
+    write_alias = "default"  # 可选，提交使用的数据库别名 (主库)：事务、save()、bulk_update 和 SQL 下推；与 read_alias 不同时，提交前在主库上校验记录
 
     def __init__(self, *args, **kwargs):
         super(ETLBase, self).__init__(*args, **kwargs)
         self.database = config.DBConfig.database  # 为了避免传输错误，不从外部传入，而是直接读配置
         self._check_config()
+        # 查询和提交使用的数据库，从从库查询时，提交前在主库上重新读取将要变更的记录
+        self._read_alias = self.read_alias or self.write_alias
+        self._verify_reads = self._read_alias != self.write_alias
+        # 本次运行中未在主库上校验的记录数 (从库上清洗后没有变更)，参照 _verify_on_primary()
+        self._unverified_count = 0
         self.table_name = self.target_model._meta.db_table  # Meta 中定义的 db_table
 
         # 归档路径创建
@@ -87,19 +201,76 @@ class ETLBase(unittest.TestCase):
         )
         self._archive_dir_init()
 
+        # 归档文件后缀
+        ext = ".txt.gz" if self.archive_format == "gz" else ".txt"
         # 清洗前 原始数据
         self.origin_file = (
-            f"{self.database_archive_dir}/{self.database}@{self.table_name}__origin.txt"
+            f"{self.database_archive_dir}/{self.database}@{self.table_name}__origin{ext}"
         )
         # 清洗时 字段变更
-        self.change_field_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__change_field.txt"
+        self.change_field_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__change_field{ext}"
         # 清洗后 完整数据变更
-        self.changed_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__changed.txt"
+        self.changed_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__changed{ext}"
         # 恢复后 完整数据变更
-        self.recovered_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__recovered.txt"
+        self.recovered_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__recovered{ext}"
+        # 清洗进度断点，每页提交后更新
+        self.checkpoint_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__checkpoint.json"
+        # 字段变更去重索引，每行为 "摘要 归档文件大小"，用于重复运行时快速加载
+        self.change_field_index_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__change_field.idx"
+        # 字段变更去重索引 (内存)，首次写入字段变更时加载
+        self._change_field_index = None
+        self._change_field_size = 0
+        # 归档写入器，运行期间持有归档文件句柄
+        self._archive_writer = None
+        # 归档文件的记录偏移索引，归档文件路径 -> ArchiveIndex
+        self._offset_indexes = {}
+        # 本次归档会话中已校验过偏移索引的归档文件
+        self._indexed_files = set()
+        # 当前进程的分片序号，None 表示主进程
+        self._shard_index = None
+        # 归档文件上传进度清单，记录分片上传的 upload_id 和已上传的分片
+        self.upload_manifest_file = f"{self.database_archive_dir}/{self.database}@{self.table_name}__upload.json"
+        # 归档文件后台上传器，stream_upload 开启时创建
+        self._archive_uploader = None
+        # 运行指标报告前缀，按场景区分，如 __metrics_data_fix.json (JSON 格式)、__metrics_data_fix.prom (Prometheus textfile 格式)
+        self.metrics_file_prefix = f"{self.database_archive_dir}/{self.database}@{self.table_name}__metrics"
+        # 本次运行的指标，start() 和恢复方法中创建
+        self._metrics = None
+        # SQL 查询计数，按页和来源 (框架、清洗规则) 统计
+        self._query_counter = QueryCounter()
+        self._query_warned = set()  # 已输出过的查询数警告，每次运行只提示一次
+        # 性能剖析结果前缀，如 __profile_page1_1-100.prof，分片进程为 __profile.shard000_page1_1-100.prof
+        self.profile_file_prefix = f"{self.database_archive_dir}/{self.database}@{self.table_name}__profile"
+        # 按页的性能剖析器，profile_mode 开启时 start() 中创建
+        self._profiler = None
+        # 限流控制器，设置限流参数时 start() 和恢复方法中创建
+        self._throttle = None
+        self._write_seconds = 0  # 当前页写入数据库的耗时
+        # 包含所有字段的快照器，归档字段变更时校验字段名和是否允许为空
+        self._model_snapshot = ModelSnapshot.of(self.target_model)
+        # 查询和对比的字段，None 表示所有字段
+        self._fields = self._projection_fields()
+        # 设置 fields 时，未查询的字段 (字段名, 属性名)
+        self._deferred_fields = ()
+        if self._fields is not None:
+            self._deferred_fields = tuple(
+                (f.name, f.attname)
+                for f in self.target_model._meta.concrete_fields
+                if f.name not in self._fields
+            )
+        # 清洗规则写入字段的追踪器，trace_fields 开启时创建
+        self._field_tracer = None
+        if self.trace_fields:
+            self._field_tracer = FieldTracer(self.target_model, self._fields, self.trace_warmup)
+        # 当前的分页尺寸，自适应分页尺寸时由 _page_tuner 调整
+        self._page_size = self.page_size
+        self._page_tuner = None
+        self._page_started = None  # 当前页的开始时间
+        self._page_bytes = 0  # 当前页原始数据的大致大小
+        self._fetch_seconds = 0  # 当前页的查询耗时
 
         Logger.info(
-            f"归档路径: {self.database_archive_dir}/{self.database}@{self.table_name}__*.txt"
+            f"归档路径: {self.database_archive_dir}/{self.database}@{self.table_name}__*{ext}"
         )
 
     def filter(self) -> models.QuerySet:
@@ -116,114 +287,1386 @@ class ETLBase(unittest.TestCase):
         清洗的变更自动记录到 __change_field.txt 文件
         清洗后的完整数据自动记录到 __changed.txt 文件
         """
-        raise NotImplemented(f"尚未实现清洗规则")
+        raise NotImplementedError(f"尚未实现清洗规则")
+
+    def rule_batch(self, records: list):
+        """
+        批量清洗规则，rule_mode = "batch" 时每页调用一次，子类直接修改 records 中的记录即可，无需执行 save()
+        适用于每页只需查询一次的关联数据、字典等。
+        :param records: 本页待清洗的记录
+        """
+        raise NotImplementedError(f"尚未实现批量清洗规则")
+
+    def rule_columns(self, columns: dict):
+        """
+        按列清洗规则，rule_mode = "columns" 时每页调用一次，适用于字符串、数值的向量化处理
+        :param columns: 字段名 -> 本页所有记录的字段值 (list，rule_columns_numpy 为 True 时为 NumPy 数组)，与记录的顺序一致
+        :return: 变更的列 {字段名: 新的字段值}，也可以直接修改 columns 后返回 None
+
+        变更的值会写回对应的记录，之后与逐条清洗一样归档和提交。
+        """
+        raise NotImplementedError(f"尚未实现按列清洗规则")
+
+    def pushdown_updates(self) -> dict:
+        """
+        SQL 下推的清洗规则，pushdown_mode = True 时使用，只适用于可以用 SQL 表达式完成的清洗
+        :return: {字段名: 新的值或表达式}，如 {"name": Concat("name", Value("_bak")), "remark": None}
+        """
+        raise NotImplementedError(f"尚未实现 SQL 下推的清洗规则")
+
+    def _apply_rule_batch(self, records: list):
+        """
+        调用批量清洗规则或按列清洗规则，规则直接修改 records 中的记录
+        """
+        if self.rule_mode == "batch":
+            self.rule_batch(records)
+            return
+
+        opts = self.target_model._meta
+        attnames = {
+            f.name: f.attname
+            for f in opts.concrete_fields
+            if self._fields is None or f.name in self._fields
+        }
+        origin_columns = {
+            name: [getattr(record, attname) for record in records]
+            for name, attname in attnames.items()
+        }
+        columns = {}
+        for name, values in origin_columns.items():
+            if self.rule_columns_numpy:
+                if numpy is None:
+                    raise Exception(f"rule_columns_numpy 需要安装 numpy")
+                column = None
+                try:
+                    column = numpy.array(values)
+                except ValueError:
+                    pass
+                if (
+                    column is not None
+                    and column.dtype.kind in "US"
+                    and len({type(value) for value in values}) > 1
+                ):
+                    # 字符串与其他类型混合时，numpy 会把所有值转为字符串 (如 1 -> "1")
+                    column = None
+                if column is None or column.ndim != 1:
+                    # 列表、字典等字段值或混合类型，保持为一维的 object 数组
+                    column = numpy.empty(len(values), dtype=object)
+                    column[:] = values
+                columns[name] = column
+            else:
+                columns[name] = list(values)
+
+        changed_columns = self.rule_columns(columns)
+        if changed_columns is None:
+            changed_columns = columns
+
+        for name, values in changed_columns.items():
+            if name not in origin_columns:
+                raise Exception(f"rule_columns 返回的列 {name} 不是 {self.table_name} 的字段。")
+            if numpy is not None and isinstance(values, numpy.ndarray):
+                # NumPy 类型转为 Python 类型，避免数据库驱动无法识别
+                values = values.tolist()
+            if len(values) != len(records):
+                raise Exception(f"rule_columns 返回的列 {name} 长度 {len(values)} 与记录数 {len(records)} 不一致。")
+            for record, origin_value, value in zip(records, origin_columns[name], values):
+                if value != origin_value:
+                    if name == opts.pk.name:
+                        raise Exception(f"rule_columns 不能修改主键 {name}。")
+                    setattr(record, attnames[name], value)
+
+    def _apply_rule(self, record: models.Model) -> models.Model:
+        """
+        调用清洗规则，并校验规则返回的记录
+        """
+        _record = self.rule(record)
+        if not _record:
+            return record
+        if not isinstance(_record, self.target_model):
+            raise Exception(
+                f"返回的记录类型 {type(_record)} 与模型属性 {type(self.target_model)} 不一致。"
+            )
+        if _record.id != record.id:
+            raise Exception(f"返回的记录 id 与输入记录 id 不一致。")
+        return _record
+
+    def _diff_record(
+        self,
+        record: models.Model,
+        origin_values: tuple,
+        changed_values: tuple,
+        snapshot: ModelSnapshot = None,
+    ) -> list:
+        """
+        对比清洗前后的快照，参照 ModelSnapshot.capture()
+        :param snapshot: 生成快照的快照器，默认为 _snapshot()
+        :return: 发生变更的字段名列表
+        """
+        snapshot = snapshot or self._snapshot()
+        changed_fields = []
+        for i in snapshot.diff(origin_values, changed_values):
+            field_name = snapshot.names[i]
+            if i in snapshot.auto_now_indexes:
+                raise Exception(
+                    f"请勿在规则方法中主动调用 save() 方法，因为 ETL 父类会统一处理提交，目前 {field_name} 已发生变化，可能会存在重复提交，影响效率。"
+                )
+            changed_fields.append(field_name)
+        return changed_fields
+
+    def _bulk_commit(self, items: list):
+        """
+        批量提交一页变更的记录，只更新实际变更过的字段
+        :param items: [(记录, 清洗前的完整数据, 变更的字段), ...]
+        """
+        if not items:
+            return
+        records = [item[0] for item in items]
+        update_fields = set()
+        for _, _, changed_fields in items:
+            update_fields.update(changed_fields)
+        self._bulk_update(records, update_fields)
+
+        for record, origin_data, _ in items:
+            # 保存记录数据变更，此时 auto now 字段已是实际写入的值
+            self._save_changed(record, origin_data, self._changed_dict(record, origin_data))
+        items.clear()
+
+    def _bulk_update(self, records: list, update_fields: set):
+        """
+        批量更新记录的指定字段，auto_now 字段与 save() 一样自动刷新
+        """
+        snapshot = ModelSnapshot.of(self.target_model)
+        # 多对多字段不在本表中，bulk_update 无法更新
+        update_fields = {name for name in update_fields if name in snapshot.concrete_names}
+        if not records or not update_fields:
+            return
+
+        # bulk_update 不会触发 auto_now，这里与 save() 保持一致，手动刷新 auto_now 字段
+        auto_now_fields = snapshot.auto_now_fields
+        for record in records:
+            for f in auto_now_fields:
+                f.pre_save(record, False)
+        update_fields.update(f.name for f in auto_now_fields)
+
+        # 在 _archive_transaction() 中调用，事务提交前归档刷盘
+        with self._timed("db_write"):
+            self.target_model.objects.using(self.write_alias).bulk_update(
+                records, fields=sorted(update_fields)
+            )
 
     def start(self, min_id: int = 1, max_id: int = None):
         """
         启动数据订正/清洗
         """
-        _max_id = self.target_model.objects.aggregate(Max("id"))["id__max"]
-        if max_id is None:
-            max_id = _max_id
-        if max_id > _max_id:
-            max_id = _max_id
-
-        if min_id > max_id:
-            raise Exception(f"记录 id 范围错误，min_id: {min_id} 应小于 max_id: {max_id}")
         if self.page_size < 1:
             raise Exception(f"page_size 不能小于 1。")
 
+        progress = self._load_checkpoint() if self.resume_mode else None
+        if progress is not None:
+            requested = progress.get("requested") or [progress["min_id"], progress["max_id"]]
+            if requested != [min_id, max_id]:
+                if not progress["finished"]:
+                    raise Exception(
+                        f"断点记录的 id 范围 {requested} 与本次传入的 [{min_id}, {max_id}] 不一致，"
+                        f"继续上次的清洗请传入相同的参数，重新清洗请删除断点文件：{self.checkpoint_file}"
+                    )
+                Logger.warning(
+                    f"断点记录的 id 范围 {requested} 已清洗完成，本次 id 范围 [{min_id}, {max_id}] 不同，重新开始清洗"
+                )
+                progress = None
+        if progress is not None:
+            # 断点续跑，无需重新统计 id 范围和数据量
+            if progress["finished"]:
+                Logger.info(f"断点记录显示清洗已完成，无需继续：{self.checkpoint_file}")
+                return
+            Logger.info(
+                f"从断点继续清洗 {self.database}@{self.table_name}.id 范围：[{progress['next_id']}, {progress['max_id']}]，已清洗 {progress['data_count']} 条记录"
+            )
+        else:
+            requested = [min_id, max_id]
+            _max_id = self.target_model.objects.using(self._read_alias).aggregate(Max("id"))[
+                "id__max"
+            ]
+            if max_id is None:
+                max_id = _max_id
+            if max_id > _max_id:
+                max_id = _max_id
+
+            if min_id > max_id:
+                raise Exception(f"记录 id 范围错误，min_id: {min_id} 应小于 max_id: {max_id}")
+
+            Logger.info(
+                f"数据清洗 {self.database}@{self.table_name}.id 范围：[{min_id}, {max_id}]"
+            )
+
+            waiting_count = (
+                self.filter().using(self._read_alias).filter(id__gte=min_id, id__lte=max_id).count()
+            )
+            Logger.info(f"符合条件，即将清洗的数据有：{waiting_count} 条")
+
+            progress = self._new_progress(min_id, max_id, waiting_count)
+            # 传入的参数，续跑时与本次传入的参数对比
+            progress["requested"] = requested
+            self._save_checkpoint(progress)
+
+        self._start_metrics(ArchiveSceneEnum.data_fix.value, progress["waiting_count"])
+        self._start_profiler()
+        self._start_throttle(adjust_page_size=self.throttle_page_size)
+        self._start_stream_upload(ArchiveSceneEnum.data_fix.value)
+        if self.adaptive_page_size:
+            # 断点续跑时从上次调整后的分页尺寸开始
+            self._page_tuner = PageSizeTuner(
+                progress.get("page_size") or self.page_size,
+                self.min_page_size,
+                self.max_page_size,
+                self.target_page_seconds,
+                self.max_page_bytes,
+            )
+            self._page_size = self._page_tuner.page_size
+        self._page_started = time.time()
+        self._unverified_count = 0
+        try:
+            if self.shard_count > 1:
+                finished = self._clean_shards(progress)
+            else:
+                with self._archive_session():
+                    finished = self._clean_pages(progress)
+                self._report_unverified()
+        except Exception:
+            # 异常退出时也输出运行指标报告，便于排查
+            self._stop_stream_upload()
+            self._finish_metrics(finished=False)
+            raise
+        if not finished:
+            self._stop_stream_upload()
+            self._finish_metrics(finished=False)
+            return
+        progress["finished"] = True
+        self._save_checkpoint(progress)
+
+        data_count = progress["data_count"]
+        Logger.info(f"清洗完成：共 {data_count} 条记录")
+        if self._page_tuner is not None and self.shard_count <= 1:
+            Logger.info(f"自适应分页尺寸最终为 {self._page_size}，后续运行可以设置 page_size = {self._page_size}")
+        if self.pre_check_mode:
+            Logger.warning(f"预检模式已开启，未提交数据。")
+        if data_count > 0:
+            # 归档文件上传到 oss
+            self._archive_to_oss(ArchiveSceneEnum.data_fix.value)
+        self._stop_stream_upload()
+        self._finish_metrics()
+
+    def _new_progress(self, min_id: int, max_id: int, waiting_count: int = None) -> dict:
+        """
+        清洗进度，每页提交后写入断点文件
+        """
+        return dict(
+            database=self.database,
+            table_name=self.table_name,
+            min_id=min_id,
+            max_id=max_id,
+            waiting_count=waiting_count,
+            next_id=min_id,  # 下一条待清洗的 id，之前的记录均已提交
+            page_no=0,  # 已提交的页数
+            scanned_count=0,  # 已扫描的记录数
+            data_count=0,  # 已清洗的记录数
+            finished=False,
+        )
+
+    def _load_checkpoint(self) -> dict:
+        """
+        读取断点文件，文件不存在时返回 None
+        """
+        if not os.path.exists(self.checkpoint_file):
+            return None
+        with open(self.checkpoint_file, "r") as f:
+            progress = json.load(f)
+        if progress["database"] != self.database:
+            raise Exception(f"断点文件的数据库 {progress['database']} 与配置 {self.database}不匹配")
+        if progress["table_name"] != self.table_name:
+            raise Exception(
+                f"断点文件的表名 {progress['table_name']} 与配置 {self.table_name}不匹配"
+            )
+        return progress
+
+    def _save_checkpoint(self, progress: dict, fsync: bool = True):
+        """
+        写入断点文件，先写临时文件再替换，避免中断时断点文件损坏
+        :param fsync: 是否同步到磁盘，为 False 时进程退出不影响断点，机器宕机时可能回退到上一次同步的断点
+        """
+        if self.pre_check_mode:
+            return
+        progress["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(progress, f, ensure_ascii=False)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _commit_progress(
+        self, progress: dict, records: list, data_count: int, failed_id: int
+    ):
+        """
+        一页提交后更新清洗进度并写入断点文件
+        :param records: 本页查询的记录
+        :param data_count: 本页清洗的记录数
+        :param failed_id: 本页异常记录的 id，None 表示本页全部提交
+        """
+        progress["page_no"] += 1
+        progress["data_count"] += data_count
+        if failed_id is None:
+            progress["next_id"] = records[-1].id + 1
+            progress["scanned_count"] += len(records)
+        else:
+            # 异常记录及之后的记录尚未提交，续跑时从异常记录开始
+            progress["next_id"] = failed_id
+            progress["scanned_count"] += len([r for r in records if r.id < failed_id])
+        if self._page_tuner is not None:
+            now = time.time()
+            self._page_size = self._page_tuner.update(
+                len(records), now - self._page_started, self._page_bytes, self._fetch_seconds
+            )
+            progress["page_size"] = self._page_size
+            self._page_started = now
+        self._page_bytes = 0
+        write_seconds, self._write_seconds = self._write_seconds, 0
+        self._save_checkpoint(progress)
+        if self._archive_uploader is not None:
+            # 已写满的分片交给后台线程上传
+            try:
+                self._archive_uploader.poll()
+            except Exception as e:
+                # 上传失败不影响清洗，结束时根据上传清单从已上传的位置继续
+                Logger.warning(f"归档文件后台上传已停止: {e}")
+                self._stop_stream_upload()
+        if records:
+            queries = self._query_counter.pop(records[0].id)
+            if failed_id is None:
+                self._throttle_page(len(records), queries, write_seconds)
+            if self._metrics is not None:
+                self._metrics.page_done(
+                    len(records),
+                    data_count,
+                    scanned=progress["scanned_count"],
+                    queries=queries,
+                    min_id=records[0].id,
+                    max_id=records[-1].id,
+                )
+            self._check_queries(
+                queries,
+                len(records),
+                f"第 {progress['page_no']} 页 (id 范围 [{records[0].id}, {records[-1].id}])",
+            )
+
+    def _clean_shards(self, progress: dict) -> bool:
+        """
+        多进程分片清洗：将 id 范围拆分为 shard_count 个分片，每个分片一个进程，
+        分片进程写入各自的分片归档文件和断点文件，全部结束后按分片顺序合并到归档文件。
+        :return: 是否全部清洗完成
+        """
+        ranges = progress.get("shards")
+        if not ranges:
+            ranges = self._shard_ranges(progress["min_id"], progress["max_id"])
+            progress["shards"] = ranges
+            self._save_checkpoint(progress)
+        Logger.info(f"多进程分片清洗：共 {len(ranges)} 个分片 {ranges}")
+
+        # 字段变更去重索引在主进程加载，子进程直接继承
+        self._load_change_field_index()
+        results = self._run_shards(
+            self._clean_shard,
+            ranges,
+            ("origin_file", "change_field_file", "changed_file", "checkpoint_file"),
+        )
+        self._merge_shard_archives()
+
+        progress["data_count"] = 0
+        finished = True
+        for index, result in enumerate(results):
+            if result is None:
+                Logger.warning(f"分片 {index} {ranges[index]} 异常退出，请检查日志。")
+                finished = False
+                continue
+            progress["data_count"] += result["data_count"]
+            if not result["finished"]:
+                finished = False
+        self._save_checkpoint(progress)
+        return finished
+
+    def _clean_shard(self, min_id: int, max_id: int) -> dict:
+        """
+        分片进程：清洗 [min_id, max_id] 范围内的数据
+        """
+        progress = self._load_checkpoint() if self.resume_mode else None
+        if progress is None:
+            progress = self._new_progress(min_id, max_id)
+            self._save_checkpoint(progress)
+        if progress["finished"]:
+            Logger.info(f"分片 {self._shard_index} 已清洗完成，跳过")
+            return dict(data_count=progress["data_count"], finished=True)
+
         Logger.info(
-            f"数据清洗 {self.database}@{self.table_name}.id 范围：[{min_id}, {max_id}]"
+            f"分片 {self._shard_index} 开始清洗，id 范围：[{progress['next_id']}, {max_id}]"
         )
+        self._page_started = time.time()
+        with self._archive_session():
+            finished = self._clean_pages(progress)
+        self._report_unverified()
+        if finished:
+            progress["finished"] = True
+            self._save_checkpoint(progress)
+        return dict(data_count=progress["data_count"], finished=finished)
+
+    def _shard_ranges(self, min_id: int, max_id: int) -> list:
+        """
+        将 id 范围平均拆分为 shard_count 个分片
+        :return: [(min_id, max_id), ...]
+        """
+        total = max_id - min_id + 1
+        count = min(self.shard_count, total)
+        step = (total + count - 1) // count
+        return [
+            (lo, min(lo + step - 1, max_id)) for lo in range(min_id, max_id + 1, step)
+        ]
+
+    def _run_shards(self, target, shard_args: list, archive_attrs: tuple) -> list:
+        """
+        多进程运行分片任务，每个分片一个进程
+        :param target: 分片任务，在子进程中以 target(*args) 调用，返回结果字典
+        :param shard_args: 每个分片的参数
+        :param archive_attrs: 子进程需要写入的归档文件属性名，子进程中切换为分片归档文件
+        :return: 各分片的结果，按分片顺序排列，异常退出的分片结果为 None
+        """
+        # fork 只复制当前线程，其他线程持有的锁在子进程中永远不会释放，子进程可能死锁
+        threads = [
+            thread.name
+            for thread in threading.enumerate()
+            if thread is not threading.current_thread() and thread.is_alive()
+        ]
+        if threads:
+            raise Exception(f"存在运行中的线程 {threads}，fork 子进程不安全，无法多进程分片，请先停止这些线程或设置 shard_count = 1")
+        ctx = multiprocessing.get_context("fork")
+        result_queue = ctx.Queue()
+        # 关闭当前进程的数据库连接，子进程各自重新建立连接，避免共用连接
+        connections.close_all()
+
+        processes = []
+        for index, args in enumerate(shard_args):
+            process = ctx.Process(
+                target=self._shard_main,
+                args=(target, index, args, archive_attrs, result_queue),
+                name=f"etl-shard-{index}",
+            )
+            process.start()
+            processes.append(process)
 
-        waiting_count = self.filter().filter(id__gte=min_id, id__lte=max_id).count()
-        Logger.info(f"符合条件，即将清洗的数据有：{waiting_count} 条")
+        results = [None] * len(processes)
+        received = 0
+        while received < len(processes):
+            try:
+                index, result = result_queue.get(timeout=1)
+            except Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            results[index] = result
+            received += 1
+        for process in processes:
+            process.join()
+        if self._metrics is not None:
+            for result in results:
+                if result is not None and "metrics" in result:
+                    self._metrics.merge(result["metrics"])
+        return results
+
+    def _shard_main(
+        self, target, index: int, args: tuple, archive_attrs: tuple, result_queue
+    ):
+        """
+        分片子进程入口，切换到分片归档文件后运行分片任务
+        """
+        result = None
+        try:
+            self._use_shard(index, archive_attrs)
+            result = target(*args)
+            if self._metrics is not None:
+                # 分片的运行指标，由主进程汇总
+                result["metrics"] = self._metrics.report(finished=True)
+        except Exception as e:
+            traceback.print_exc()
+            Logger.warning(f"分片 {index} 异常：{e}")
+        finally:
+            connections.close_all()
+            result_queue.put((index, result))
 
-        # 分页查询，逐条清洗
-        data_count = 0
-        offset = min_id
+    def _use_shard(self, index: int, archive_attrs: tuple):
+        """
+        子进程切换到分片归档文件
+        """
+        self._shard_index = index
+        for attr in archive_attrs:
+            setattr(self, attr, self._shard_file(getattr(self, attr), index))
+        # 去重索引继承自主进程，合并分片归档时再写入索引文件
+        self.change_field_index_sidecar = False
+        # 分片归档文件不上传，合并后由主进程上传
+        self._archive_uploader = None
+        if self._metrics is not None:
+            # 分片进程单独统计，写入分片的指标报告
+            self._metrics = self._metrics.copy(
+                self._shard_file(self._metrics.report_file, index),
+                self._shard_file(self._metrics.prom_file, index),
+            )
+        if self._profiler is not None:
+            self._profiler.file_prefix = f"{self.profile_file_prefix}.shard{index:03d}"
+        if self._throttle is not None:
+            # 每秒记录数、查询数的上限由所有分片平分
+            self._throttle.share(1 / self.shard_count)
+
+    @staticmethod
+    def _shard_file(archive_file: str, index: int) -> str:
+        """
+        分片归档文件路径，如 db@table__origin.shard001.txt
+        """
+        base, ext = split_archive_name(archive_file)
+        return f"{base}.shard{index:03d}{ext}"
+
+    def _archive_files(self, archive_file: str) -> list:
+        """
+        归档文件及尚未合并的分片归档文件，按分片顺序排列
+        """
+        files = []
+        if os.path.exists(archive_file):
+            files.append(archive_file)
+        base, ext = split_archive_name(archive_file)
+        prefix = f"{os.path.basename(base)}.shard"
+        shard_files = [
+            name
+            for name in os.listdir(os.path.dirname(archive_file))
+            if name.startswith(prefix) and name.endswith(ext)
+        ]
+        for name in sorted(shard_files):
+            files.append(os.path.join(os.path.dirname(archive_file), name))
+        return files
+
+    def _merge_shard_archives(self):
+        """
+        按分片顺序将分片归档文件合并到归档文件，合并后删除分片归档文件
+        """
+        with self._archive_session():
+            for archive_file in (
+                self.origin_file,
+                self.change_field_file,
+                self.changed_file,
+                self.recovered_file,
+            ):
+                for shard_file in self._archive_files(archive_file):
+                    if shard_file == archive_file:
+                        continue
+                    with open_archive(shard_file) as f:
+                        for line in f:
+                            line = line.strip()
+                            if not line:
+                                continue
+                            record_id = ArchiveIndex.parse_record_id(line.encode())
+                            if archive_file == self.change_field_file:
+                                digest = self._line_digest(line)
+                                if digest in self._load_change_field_index():
+                                    continue
+                                self._append_archive_line(
+                                    archive_file,
+                                    record_id,
+                                    line,
+                                    on_flush=self._add_change_field_index(digest),
+                                )
+                            else:
+                                self._append_archive_line(archive_file, record_id, line)
+                    # 分片文件删除前，合并的内容先刷盘
+                    self._archive_flush()
+                    os.remove(shard_file)
+                    shard_index_file = ArchiveIndex(shard_file).index_file
+                    if os.path.exists(shard_index_file):
+                        os.remove(shard_index_file)
+                    Logger.info(f"分片归档文件已合并：{shard_file}")
+
+    def _clean_pages(self, progress: dict) -> bool:
+        """
+        分页查询，逐条清洗，每页提交后更新清洗进度
+        :param progress: 清洗进度，参照 _new_progress()
+        :return: 是否全部清洗完成
+        """
+        with self._query_counter.install():
+            if self.pushdown_mode:
+                return self._pushdown_pages(progress)
+            if self.pipeline_mode:
+                return self._pipeline_pages(progress)
+
+            max_id = progress["max_id"]
+            offset = progress["next_id"]
+
+            filters = self.filter().using(self._read_alias)
+            while True:
+                with self._profile_page(progress["page_no"] + 1) as page:
+                    records = self._fetch_page(filters, offset, max_id)
+                    if not records:
+                        break
+                    page["ids"] = (records[0].id, records[-1].id)
+                    offset = records[-1].id + 1
+
+                    items, error = self._transform_page(records)
+                    with self._query_counter.scope(page=records[0].id):
+                        data_count, failed_id = self._load_page(items, error, progress)
+                    self._commit_progress(progress, records, data_count, failed_id)
+                    if failed_id is not None:
+                        return False
+
+            return True
+
+    def _pipeline_pages(self, progress: dict) -> bool:
+        """
+        流水线模式分页清洗：
+        抽取：一个线程分页查询，放入 extract_queue
+        转换：worker 个线程从 extract_queue 中取出一页，执行清洗规则并对比差异，放入 load_queue
+        加载：当前线程按页码顺序从 load_queue 中取出，归档并提交
+        任一阶段出现异常，加载到异常记录之前的数据后，停止所有线程；
+        某一页未能交给加载阶段 (线程异常退出) 时，加载到该页之前的数据后抛出异常。
+        :param progress: 清洗进度，参照 _new_progress()
+        :return: 是否全部清洗完成
+        """
+        if self.worker < 1:
+            raise Exception(f"worker 不能小于 1。")
+        if self.queue_size < 1:
+            raise Exception(f"queue_size 不能小于 1。")
+
+        max_id = progress["max_id"]
+        first_page_no = progress["page_no"]  # 之前运行已提交的页数
+        extract_queue = Queue(self.queue_size)
+        load_queue = Queue(self.queue_size)
+        stop = threading.Event()
+        filters = self.filter().using(self._read_alias)
+        extracted = {}  # 抽取结束后记录总页数 (包括抽取异常的一页)，加载阶段据此检查是否有页丢失
+        failures = []  # 线程中未能作为一页交给加载阶段的异常
+
+        def extract():
+            page_no = 0
+            try:
+                offset = progress["next_id"]
+                while not stop.is_set():
+                    records = self._fetch_page(filters, offset, max_id)
+                    if not records:
+                        break
+                    offset = records[-1].id + 1
+                    if not _queue_put(extract_queue, (page_no, records, None), stop):
+                        return
+                    page_no += 1
+                extracted["pages"] = page_no
+            except Exception as e:
+                # 抽取异常，作为最后一页交给加载阶段抛出
+                extracted["pages"] = page_no + 1
+                _queue_put(extract_queue, (page_no, [], (None, e)), stop)
+            finally:
+                for _ in range(self.worker):
+                    if not _queue_put(extract_queue, None, stop):
+                        break
+                connections.close_all()
+
+        def transform():
+            try:
+                while not stop.is_set():
+                    task = _queue_get(extract_queue, stop)
+                    if task is None:
+                        break
+                    page_no, records, error = task
+                    items = []
+                    if error is None:
+                        try:
+                            # 流水线模式下只剖析转换阶段
+                            with self._profile_page(first_page_no + page_no + 1) as page:
+                                page["ids"] = (records[0].id, records[-1].id)
+                                items, error = self._transform_page(records)
+                        except Exception as e:
+                            # 逐条清洗之外的异常 (如查询完整数据)，整页交给加载阶段抛出
+                            items, error = [], (None, e)
+                    if not _queue_put(
+                        load_queue, (page_no, records, items, error), stop
+                    ):
+                        break
+            finally:
+                _queue_put(load_queue, None, stop)
+                connections.close_all()
+
+        def counted(target):
+            # 数据库连接是线程独立的，每个线程单独安装查询计数
+            def run():
+                try:
+                    with self._query_counter.install():
+                        target()
+                except Exception as e:
+                    traceback.print_exc()
+                    failures.append(e)
+
+            return run
+
+        threads = [
+            threading.Thread(target=counted(extract), name="etl-extract", daemon=True)
+        ]
+        for i in range(self.worker):
+            threads.append(
+                threading.Thread(
+                    target=counted(transform), name=f"etl-transform-{i}", daemon=True
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        pending = {}  # 页码 -> (本页记录, 清洗结果, 异常)，转换阶段乱序完成，按页码顺序加载
+        next_page_no = 0
+        done_workers = 0
+        try:
+            while done_workers < self.worker:
+                try:
+                    task = load_queue.get(timeout=0.1)
+                except Empty:
+                    if failures:
+                        raise failures[0]
+                    continue
+                if task is None:
+                    done_workers += 1
+                    continue
+                page_no, records, items, error = task
+                pending[page_no] = (records, items, error)
+                while next_page_no in pending:
+                    records, items, error = pending.pop(next_page_no)
+                    next_page_no += 1
+                    if error is not None and error[0] is None:
+                        raise error[1]
+                    with self._query_counter.scope(page=records[0].id):
+                        data_count, failed_id = self._load_page(items, error, progress)
+                    self._commit_progress(progress, records, data_count, failed_id)
+                    if failed_id is not None:
+                        return False
+            if failures:
+                raise failures[0]
+            if next_page_no != extracted.get("pages"):
+                raise Exception(
+                    f"流水线第 {first_page_no + next_page_no + 1} 页未能交给加载阶段，之后的数据未清洗，请检查日志。"
+                )
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        return True
 
-        filters = self.filter()
+    def _pushdown_pages(self, progress: dict) -> bool:
+        """
+        SQL 下推模式分页清洗：每页在一个事务中锁定并查询清洗前的数据，按 id 范围执行一次 UPDATE，
+        再获取清洗后的数据 (支持 UPDATE ... RETURNING 的数据库直接返回，否则重新查询)，归档格式与逐条清洗一致。
+        预检查模式下不执行 UPDATE，也不锁定记录，在 read_alias 上将表达式作为查询的注解计算清洗后的值。
+        :param progress: 清洗进度，参照 _new_progress()
+        :return: 是否全部清洗完成
+        """
+        updates = self.pushdown_updates()
+        opts = self.target_model._meta
+        for name in updates:
+            field = opts.get_field(name)
+            if not field.concrete or field.many_to_many or field.primary_key:
+                raise Exception(f"pushdown_updates 中的字段 {name} 不能通过 UPDATE 修改。")
+
+        max_id = progress["max_id"]
+        offset = progress["next_id"]
+        # 下推模式在主库上锁定并更新，预检查模式只查询
+        filters = self.filter().using(self._read_alias if self.pre_check_mode else self.write_alias)
         while True:
-            # 查询 page_size 条数据
-            # 按 id 排序，用切片查询确保每次都能拿到足量数据
-            # 记录最新的 id 偏移量继续用 page_size 进行切片分页。
-            records = filters.filter(id__gte=offset, id__lte=max_id).order_by("id")[
-                : self.page_size
-            ]
+            page = ("pushdown", offset)
+            try:
+                with self._query_counter.scope(page=page), self._profile_page(
+                    progress["page_no"] + 1
+                ) as profile:
+                    records, data_count = self._pushdown_page(filters, updates, offset, max_id)
+                    if records:
+                        profile["ids"] = (records[0].id, records[-1].id)
+            except Exception as e:
+                self._query_counter.pop(page)
+                traceback.print_exc()
+                Logger.warning(
+                    f"SQL 下推更新失败，已回滚，请检查 {self.database}@{self.table_name}.id 从 {offset} 开始的一页 异常信息：{e}"
+                )
+                self._commit_progress(progress, [], 0, offset)
+                return False
             if not records:
+                self._query_counter.pop(page)
                 break
+            self._query_counter.move(page, records[0].id)
+            offset = records[-1].id + 1
+            self._commit_progress(progress, records, data_count, None)
 
-            if not isinstance(records[0], self.target_model):
+        return True
+
+    def _pushdown_page(
+        self, filters: models.QuerySet, updates: dict, offset: int, max_id: int
+    ) -> (list, int):
+        """
+        SQL 下推更新一页数据
+        :return: (本页清洗前的记录, 发生变更的记录数)
+        """
+        model = self.target_model
+        with self._archive_transaction():
+            started = time.time()
+            queryset = filters.filter(id__gte=offset, id__lte=max_id).order_by("id")
+            if not self.pre_check_mode:
+                # 锁定本页记录，清洗前的数据与 UPDATE 之间不会被其他事务修改
+                queryset = queryset.select_for_update()
+            records = list(m2m_prefetches(queryset)[: self._page_size])
+            self._fetch_seconds = time.time() - started
+            self._add_metric("fetch", self._fetch_seconds)
+            if not records:
+                return [], 0
+            origin_datas = {record.id: to_origin_dict(record) for record in records}
+
+            page = filters.filter(id__gte=records[0].id, id__lte=records[-1].id)
+            if self.pre_check_mode:
+                with self._timed("fetch"):
+                    target_rows = self._pushdown_preview(page, updates)
+                update_count = len(target_rows)
+            else:
+                with self._timed("db_write"):
+                    update_count, target_rows = self._pushdown_update(
+                        page, updates, list(origin_datas)
+                    )
+            if update_count != len(origin_datas) or set(target_rows) != set(origin_datas):
                 raise Exception(
-                    f"查询的数据类型 {type(records[0])} 与模型属性 {type(self.target_model)} 不一致。"
+                    f"UPDATE 更新了 {update_count} 条记录，与查询的 {len(origin_datas)} 条记录不一致，本页数据可能在查询期间发生变化"
                 )
 
-            offset = list(records)[-1].id + 1
-
+            snapshot = ModelSnapshot.of(model)
+            auto_now_names = {f.name for f in snapshot.auto_now_fields}
+            items = []  # (记录, 清洗前的完整数据, 清洗后的完整数据, 变更的字段)
             for record in records:
-                # record: self.target_model
+                origin_data = origin_datas[record.id]
+                changed_data = {**origin_data, **target_rows[record.id]}
+                changed_fields = [
+                    name
+                    for name in snapshot.names
+                    if name in snapshot.concrete_names
+                    and name not in auto_now_names
+                    and origin_data[name] != changed_data[name]
+                ]
+                items.append((record, origin_data, changed_data, changed_fields))
+
+            changed_ids = [record.id for record, _, _, changed_fields in items if changed_fields]
+            if changed_ids and snapshot.auto_now_fields:
+                # UPDATE 不会触发 auto_now，与 save() 保持一致，只刷新变更记录的 auto_now 字段
+                auto_now = {f.name: f.pre_save(model(), False) for f in snapshot.auto_now_fields}
+                if not self.pre_check_mode:
+                    with self._timed("db_write"):
+                        model._base_manager.using(self.write_alias).filter(
+                            id__in=changed_ids
+                        ).update(**auto_now)
+                for _, _, changed_data, changed_fields in items:
+                    if changed_fields:
+                        changed_data.update(auto_now)
+
+            for record, origin_data, changed_data, changed_fields in items:
+                self._save_origin(record.id, origin_data)
+                for field_name in changed_fields:
+                    self._save_change_field(
+                        record,
+                        field_name=field_name,
+                        origin_value=origin_data[field_name],
+                        target_value=changed_data[field_name],
+                    )
+                if changed_fields:
+                    self._save_changed(record, origin_data, changed_data)
+        return records, len(changed_ids)
+
+    def _pushdown_update(
+        self, queryset: models.QuerySet, updates: dict, ids: list
+    ) -> (int, dict):
+        """
+        执行 UPDATE 并获取更新后的数据
+        :param ids: 本页清洗前的记录 id，不支持 RETURNING 时按 id 重新查询
+        :return: (更新的记录数, record_id -> {字段名: 更新后的值})，只包含本表的字段
+        """
+        model = self.target_model
+        fields = model._meta.concrete_fields
+        connection = connections[queryset.db]
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(updates)
+        query.annotations = {}
+
+        if query.related_updates or not self._update_returning_supported(connection):
+            # 不支持 RETURNING 时，在同一个事务中重新查询
+            update_count = queryset.update(**updates)
+            return update_count, {
+                record.pk: {f.name: f.value_from_object(record) for f in fields}
+                for record in model._base_manager.using(queryset.db).filter(id__in=ids)
+            }
+
+        sql, params = query.get_compiler(queryset.db).as_sql()
+        columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} RETURNING {columns}", params)
+            rows = cursor.fetchall()
+
+        # 与查询一样，数据库返回的值经过后端和字段的转换
+        cols = [f.get_col(model._meta.db_table) for f in fields]
+        converters = [
+            connection.ops.get_db_converters(col) + col.get_db_converters(connection)
+            for col in cols
+        ]
+        target_rows = {}
+        for row in rows:
+            values = {}
+            for f, col, field_converters, value in zip(fields, cols, converters, row):
+                for converter in field_converters:
+                    value = converter(value, col, connection)
+                values[f.name] = value
+            target_rows[values[model._meta.pk.name]] = values
+        return len(rows), target_rows
+
+    def _pushdown_preview(self, queryset: models.QuerySet, updates: dict) -> dict:
+        """
+        预检查模式下计算清洗后的值：UPDATE 的表达式作为查询的注解，不修改也不锁定记录
+        :return: record_id -> {字段名: 清洗后的值}，只包含 updates 中的字段
+        """
+        opts = self.target_model._meta
+        annotations = {}  # 注解名 -> 字段名
+        expressions = {}
+        for index, (name, value) in enumerate(updates.items()):
+            field = opts.get_field(name)
+            alias = f"pushdown_{index}"
+            annotations[alias] = name
+            # 与 UPDATE 一样按字段的类型转换，读取时经过字段的转换
+            if hasattr(value, "resolve_expression"):
+                expressions[alias] = ExpressionWrapper(value, output_field=field)
+            else:
+                expressions[alias] = Value(value, output_field=field)
+        rows = queryset.annotate(**expressions).values("pk", *annotations)
+        return {
+            row["pk"]: {name: row[alias] for alias, name in annotations.items()} for row in rows
+        }
+
+    @staticmethod
+    def _update_returning_supported(connection) -> bool:
+        """
+        数据库是否支持 UPDATE ... RETURNING：PostgreSQL、SQLite 3.35 及以上，MySQL 不支持
+        """
+        if connection.vendor == "postgresql":
+            return True
+        if connection.vendor == "sqlite":
+            return connection.Database.sqlite_version_info >= (3, 35)
+        return False
+
+    def _fetch_page(self, filters: models.QuerySet, offset: int, max_id: int) -> list:
+        """
+        抽取：查询 id 从 offset 开始的一页数据
+        """
+        # 查询 page_size 条数据
+        # 按 id 排序，用切片查询确保每次都能拿到足量数据
+        # 记录最新的 id 偏移量继续用 page_size 进行切片分页。
+        started = time.time()
+        queryset = filters.filter(id__gte=offset, id__lte=max_id).order_by("id")
+        with self._query_counter.scope(page=("fetch", offset)):
+            records = list(self._projected(queryset)[: self._page_size])
+        self._fetch_seconds = time.time() - started
+        self._add_metric("fetch", self._fetch_seconds)
+        # 查询完成后才知道本页的第一条记录，查询数合并到本页
+        self._query_counter.move(("fetch", offset), records[0].id if records else None)
+        if records and not isinstance(records[0], self.target_model):
+            raise Exception(
+                f"查询的数据类型 {type(records[0])} 与模型属性 {type(self.target_model)} 不一致。"
+            )
+        return records
+
+    def _projected(self, queryset: models.QuerySet) -> models.QuerySet:
+        """
+        设置 fields 时只查询清洗规则使用的字段，并预加载多对多字段
+        """
+        if self._fields is not None:
+            queryset = queryset.only(
+                *(name for name in self._fields if name in self._snapshot().concrete_names)
+            )
+        return m2m_prefetches(queryset, self._fields)
+
+    def _transform_page(self, records: list) -> (list, tuple):
+        """
+        转换：逐条执行清洗规则并对比差异，遇到异常即停止
+        批量清洗规则或按列清洗规则异常时，整页都不提交。
+        :return: (异常记录之前的清洗结果, (异常记录, 异常) 或 None)
+        """
+        with self._query_counter.scope(page=records[0].id if records else None):
+            full_rows = {}
+            if self._fields is not None and self.archive_full_row and records:
+                full_rows = self._full_rows(records)
+            if self.rule_mode != "record" and records:
+                with self._timed("diff"):
+                    snapshot = self._snapshot()
+                    origin_values = [snapshot.capture(record) for record in records]
+                writes = [None] * len(records)
+                try:
+                    with self._timed("rule"), self._query_counter.scope(source="rule"):
+                        if self._field_tracer is None:
+                            self._apply_rule_batch(records)
+                        else:
+                            with self._field_tracer.trace(records) as writes:
+                                self._apply_rule_batch(records)
+                except Exception as e:
+                    return [], (records[0], e)
+            items = []
+            for i, record in enumerate(records):
                 try:
-                    # 记录清洗前的完整数据
-                    origin_data = to_origin_dict(record)
-                    self._save_origin(record.id, origin_data)
-
-                    # 调用清洗规则
-                    _record = self.rule(record)
-                    if not _record:
-                        _record = record
+                    if self.rule_mode == "record":
+                        item = self._transform_record(record, full_rows.get(record.id))
                     else:
-                        if not isinstance(_record, self.target_model):
-                            raise Exception(
-                                f"返回的记录类型 {type(_record)} 与模型属性 {type(self.target_model)} 不一致。"
-                            )
-                        if _record.id != record.id:
-                            raise Exception(f"返回的记录 id 与输入记录 id 不一致。")
-
-                    changed_data = to_origin_dict(_record)
-
-                    has_field_changed = False
-                    for field_name, field_value in origin_data.items():
-                        changed_value = changed_data[field_name]
-                        if field_value != changed_value:
-                            _field_meta = _record._meta.get_field(field_name)
-                            if hasattr(_field_meta, "auto_now"):
-                                if _field_meta.auto_now is True:
-                                    raise Exception(
-                                        f"请勿在规则方法中主动调用 save() 方法，因为 ETL 父类会统一处理提交，目前 {field_name} 已发生变化，可能会存在重复提交，影响效率。"
-                                    )
-                            has_field_changed = True
-                            # 保存字段变更
-                            self._save_change_field(
-                                _record,
-                                field_name=field_name,
-                                origin_value=field_value,
-                                target_value=changed_value,
+                        with self._timed("diff"):
+                            item = self._diff_item(
+                                record, origin_values[i], full_rows.get(record.id), writes[i]
                             )
+                    items.append(item)
+                except Exception as e:
+                    return items, (record, e)
+            return items, None
+
+    def _transform_record(self, record: models.Model, full_row: dict = None) -> tuple:
+        """
+        转换：执行清洗规则并对比差异
+        :param full_row: 设置 fields 时，单独查询的完整数据
+        :return: (清洗后的记录, 清洗前的完整数据, 清洗后的完整数据, 变更的字段)
+        """
+        # 记录清洗前的完整数据
+        with self._timed("diff"):
+            origin_values = self._snapshot().capture(record)
+
+        # 调用清洗规则
+        written = None
+        with self._timed("rule"), self._query_counter.scope(source="rule"):
+            if self._field_tracer is None:
+                _record = self._apply_rule(record)
+            else:
+                with self._field_tracer.trace([record]) as writes:
+                    _record = self._apply_rule(record)
+                # 规则返回了新的记录时，无法追踪写入的字段
+                written = writes[0] if _record is record else None
+        with self._timed("diff"):
+            return self._diff_item(_record, origin_values, full_row, written)
+
+    def _diff_item(
+        self,
+        record: models.Model,
+        origin_values: tuple,
+        full_row: dict = None,
+        written: set = None,
+    ) -> tuple:
+        """
+        对比清洗后的记录与清洗前的快照
+        :param full_row: 设置 fields 时，单独查询的完整数据，与快照合并后归档
+        :param written: trace_fields 开启时，清洗规则写入的字段，None 表示无法追踪
+        :return: 参照 _transform_record()
+        """
+        snapshot = self._snapshot()
+        if self._fields is not None:
+            self._check_deferred(record)
+        origin_data = snapshot.to_dict(origin_values)
+        if full_row:
+            origin_data = {**full_row, **origin_data}
+
+        narrowed = None
+        if self._field_tracer is not None:
+            narrowed = self._field_tracer.narrowed(written)
+        if narrowed is None:
+            changed_values = snapshot.capture(record)
+            changed_fields = self._diff_record(record, origin_values, changed_values)
+            if self._field_tracer is not None:
+                self._field_tracer.observe(written, changed_fields)
+        else:
+            # 预热之后只对比清洗规则写入的字段，其他字段沿用清洗前的快照
+            snapshot, indexes = narrowed
+            changed_values = snapshot.capture(record)
+            changed_fields = self._diff_record(
+                record, tuple(origin_values[i] for i in indexes), changed_values, snapshot
+            )
+        return (
+            record,
+            origin_data,
+            {**origin_data, **snapshot.to_dict(changed_values)},
+            changed_fields,
+        )
 
-                    # todo 放入队列，异步提交
-                    if has_field_changed:
-                        if self.pre_check_mode is False:
-                            _record.save()
-                            changed_data = to_origin_dict(_record)  # auto now 字段变了，重新读取
-                            # 保存记录数据变更
-                            self._save_changed(_record, origin_data, changed_data)
-                        data_count += 1
+    def _snapshot(self) -> ModelSnapshot:
+        """
+        清洗时使用的快照器，设置 fields 时只包含这些字段
+        """
+        return ModelSnapshot.of(self.target_model, self._fields)
 
-                except Exception as e:
-                    traceback.print_exc()
+    def _changed_dict(self, record: models.Model, origin_data: dict) -> dict:
+        """
+        提交后的完整数据：清洗前的完整数据与提交后的快照合并
+        """
+        snapshot = self._snapshot()
+        return {**origin_data, **snapshot.to_dict(snapshot.capture(record))}
+
+    def _projection_fields(self) -> tuple:
+        """
+        查询和对比的字段：fields 加上主键和 auto_now 字段
+        :return: 字段名，None 表示所有字段
+        """
+        if self.fields is None:
+            return None
+        opts = self.target_model._meta
+        names = {
+            f.name
+            for fields in (opts.concrete_fields, opts.private_fields, opts.many_to_many)
+            for f in fields
+        }
+        unknown = [name for name in self.fields if name not in names]
+        if unknown:
+            raise Exception(f"fields 中的字段 {unknown} 不是 {self.table_name} 的字段。")
+        projection = set(self.fields)
+        projection.add(opts.pk.name)
+        projection.update(
+            f.name for f in opts.concrete_fields if getattr(f, "auto_now", False) is True
+        )
+        return tuple(sorted(projection))
+
+    def _check_deferred(self, record: models.Model):
+        """
+        设置 fields 时，清洗规则不能读取或修改其他字段，否则变更无法归档
+        """
+        loaded = [name for name, attname in self._deferred_fields if attname in record.__dict__]
+        if loaded:
+            raise Exception(
+                f"清洗规则使用了 fields 以外的字段 {loaded}，请将其加入 fields。"
+            )
+
+    def _full_rows(self, records: list) -> dict:
+        """
+        设置 fields 时，单独查询一页记录的完整数据 (与这页记录相同的数据库)，用于归档
+        :return: record_id -> 完整数据
+        """
+        queryset = self.target_model._base_manager.using(records[0]._state.db).filter(
+            id__in=[r.id for r in records]
+        )
+        with self._timed("fetch"):
+            return {record.id: to_origin_dict(record) for record in m2m_prefetches(queryset)}
+
+    def _load_page(self, items: list, error: tuple = None, progress: dict = None) -> (int, int):
+        """
+        加载：归档并提交一页清洗结果，每 commit_size 条变更的记录 (及其之前未变更的记录) 在一个事务中提交，
+        未变更的记录只写入归档，不单独开启事务；事务中任一记录异常时，整个事务回滚，归档同步撤销。
+        :param items: 清洗结果，参照 _transform_record()
+        :param error: 转换阶段的异常 (异常记录, 异常)，加载完异常记录之前的数据后停止
+        :param progress: 清洗进度，每个事务提交后写入断点文件，中途退出时续跑不会重新清洗和归档已提交的记录；
+            本页最后一个事务之后的进度由 _commit_progress() 更新
+        :return: (已提交的清洗记录数, 异常记录或回滚事务中第一条记录的 id，None 表示全部提交)
+        """
+        data_count = 0
+        scanned_count = 0
+        commit_size = max(self.commit_size or (len(items) if self.bulk_update_mode else 1), 1)
+        groups, group, changed_count = [], [], 0
+        for item in items:
+            group.append(item)
+            if item[3]:
+                changed_count += 1
+                if changed_count == commit_size:
+                    groups.append(group)
+                    group, changed_count = [], 0
+        if group:
+            # 最后一组可能没有变更的记录
+            groups.append(group)
+
+        for index, group in enumerate(groups):
+            _record = None
+            atomic = any(item[3] for item in group)
+            try:
+                with self._archive_transaction(atomic=atomic):
+                    group_count, page_items = 0, []
+                    for _record, origin_data, changed_data, changed_fields in self._verify_on_primary(
+                        group
+                    ):
+                        if self._load_record(
+                            _record, origin_data, changed_data, changed_fields, page_items
+                        ):
+                            group_count += 1
+                    _record = None
+                    self._bulk_commit(page_items)
+            except Exception as e:
+                traceback.print_exc()
+                if _record is not None:
                     Logger.warning(
-                        f"修正失败，请检查记录 {self.database}@{self.table_name}.id={record.id} 异常信息：{e}"
+                        f"修正失败，请检查记录 {self.database}@{self.table_name}.id={_record.id} 异常信息：{e}"
                     )
-                    return
+                else:
+                    Logger.warning(
+                        f"批量提交失败，请检查 {self.database}@{self.table_name}.id 范围：[{group[0][0].id}, {group[-1][0].id}] 异常信息：{e}"
+                    )
+                if len(group) > 1:
+                    Logger.warning(f"同一事务中的 {len(group)} 条记录已回滚，从 id={group[0][0].id} 继续清洗")
+                return data_count, group[0][0].id
+            data_count += group_count
+            scanned_count += len(group)
+            if progress is not None and atomic and index < len(groups) - 1:
+                # 事务提交时之前未变更的记录的归档已一起刷盘；
+                # 页内的断点不同步到磁盘，宕机时回退到上一页结束的断点，续跑时重新清洗的记录数不超过一页
+                self._save_checkpoint(
+                    dict(
+                        progress,
+                        next_id=group[-1][0].id + 1,
+                        scanned_count=progress["scanned_count"] + scanned_count,
+                        data_count=progress["data_count"] + data_count,
+                    ),
+                    fsync=False,
+                )
 
-        Logger.info(f"清洗完成：共 {data_count} 条记录")
+        if error is not None:
+            record, e = error
+            traceback.print_exception(type(e), e, e.__traceback__)
+            Logger.warning(
+                f"修正失败，请检查记录 {self.database}@{self.table_name}.id={record.id} 异常信息：{e}"
+            )
+            return data_count, record.id
+
+        # 分页结束，归档刷盘
+        self._archive_flush()
+        return data_count, None
+
+    def _verify_on_primary(self, items: list) -> list:
+        """
+        从从库查询时，在提交的事务中锁定并重新读取主库上将要变更的记录，与清洗前的数据对比：
+        不一致的记录 (从库延迟，或查询后被修改) 基于主库的数据重新清洗，主库上已不符合 filter() 条件的记录跳过。
+        只校验在从库上清洗后有变更的记录：没有变更的记录不访问主库，从库延迟期间主库上被修改、
+        需要清洗的记录会被漏掉，数量计入 _unverified_count，清洗结束时输出，参照 _report_unverified()
+        :param items: 清洗结果，参照 _transform_record()
+        :return: 校验后的清洗结果
+        """
+        if not self._verify_reads or self.pre_check_mode:
+            return items
+        changed = {item[0].id: item for item in items if item[3]}
+        self._unverified_count += len(items) - len(changed)
+        if not changed:
+            return items
+        queryset = self.filter().using(self.write_alias).filter(id__in=list(changed))
+        with self._timed("fetch"):
+            primary = {
+                record.id: record
+                for record in self._projected(queryset.select_for_update().order_by("id"))
+            }
+        snapshot = self._snapshot()
+        stale = []
+        for record_id, (_, origin_data, _, _) in changed.items():
+            record = primary.get(record_id)
+            if record is None:
+                continue
+            values = snapshot.to_dict(snapshot.capture(record))
+            if any(origin_data[name] != value for name, value in values.items()):
+                stale.append(record)
+        missing = [record_id for record_id in changed if record_id not in primary]
+        if missing:
+            Logger.warning(f"记录在主库上已不符合查询条件，跳过: {self.database}@{self.table_name}.id in {missing}")
+        if not stale and not missing:
+            return items
+
+        retransformed = {}
+        if stale:
+            Logger.info(
+                f"{len(stale)} 条记录在主库上的数据与查询时不一致 (从库延迟或期间被修改)，基于主库的数据重新清洗: "
+                f"{self.database}@{self.table_name}.id in {[record.id for record in stale]}"
+            )
+            page = self._query_counter.current_page()
+            stale_items, error = self._transform_page(stale)
+            # 重新清洗的查询数计入当前页
+            self._query_counter.move(stale[0].id, page)
+            if error is not None:
+                raise error[1]
+            retransformed = {item[0].id: item for item in stale_items}
+        return [retransformed.get(item[0].id, item) for item in items if item[0].id not in missing]
+
+    def _report_unverified(self):
+        """
+        输出未在主库上校验的记录数，参照 _verify_on_primary()
+        """
+        if self._unverified_count:
+            Logger.warning(
+                f"{self._unverified_count} 条记录在从库上清洗后没有变更，未在主库上校验：从库延迟期间主库上被修改的记录可能仍需清洗，可以在从库追上后再运行一次"
+            )
+
+    def _load_record(
+        self,
+        _record: models.Model,
+        origin_data: dict,
+        changed_data: dict,
+        changed_fields: list,
+        page_items: list,
+    ) -> bool:
+        """
+        归档并提交一条清洗结果，批量提交模式下放入 page_items，由 _bulk_commit() 统一提交
+        :return: 是否发生变更
+        """
+        self._save_origin(_record.id, origin_data)
+        for field_name in changed_fields:
+            # 保存字段变更
+            self._save_change_field(
+                _record,
+                field_name=field_name,
+                origin_value=origin_data[field_name],
+                target_value=changed_data[field_name],
+            )
+
+        if not changed_fields:
+            return False
+        if self.pre_check_mode is False:
+            if self.bulk_update_mode:
+                page_items.append((_record, origin_data, changed_fields))
+            else:
+                with self._timed("db_write"):
+                    if self._field_tracer is not None:
+                        # 已追踪写入的字段，只更新变更的字段
+                        _record.save(
+                            using=self.write_alias,
+                            update_fields=self._field_tracer.update_fields(changed_fields),
+                        )
+                    else:
+                        _record.save(using=self.write_alias)
+                changed_data = self._changed_dict(_record, origin_data)  # auto now 字段变了，重新读取
+                # 保存记录数据变更
+                self._save_changed(_record, origin_data, changed_data)
+        return True
+
+    @contextmanager
+    def _archive_transaction(self, atomic: bool = True):
+        """
+        数据库事务，归档写入与事务保持一致：
+        事务提交前归档写入文件并同步到磁盘；事务回滚时，丢弃未写入的归档，已写入的归档截断到事务开始前的大小
+        :param atomic: 是否开启数据库事务，为 False 时 (没有需要提交的记录) 只在异常时撤销归档，归档留在缓冲区
+        """
         if self.pre_check_mode:
-            Logger.warning(f"预检模式已开启，未提交数据。")
-        if data_count > 0:
-            # 归档文件上传到 oss
-            self._archive_to_oss(ArchiveSceneEnum.data_fix.value)
+            yield
+            return
+        with self._archive_session():
+            writer = self._archive_writer
+            writer.begin()
+            try:
+                if not atomic:
+                    yield
+                    return
+                with transaction.atomic(using=self.write_alias):
+                    yield
+                    # 提交前归档先写入文件并同步到磁盘，确保归档不落后于数据库
+                    with self._timed("archive"):
+                        writer.flush()
+                    committing = time.perf_counter()
+                self._add_metric("db_write", time.perf_counter() - committing)
+            except BaseException:
+                # 包括 KeyboardInterrupt，中断时数据库事务回滚，归档同样撤销，避免关闭时写入文件
+                writer.rollback()
+                # 内存中的去重索引和偏移索引可能包含已撤销的归档行，下次写入时重新加载
+                self._change_field_index = None
+                self._offset_indexes = {}
+                self._indexed_files = set()
+                raise
+            finally:
+                writer.commit()
 
     def recover(self):
         """
@@ -242,18 +1685,121 @@ class ETLBase(unittest.TestCase):
         """
         变更文件 __change_field.txt 数据恢复
         todo mysql 5.7 json 字段的恢复测试
-        todo 批量提交
         """
         Logger.info(f"根据字段变更恢复: {self.change_field_file}")
+        self._start_metrics(ArchiveSceneEnum.data_recover.value)
+        self._start_throttle()
+        try:
+            if self.shard_count > 1:
+                recover_count = self._recover_shards(
+                    self._recover_change_field_records, self.change_field_file
+                )
+            else:
+                with self._archive_session():
+                    recover_count = self._recover_change_field_records()
+        except Exception:
+            self._finish_metrics(finished=False)
+            raise
+
+        Logger.info(f"恢复完成：共 {recover_count} 次字段变更")
+        if self.pre_check_mode:
+            Logger.warning(f"预检模式已开启，未提交数据。")
+            self._finish_metrics()
+            return
+
+        # 归档文件上传到 oss
+        if recover_count > 0:
+            self._archive_to_oss(ArchiveSceneEnum.data_recover.value)
+        self._finish_metrics()
+
+    def _recover_shards(self, target, archive_file: str, reverse: bool = False) -> int:
+        """
+        多进程分片恢复：按 record_id 对 shard_count 取模拆分，同一条记录的变更由同一个进程按顺序恢复
+        主进程只读取一次归档文件并拆分到各分片的临时文件，分片进程只读取和解析自己的临时文件。
+        :param target: 恢复方法，参数为归档数据迭代器，返回恢复次数
+        :param reverse: 是否逆序读取归档文件，参照 _archive_iter()
+        :return: 恢复次数
+        """
+        part_files = self._partition_archive(archive_file, reverse)
+        try:
+            shard_args = [
+                (target, part_file, archive_file == self.change_field_file)
+                for part_file in part_files
+            ]
+            results = self._run_shards(
+                self._recover_shard, shard_args, ("recovered_file",)
+            )
+        finally:
+            for part_file in part_files:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+        self._merge_shard_archives()
+
+        failed = [index for index, result in enumerate(results) if result is None]
+        if failed:
+            raise Exception(f"分片 {failed} 恢复异常，请检查日志。")
+        return sum(result["recover_count"] for result in results)
+
+    def _recover_shard(self, target, part_file: str, is_change_field: bool) -> dict:
+        """
+        分片进程：恢复分片临时文件中的数据，即 record_id 属于当前分片的数据
+        """
+        metas = self._archive_file_iter(part_file, self._archive_lines(part_file), is_change_field)
+        with self._archive_session():
+            recover_count = target(metas)
+        return dict(recover_count=recover_count)
+
+    def _partition_archive(self, archive_file: str, reverse: bool = False) -> list:
+        """
+        按 record_id 对 shard_count 取模，将归档文件 (及尚未合并的分片归档文件) 的归档行拆分到各分片的临时文件，
+        临时文件中的行保持读取顺序，拆分时只解析 record_id
+        :return: 各分片的临时文件路径，如 db@table__origin.recover001.txt
+        """
+        archive_files = self._archive_files(archive_file)
+        if not archive_files:
+            raise Exception(f"数据归档文件 {archive_file} 不存在。")
+
+        base, _ = split_archive_name(archive_file)
+        part_files = [f"{base}.recover{index:03d}.txt" for index in range(self.shard_count)]
+        outs = [open(part_file, "w", encoding=archive_encoding()) for part_file in part_files]
+        try:
+            for _archive_file, lines in self._archive_file_lines(archive_files, reverse):
+                for line_no, line in lines:
+                    line = line.strip()
+                    if not line:
+                        raise Exception(f"归档文件 {_archive_file}:{line_no} 中存在空行。")
+                    record_id = ArchiveIndex.parse_record_id(line.encode())
+                    outs[record_id % self.shard_count].write(f"{line}\n")
+        except Exception:
+            for out in outs:
+                out.close()
+            for part_file in part_files:
+                os.remove(part_file)
+            raise
+        for out in outs:
+            out.close()
+        return part_files
+
+    def _recover_change_field_records(self, metas=None) -> int:
+        """
+        分批恢复 __change_field.txt 中的字段变更，每批 recover_chunk_size 行
+        :param metas: 归档数据迭代器，分片进程为分片临时文件中的数据，默认读取整个字段变更归档
+        :return: 恢复的字段变更次数
+        """
+        if self.recover_chunk_size < 1:
+            raise Exception(f"recover_chunk_size 不能小于 1。")
+
+        if metas is None:
+            metas = self._archive_iter(self.change_field_file)
         recover_count = 0
-        for meta in self._archive_iter(self.change_field_file):
+        chunk = []
+        for meta in metas:
             database = meta["database"]
             table_name = meta["table_name"]
             record_id = meta["record_id"]
             field_name = meta["field_name"]
             archive_origin_value = meta["origin_value"]
             archive_target_value = meta["target_value"]
-            archive_note = meta["note"]
 
             if archive_origin_value is not None and archive_target_value is not None:
                 if type(archive_origin_value) != type(archive_target_value):
@@ -274,24 +1820,93 @@ class ETLBase(unittest.TestCase):
             if not hasattr(model, field_name):
                 raise Exception(f"模型 {model} 中不存在字段 {field_name}")
 
-            # Logger.info(
-            #     f"开始恢复: {self.database}@{table_name}.id={record_id} {field_name}={archive_origin_value}"
-            # )
+            chunk.append(meta)
+            if len(chunk) >= self.recover_chunk_size:
+                recover_count += self._recover_chunk(self._recover_change_field_chunk, chunk)
+                chunk = []
 
-            try:
-                record: model = model.objects.get(id=record_id)
-            except model.DoesNotExist:
+        if chunk:
+            recover_count += self._recover_chunk(self._recover_change_field_chunk, chunk)
+        return recover_count
+
+    def _recover_chunk(self, target, metas: list) -> int:
+        """
+        恢复一批归档数据，统计本批的 SQL 查询数和运行指标
+        :param target: 恢复方法，参数为本批归档数据，返回恢复次数
+        :return: 恢复次数
+        """
+        with self._query_counter.install(), self._query_counter.scope(page="recover"):
+            recover_count = target(metas)
+        queries = self._query_counter.pop("recover")
+        write_seconds, self._write_seconds = self._write_seconds, 0
+        self._throttle_page(len(metas), queries, write_seconds)
+        if self._metrics is not None:
+            self._metrics.page_done(len(metas), recover_count, queries=queries)
+        self._check_queries(
+            queries, len(metas), f"本批恢复 (record_id {metas[0]['record_id']} 开始的 {len(metas)} 条归档数据)"
+        )
+        return recover_count
+
+    def _recover_change_field_chunk(self, metas: list) -> int:
+        """
+        恢复一批字段变更：一次查询本批涉及的记录，按记录依次还原所有字段，再用一次 bulk_update 提交
+        同一条记录的多次变更按归档顺序还原，与逐条恢复的结果一致。
+        :return: 恢复的字段变更次数
+        """
+        model = self.target_model
+        record_ids = list(dict.fromkeys(meta["record_id"] for meta in metas))
+        if self.pre_check_mode is False and self._verify_reads:
+            # 是否重复恢复取决于记录的当前值，从库延迟时可能误判，在主库上锁定并查询
+            with self._archive_transaction():
+                with self._timed("fetch"):
+                    records = m2m_prefetches(
+                        model.objects.using(self.write_alias).select_for_update()
+                    ).in_bulk(record_ids)
+                origin_datas, update_fields, recovered = self._apply_change_fields(metas, records)
+                self._commit_change_fields(records, origin_datas, update_fields)
+            self._archive_flush()
+        else:
+            with self._timed("fetch"):
+                records = m2m_prefetches(model.objects.using(self._read_alias)).in_bulk(record_ids)
+            origin_datas, update_fields, recovered = self._apply_change_fields(metas, records)
+            if self.pre_check_mode is False and origin_datas:
+                # 本批更新与 __recovered.txt 的归档在同一个事务中提交
+                with self._archive_transaction():
+                    self._commit_change_fields(records, origin_datas, update_fields)
+                self._archive_flush()
+
+        for record_id, field_name, archive_origin_value in recovered:
+            Logger.info(
+                f"恢复成功: {self.database}@{self.table_name}.id={record_id} 字段 {field_name}={archive_origin_value}"
+            )
+        return len(recovered)
+
+    def _apply_change_fields(self, metas: list, records: dict) -> (dict, set, list):
+        """
+        按归档顺序将一批字段变更还原到记录上 (尚未提交)
+        :param records: record_id -> 记录
+        :return: (record_id -> 恢复前的完整数据, 恢复的字段, [(record_id, 字段名, 恢复的值), ...])
+        """
+        origin_datas = {}  # record_id -> 恢复前的完整数据
+        update_fields = set()
+        recovered = []  # 本批恢复的字段变更，提交后输出日志
+        for meta in metas:
+            record_id = meta["record_id"]
+            field_name = meta["field_name"]
+            archive_origin_value = meta["origin_value"]
+            archive_target_value = meta["target_value"]
+
+            record = records.get(record_id)
+            if record is None:
                 Logger.warning(
-                    f"一个变更恢复失败，记录可能已被删除：{self.database}@{table_name}.id={record_id}，变更: {field_name}={archive_origin_value}"
+                    f"一个变更恢复失败，记录可能已被删除：{self.database}@{self.table_name}.id={record_id}，变更: {field_name}={archive_origin_value}"
                 )
                 Logger.warning(f"对于被删除的数据，可以通过原始文件进行恢复，参照 _recover_origin() 方法。")
                 continue
-            # values = to_origin_dict(record)
             origin_value = getattr(record, field_name)
-            # origin_value = record.__getattribute__(field_name)
             if origin_value == archive_origin_value:
                 Logger.warning(
-                    f"重复恢复，跳过: {self.database}@{table_name}.id={record_id} {field_name}={archive_origin_value}"
+                    f"重复恢复，跳过: {self.database}@{self.table_name}.id={record_id} {field_name}={archive_origin_value}"
                 )
                 continue
             if origin_value != archive_target_value:
@@ -299,29 +1914,175 @@ class ETLBase(unittest.TestCase):
                     f"数据已发生变化，可能来自外部编辑，本次将继续恢复。库中的期望值: {archive_target_value} 实际的值: {origin_value} 计划写入的原始值: {archive_origin_value}"
                 )
             # 恢复前，记录完整数据
-            origin_data = to_origin_dict(record)
+            if record_id not in origin_datas:
+                origin_datas[record_id] = to_origin_dict(record)
 
             record.__setattr__(field_name, archive_origin_value)
-            # todo 放入队列，异步提交
-            if self.pre_check_mode is False:
-                record.save()
-                # 恢复后，记录完整数据
-                target_data = to_origin_dict(record)
-                self._save_recovered(record, origin_data, target_data)
+            update_fields.add(field_name)
+            recovered.append((record_id, field_name, archive_origin_value))
+        return origin_datas, update_fields, recovered
 
-            Logger.info(
-                f"恢复成功: {self.database}@{table_name}.id={record_id} 字段 {field_name}={archive_origin_value}"
-            )
-            recover_count += 1
+    def _commit_change_fields(self, records: dict, origin_datas: dict, update_fields: set):
+        """
+        提交还原后的记录，并归档恢复后的完整数据 (在事务中调用)
+        """
+        changed_records = [records[record_id] for record_id in origin_datas]
+        if not changed_records:
+            return
+        self._bulk_update(changed_records, update_fields)
+        for record in changed_records:
+            # 恢复后，记录完整数据
+            target_data = to_origin_dict(record)
+            self._save_recovered(record, origin_datas[record.id], target_data)
 
-        Logger.info(f"恢复完成：共 {recover_count} 次字段变更")
+    def _check_queries(self, queries: dict, rows: int, description: str):
+        """
+        检查一页的 SQL 查询数：清洗规则的查询数不少于记录数时，提示可能存在 N+1 查询；
+        超过 max_queries_per_page 时，预检查模式下报错停止，正式运行时输出警告
+        :param queries: 本页的查询数 {来源: 查询数}
+        :param rows: 本页的记录数
+        :param description: 本页的描述，用于日志
+        """
+        if rows and queries["rule"] >= rows and "rule" not in self._query_warned:
+            self._query_warned.add("rule")
+            Logger.warning(
+                f"{description} 清洗规则执行了 {queries['rule']} 次 SQL 查询 (共 {rows} 条记录)，可能存在 N+1 查询，"
+                f"可以在 filter() 中使用 select_related / prefetch_related，或改用 rule_batch() 每页查询一次"
+            )
+        total = sum(queries.values())
+        if self.max_queries_per_page is None or total <= self.max_queries_per_page:
+            return
+        message = (
+            f"{description} 执行了 {total} 次 SQL 查询 (框架 {queries['framework']}，清洗规则 {queries['rule']})，"
+            f"超过 max_queries_per_page={self.max_queries_per_page}"
+        )
         if self.pre_check_mode:
-            Logger.warning(f"预检模式已开启，未提交数据。")
+            raise Exception(message)
+        if "budget" not in self._query_warned:
+            self._query_warned.add("budget")
+            Logger.warning(f"{message}，后续超出时不再提示，单页最多的查询数见运行指标报告")
+
+    def _start_metrics(self, scene: str, waiting_count: int = None):
+        """
+        开始统计本次运行的指标
+        :param waiting_count: 待处理的记录数，用于估算剩余时间
+        """
+        if not self.metrics_report:
             return
+        self._metrics = RunMetrics(
+            scene,
+            self.database,
+            self.table_name,
+            f"{self.metrics_file_prefix}_{scene}.json",
+            f"{self.metrics_file_prefix}_{scene}.prom",
+            waiting_count=waiting_count,
+            interval=self.metrics_interval,
+        )
 
-        # 归档文件上传到 oss
-        if recover_count > 0:
-            self._archive_to_oss(ArchiveSceneEnum.data_recover.value)
+    def _finish_metrics(self, finished: bool = True):
+        """
+        结束统计，写入最终的运行指标报告
+        """
+        metrics = self._metrics
+        self._metrics = None
+        if metrics is None:
+            return
+        summary = metrics.report(finished=finished)
+        phases = "，".join(f"{k} {v:.2f}s" for k, v in summary["phases"].items() if v)
+        Logger.info(f"各阶段耗时：{phases}，运行指标报告：{metrics.report_file}")
+
+    def _add_metric(self, phase: str, seconds: float):
+        """
+        累计阶段耗时，参照 RunMetrics.add()；db_write 同时计入当前页的写入耗时，用于限流
+        """
+        if phase == "db_write":
+            self._write_seconds += seconds
+        if self._metrics is not None:
+            self._metrics.add(phase, seconds)
+
+    @contextmanager
+    def _timed(self, phase: str):
+        """
+        统计代码块的耗时，计入 phase 阶段
+        """
+        if self._metrics is None and phase != "db_write":
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_metric(phase, time.perf_counter() - started)
+
+    def _start_profiler(self):
+        """
+        创建按页的性能剖析器，时间窗口从此时开始计算
+        """
+        if self.profile_mode is None:
+            return
+        rule_codes = []
+        for name in ("rule", "rule_batch", "rule_columns"):
+            code = getattr(getattr(type(self), name), "__code__", None)
+            if code is not None:
+                rule_codes.append(code)
+        self._profiler = PageProfiler(
+            self.profile_mode,
+            self.profile_file_prefix,
+            every=self.profile_every,
+            window=self.profile_window,
+            interval=self.profile_interval,
+            rule_codes=tuple(rule_codes),
+        )
+        Logger.info(f"性能剖析已开启 ({self.profile_mode})，剖析结果：{self.profile_file_prefix}_*")
+
+    def _start_throttle(self, adjust_page_size: bool = False):
+        """
+        设置了限流参数时，创建限流控制器
+        :param adjust_page_size: 是否调整分页尺寸，数据恢复时只调整页间暂停
+        """
+        self._throttle = None
+        self._write_seconds = 0
+        if (
+            self.throttle_write_seconds is None
+            and self.replica_lag_probe is None
+            and self.max_rows_per_second is None
+            and self.max_queries_per_second is None
+        ):
+            return
+        self._throttle = ThrottleController(
+            write_seconds=self.throttle_write_seconds,
+            lag_probe=self.replica_lag_probe,
+            max_lag=self.max_replica_lag,
+            lag_interval=self.replica_lag_interval,
+            max_lag_wait=self.max_replica_lag_wait,
+            max_rows_per_second=self.max_rows_per_second,
+            max_queries_per_second=self.max_queries_per_second,
+            max_pause=self.throttle_max_pause,
+            page_size=self._page_size if adjust_page_size else None,
+            min_page_size=self.min_page_size,
+        )
+
+    def _throttle_page(self, rows: int, queries: dict, write_seconds: float):
+        """
+        一页 (或一批恢复) 提交后限流，等待的时间计入 throttle 阶段
+        """
+        if self._throttle is None:
+            return
+        waited = self._throttle.throttle(rows, sum(queries.values()), write_seconds)
+        self._add_metric("throttle", waited)
+        if self._throttle.page_size is not None:
+            self._page_size = self._throttle.page_size
+
+    @contextmanager
+    def _profile_page(self, page_no: int):
+        """
+        剖析第 page_no 页 (从 1 开始)，参照 PageProfiler.page()
+        """
+        if self._profiler is None:
+            yield {}
+            return
+        with self._profiler.page(page_no) as page:
+            yield page
 
     def _archive_dir_init(self):
         """
@@ -363,6 +2124,49 @@ class ETLBase(unittest.TestCase):
         #     raise Exception("请设置 cls.field_name 属性")
         if not self.page_size:
             raise Exception("请设置 cls.page_size 属性")
+        if self.rule_mode not in ("record", "batch", "columns"):
+            raise Exception(f"不支持的清洗规则调用方式 {self.rule_mode}，可选 record、batch、columns")
+        if self.adaptive_page_size and not (
+            0 < self.min_page_size <= self.max_page_size
+        ):
+            raise Exception(
+                f"自适应分页尺寸的范围错误，min_page_size: {self.min_page_size} 应小于等于 max_page_size: {self.max_page_size}"
+            )
+        if self.trace_fields and self.trace_warmup < 1:
+            raise Exception(f"trace_warmup 不能小于 1。")
+        if self.max_queries_per_page is not None and self.max_queries_per_page < 1:
+            raise Exception(f"max_queries_per_page 不能小于 1。")
+        if self.pushdown_mode and self.pipeline_mode:
+            raise Exception(f"pushdown_mode 不能与 pipeline_mode 同时开启。")
+        if self.profile_mode is not None:
+            if self.profile_mode not in PROFILE_MODES:
+                raise Exception(f"不支持的性能剖析方式 {self.profile_mode}，可选 {'、'.join(PROFILE_MODES)}")
+            if self.profile_every < 1:
+                raise Exception(f"profile_every 不能小于 1。")
+            if self.profile_window is not None and not (
+                len(self.profile_window) == 2 and 0 <= self.profile_window[0] < self.profile_window[1]
+            ):
+                raise Exception(f"性能剖析的时间窗口错误：{self.profile_window}，应为 (开始秒数, 结束秒数)")
+            if self.profile_interval <= 0:
+                raise Exception(f"profile_interval 应大于 0。")
+        if self.shard_count > 1:
+            # 分片子进程通过 fork 继承已初始化的 Django 配置和 ETL 实例
+            if "fork" not in multiprocessing.get_all_start_methods():
+                raise Exception(f"当前平台 ({sys.platform}) 不支持 fork 子进程，无法多进程分片，请设置 shard_count = 1")
+            if sys.platform == "darwin":
+                raise Exception(
+                    f"macOS 上 fork 子进程不安全 (系统库在子进程中可能崩溃)，无法多进程分片，请设置 shard_count = 1 或在 Linux 上运行"
+                )
+        for alias in (self.read_alias, self.write_alias):
+            if alias is not None and alias not in connections:
+                raise Exception(f"数据库别名 {alias} 不存在，请在 settings.DATABASES 中配置")
+        if self.throttle_page_size and self.adaptive_page_size:
+            raise Exception(f"throttle_page_size 不能与 adaptive_page_size 同时开启。")
+        for name in ("throttle_write_seconds", "max_rows_per_second", "max_queries_per_second"):
+            if getattr(self, name) is not None and getattr(self, name) <= 0:
+                raise Exception(f"{name} 应大于 0。")
+        if self.archive_format not in ("txt", "gz"):
+            raise Exception(f"不支持的归档文件格式 {self.archive_format}，可选 txt、gz")
 
         # 软删除暂时 不强制。
         # if not issubclass(self.target_model(), SoftDeleteBaseModel):
@@ -381,7 +2185,7 @@ class ETLBase(unittest.TestCase):
     ):
         """
         在归档文件末尾追加内容，按 database 分组存放
-        todo 写入 队列，批量写到文件
+        写入归档写入器的缓冲区，提交数据库之前批量刷盘，参照 ArchiveWriter
         """
 
         # 数据检查
@@ -400,32 +2204,197 @@ class ETLBase(unittest.TestCase):
         # if target_value is None:
         #     raise Exception(f"目标值 target_value 为空，请检查。如果确认为空，请临时注释这个判断")
 
-        meta = dict(
-            database=self.database,
-            table_name=self.table_name,
-            record_id=record_id,
-            field_name=field_name,
-            origin_value=origin_value,
-            target_value=target_value,
-            note=note,
-        )
-        _meta = json.dumps(meta, default=str, ensure_ascii=False)
+        with self._timed("archive"):
+            meta = dict(
+                database=self.database,
+                table_name=self.table_name,
+                record_id=record_id,
+                field_name=field_name,
+                origin_value=origin_value,
+                target_value=target_value,
+                note=note,
+            )
+            _meta = json.dumps(meta, default=str, ensure_ascii=False)
+            if archive_file == self.origin_file:
+                # 原始数据的大小，用于自适应分页尺寸
+                self._page_bytes += len(_meta)
+
+            # 检查 meta 是否已经在目标归档文件 archive_file 中，基于去重索引查重
+            digest = None
+            if archive_file == self.change_field_file:
+                digest = self._line_digest(_meta)
+                if digest in self._load_change_field_index():
+                    # Logger.info(f"归档文件 {archive_file} 中已存在记录，跳过写入。")
+                    return
 
-        # 检查 meta 是否已经在目标归档文件 archive_file 中 todo 未来用缓存或者数据表查重
-        if archive_file == self.change_field_file:
-            if os.path.exists(archive_file):
-                with open(archive_file, "r") as f:
+            if self.pre_check_mode:
+                return
+
+            on_flush = None
+            if digest is not None:
+                on_flush = self._add_change_field_index(digest)
+            self._append_archive_line(archive_file, record_id, _meta, on_flush=on_flush)
+
+    @contextmanager
+    def _archive_session(self):
+        """
+        归档会话，会话期间由归档写入器持有归档文件句柄，结束时刷盘并关闭
+        """
+        if self._archive_writer is not None:
+            # 已在归档会话中
+            yield
+            return
+        self._archive_writer = ArchiveWriter()
+        self._indexed_files = set()
+        try:
+            yield
+        finally:
+            try:
+                self._archive_writer.close()
+            finally:
+                self._archive_writer = None
+
+    def _archive_flush(self, fsync: bool = True):
+        """
+        归档缓冲区写入文件，提交数据库之前调用
+        """
+        if self._archive_writer is not None:
+            with self._timed("archive"):
+                self._archive_writer.flush(fsync=fsync)
+
+    def _write_line(self, archive_file: str, line: str, on_flush=None, fsync: bool = True):
+        """
+        写入一行到归档文件，运行期间写入归档写入器的缓冲区，不在归档会话中时立即写入文件
+        :param on_flush: 刷盘回调 on_flush(位置, 写入后的文件大小)，参照 ArchiveWriter.write()
+        :param fsync: 提交数据库之前是否同步到磁盘，索引文件过期时会重建，无需同步
+        :return: 该行在文件中的位置
+        """
+        if self._archive_writer is None:
+            with self._archive_session():
+                return self._archive_writer.write(archive_file, line, on_flush, fsync)
+        return self._archive_writer.write(archive_file, line, on_flush, fsync)
+
+    def _append_archive_line(
+        self, archive_file: str, record_id: int, line: str, on_flush=None
+    ):
+        """
+        追加一行到归档文件，刷盘时同步追加记录偏移索引
+        :param on_flush: 额外的刷盘回调 on_flush(位置, 写入后的文件大小)
+        """
+        if not self.archive_offset_index:
+            self._write_line(archive_file, line, on_flush)
+            return
+
+        self._offset_index_ready(archive_file)
+        index = self._offset_index(archive_file)
+
+        def _on_flush(position, end):
+            self._write_line(
+                index.index_file,
+                f"{record_id} {ArchiveIndex.format_position(position)} {end}",
+                fsync=False,
+            )
+            if on_flush is not None:
+                on_flush(position, end)
+
+        position = self._write_line(archive_file, line, _on_flush)
+        index.add(record_id, position)
+
+    def _offset_index(self, archive_file: str) -> ArchiveIndex:
+        """
+        归档文件的记录偏移索引
+        """
+        index = self._offset_indexes.get(archive_file)
+        if index is None:
+            index = ArchiveIndex(archive_file)
+            self._offset_indexes[archive_file] = index
+        return index
+
+    def _offset_index_ready(self, archive_file: str):
+        """
+        本次归档会话首次写入归档文件前，校验偏移索引，过期时先重新构建，再追加新的索引
+        """
+        if archive_file in self._indexed_files:
+            return
+        index = self._offset_index(archive_file)
+        if not index.is_valid():
+            index.rebuild()
+        self._indexed_files.add(archive_file)
+
+    @staticmethod
+    def _line_digest(line: str) -> bytes:
+        """
+        归档行的摘要，用于字段变更去重
+        """
+        return hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest()
+
+    def _load_change_field_index(self) -> set:
+        """
+        加载字段变更去重索引，每次运行只加载一次
+        优先读取 __change_field.idx 文件，文件大小与 __change_field.txt 不一致时，重新扫描归档文件构建索引
+        """
+        if self._change_field_index is not None:
+            return self._change_field_index
+
+        index = set()
+        size = 0
+        if os.path.exists(self.change_field_file):
+            size = os.path.getsize(self.change_field_file)
+
+        loaded = False
+        if (
+            self.change_field_index_sidecar
+            and size > 0
+            and os.path.exists(self.change_field_index_file)
+        ):
+            indexed_size = 0
+            with open(self.change_field_index_file, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    digest, indexed_size = line.split(" ")
+                    index.add(bytes.fromhex(digest))
+                    indexed_size = int(indexed_size)
+            if indexed_size == size:
+                loaded = True
+            else:
+                Logger.warning(f"字段变更去重索引已过期，重新构建: {self.change_field_index_file}")
+                index = set()
+
+        if not loaded:
+            if size > 0:
+                with open_archive(self.change_field_file) as f:
                     for line in f:
                         line = line.strip()
-                        if line == _meta:
-                            # Logger.info(f"归档文件 {archive_file} 中已存在记录，跳过写入。")
-                            return
+                        if line:
+                            index.add(self._line_digest(line))
+            if self.change_field_index_sidecar and self.pre_check_mode is False:
+                # 重建索引文件，覆盖过期的内容
+                with open(self.change_field_index_file, "w") as f:
+                    for digest in index:
+                        f.write(f"{digest.hex()} {size}\n")
+        Logger.info(f"字段变更去重索引加载完成：共 {len(index)} 条")
+
+        self._change_field_index = index
+        self._change_field_size = size
+        return index
+
+    def _add_change_field_index(self, digest: bytes):
+        """
+        字段变更写入归档文件时，同步更新去重索引
+        :return: 刷盘回调，归档行写入文件后追加到 __change_field.idx 文件
+        """
+        self._change_field_index.add(digest)
 
-        if self.pre_check_mode:
-            return
+        def _on_flush(position, end):
+            self._change_field_size = end
+            if self.change_field_index_sidecar:
+                self._write_line(
+                    self.change_field_index_file, f"{digest.hex()} {end}", fsync=False
+                )
 
-        with open(archive_file, "a+") as f:
-            f.write(f"{_meta}\n")
+        return _on_flush
 
     def _save_origin(self, record_id: int, data: dict):
         """
@@ -507,19 +2476,19 @@ class ETLBase(unittest.TestCase):
                 raise Exception(
                     f"归档失败：变更的数据类型 {target_value} {type(target_value)} 与原始数据类型 {origin_value} {type(origin_value)}  不一致。"
                 )
-        if target_value is None:
-            if changed_record._meta.get_field(field_name).null is False:
-                raise Exception(
-                    f"{field_name} 字段不允许为空: {self.database}@{self.table_name}.id={changed_record.id}"
-                )
+        snapshot = self._model_snapshot
         if not isinstance(changed_record, self.target_model):
             raise Exception(f"model 必须是 {self.target_model} 类型")
         if not field_name:
             raise Exception(f"存储变更时，字段名不能为空")
-        if not hasattr(changed_record, field_name):
+        if field_name not in snapshot.name_set:
             raise Exception(
                 f"当前记录 {changed_record}{type(changed_record)} 没有 {field_name} 字段，请检查配置"
             )
+        if target_value is None and field_name not in snapshot.nullable_names:
+            raise Exception(
+                f"{field_name} 字段不允许为空: {self.database}@{self.table_name}.id={changed_record.id}"
+            )
 
         note = f"字段变更：{self.database}@{self.table_name}.id={changed_record.id} 字段 {field_name}={origin_value} 调整为 {field_name}={target_value}"
         Logger.info(f"{note}")
@@ -532,9 +2501,10 @@ class ETLBase(unittest.TestCase):
             note=f"{note}",
         )
 
-    def _archive_iter(self, archive_file: str):
+    def _archive_iter(self, archive_file: str, reverse: bool = False):
         """
         归档数据迭代器
+        :param reverse: 是否逆序读取，逆序读取基于记录偏移索引
         """
 
         # 检查 archive_dir 是否存在
@@ -545,32 +2515,89 @@ class ETLBase(unittest.TestCase):
         if not os.path.exists(self.database_archive_dir):
             raise Exception(f"数据归档目录 {self.database_archive_dir} 不存在。")
 
-        # 检查 archive_file 是否存在
-        if not os.path.exists(archive_file):
+        # 检查 archive_file 是否存在，尚未合并的分片归档文件一并读取
+        archive_files = self._archive_files(archive_file)
+        if not archive_files:
             raise Exception(f"数据归档文件 {archive_file} 不存在。")
 
-        # 读取文件
+        is_change_field = archive_file == self.change_field_file
+        for _archive_file, lines in self._archive_file_lines(archive_files, reverse):
+            yield from self._archive_file_iter(_archive_file, lines, is_change_field)
+
+    def _archive_file_lines(self, archive_files: list, reverse: bool = False):
+        """
+        逐个归档文件读取归档行，不解析
+        :param reverse: 是否逆序读取，逆序读取基于记录偏移索引
+        :return: (归档文件, (行号或偏移, 行) 迭代器) 迭代器
+        """
+        if reverse:
+            archive_files = archive_files[::-1]
+        for _archive_file in archive_files:
+            if reverse:
+                index = self._offset_index(_archive_file)
+                # 位置按块从索引文件逆序读取，两个迭代器同步前进，内存占用与归档大小无关
+                offsets, positions = itertools.tee(index.reverse_offsets())
+                lines = zip(
+                    (f"@{index.format_position(offset)}" for offset in offsets),
+                    index.read(positions, reverse=True),
+                )
+            else:
+                lines = self._archive_lines(_archive_file)
+            yield _archive_file, lines
+
+    def _archive_history(self, archive_file: str, record_id: int) -> list:
+        """
+        基于记录偏移索引，查找一条记录在归档文件中的所有历史，按写入顺序排列
+        """
+        history = []
+        for _archive_file in self._archive_files(archive_file):
+            index = self._offset_index(_archive_file)
+            offsets = index.offsets(record_id)
+            lines = zip(
+                (f"@{index.format_position(offset)}" for offset in offsets),
+                index.read(offsets),
+            )
+            history.extend(
+                self._archive_file_iter(
+                    _archive_file, lines, archive_file == self.change_field_file
+                )
+            )
+        return history
+
+    @staticmethod
+    def _archive_lines(archive_file: str):
+        """
+        顺序读取归档文件
+        :return: (行号, 行) 迭代器
+        """
+        with open_archive(archive_file) as f:
+            for line_no, line in enumerate(f, start=1):
+                yield line_no, line
+
+    def _archive_file_iter(self, archive_file: str, lines, is_change_field: bool):
+        """
+        解析单个归档文件的归档行
+        :param lines: (行号或偏移, 行) 迭代器
+        :param is_change_field: 是否为字段变更归档，需要检查字段名称
+        """
         # Logger.info(f"归档文件数据恢复: {archive_file}")
-        line_no = 0
-        with open(archive_file, "r") as f:
-            for line in f:
-                line_no += 1
-                line = line.strip()
-                if not line:
-                    raise Exception(f"归档文件 {archive_file}:{line_no} 中存在空行。")
-                meta = json.loads(line)
-                if not meta["database"]:
-                    raise Exception(f"归档文件 {archive_file}:{line_no} 数据库名为空。")
-                if not meta["table_name"]:
-                    raise Exception(f"归档文件 {archive_file}:{line_no} 表名为空。")
-                if not meta["record_id"]:
-                    raise Exception(f"归档文件 {archive_file}:{line_no} 记录 ID 为空。")
-                if archive_file == self.change_field_file:
-                    if not meta["field_name"]:
-                        raise Exception(f"归档文件 {archive_file}:{line_no} 字段名称为空。")
-                # if meta["origin_value"] is None:
-                #     raise Exception(f"归档文件 {archive_file}:{line_no} 原始值为空，请提供默认值。")
-                yield meta
+        for line_no, line in lines:
+            line = line.strip()
+            if not line:
+                raise Exception(f"归档文件 {archive_file}:{line_no} 中存在空行。")
+            meta = json.loads(line)
+            if not meta["database"]:
+                raise Exception(f"归档文件 {archive_file}:{line_no} 数据库名为空。")
+            if not meta["table_name"]:
+                raise Exception(f"归档文件 {archive_file}:{line_no} 表名为空。")
+            if not meta["record_id"]:
+                raise Exception(f"归档文件 {archive_file}:{line_no} 记录 ID 为空。")
+            if is_change_field:
+                if not meta["field_name"]:
+                    raise Exception(f"归档文件 {archive_file}:{line_no} 字段名称为空。")
+            # if meta["origin_value"] is None:
+            #     raise Exception(f"归档文件 {archive_file}:{line_no} 原始值为空，请提供默认值。")
+            yield meta
 
     def _recover_origin(self):
         """
@@ -590,11 +2617,44 @@ class ETLBase(unittest.TestCase):
     def _recover_record(self, archive_file: str):
         """
         基于完整数据文件恢复
-        todo 未来存储到数据表后，逆序读取逆序数据恢复。
-        todo 批量提交
+        基于记录偏移索引逆序读取，同一条记录被多次清洗时，最早的原始数据最后恢复。
+        """
+        self._start_metrics(ArchiveSceneEnum.data_recover.value)
+        self._start_throttle()
+        try:
+            if self.shard_count > 1:
+                recover_count = self._recover_shards(
+                    functools.partial(self._recover_record_items, archive_file),
+                    archive_file,
+                    reverse=True,
+                )
+            else:
+                recover_count = self._recover_record_items(archive_file)
+        except Exception:
+            self._finish_metrics(finished=False)
+            raise
+
+        # 归档文件上传到 oss
+        if recover_count > 0:
+            Logger.info(f"成功恢复：共 {recover_count} 条记录")
+        else:
+            Logger.info(f"未恢复任何数据")
+        self._finish_metrics()
+
+    def _recover_record_items(self, archive_file: str, metas=None) -> int:
+        """
+        分批恢复完整数据文件中的记录，每批 recover_chunk_size 条
+        :param metas: 归档数据迭代器，分片进程为分片临时文件中的数据，默认逆序读取整个归档文件
+        :return: 恢复的记录数
         """
+        if self.recover_chunk_size < 1:
+            raise Exception(f"recover_chunk_size 不能小于 1。")
+
+        if metas is None:
+            metas = self._archive_iter(archive_file, reverse=True)
         recover_count = 0
-        for meta in self._archive_iter(archive_file):
+        chunk = []
+        for meta in metas:
             database: str = meta["database"]
             table_name: str = meta["table_name"]
             record_id: int = meta["record_id"]
@@ -627,31 +2687,196 @@ class ETLBase(unittest.TestCase):
                 if not hasattr(model, field_name):
                     raise Exception(f"表字段未找到 {model} 没有 {field_name} 字段，请检查配置")
 
-            # 基于已有数据更新
-            records: models.QuerySet = model.objects.filter(id=record_id)
-            if len(records) > 1:
-                raise Exception(f"恢复数据的 record_id 存在多条记录，请检查数据库")
-
-            # todo 放入队列，异步提交
-            if records:
-                # 还原旧数据
-                if self.pre_check_mode is False:
-                    records.update(**archive_origin_value)
-                Logger.info(f"恢复成功: {self.database}@{table_name}.id={record_id}")
+            chunk.append(meta)
+            if len(chunk) >= self.recover_chunk_size:
+                recover_count += self._recover_chunk(self._recover_record_chunk, chunk)
+                chunk = []
+
+        if chunk:
+            recover_count += self._recover_chunk(self._recover_record_chunk, chunk)
+        return recover_count
+
+    def _recover_record_chunk(self, metas: list) -> int:
+        """
+        恢复一批完整数据：一次查询区分已存在和已删除的记录，
+        已存在的记录参照 _restore_records() 还原，已删除的记录用 bulk_create 重新创建，整批在一个事务中提交。
+        已删除的记录只有归档了所有字段时才重新创建 (archive_full_row = False 时只归档了部分字段，
+        其余字段会被填为默认值)，否则跳过并记录警告。
+        同一条记录在本批中出现多次时，以最后一次为准 (逆序读取时即最早的一次)。
+        :return: 恢复的记录数，不包括跳过的记录
+        """
+        model = self.target_model
+        opts = model._meta
+        m2m_names = {f.name for f in opts.many_to_many}
+
+        values = {}  # record_id -> 完整数据
+        for meta in metas:
+            values[meta["record_id"]] = meta["origin_value"]
+        # 更新还是重新创建取决于记录是否存在，从库延迟时可能误判，提交时在主库上查询
+        alias = self.write_alias if self.pre_check_mode is False else self._read_alias
+        with self._timed("fetch"):
+            existing_ids = set(
+                model.objects.using(alias).filter(id__in=list(values)).values_list("id", flat=True)
+            )
+
+        # 按字段组合分组，同一组的记录一起还原
+        update_groups = {}  # 字段名 tuple -> [记录, ...]
+        create_records = []
+        m2m_values = {}  # record_id -> {多对多字段名: [关联 id, ...]}
+        skipped_ids = set()
+        for record_id, data in values.items():
+            if record_id not in existing_ids and not all(
+                f.name in data for f in opts.concrete_fields
+            ):
+                skipped_ids.add(record_id)
+                continue
+            kwargs = {}
+            for field_name, value in data.items():
+                if field_name in m2m_names:
+                    m2m_values.setdefault(record_id, {})[field_name] = value
+                else:
+                    kwargs[opts.get_field(field_name).attname] = value
+            record = model(**kwargs)
+            if record_id in existing_ids:
+                fields = tuple(
+                    f.name
+                    for f in opts.concrete_fields
+                    if f.name in data and not f.primary_key
+                )
+                update_groups.setdefault(fields, []).append(record)
+            else:
+                create_records.append(record)
+
+        if self.pre_check_mode is False:
+            manager = model.objects.db_manager(self.write_alias)
+            with self._timed("db_write"), transaction.atomic(using=self.write_alias):
+                for fields, records in update_groups.items():
+                    if fields:
+                        self._restore_records(manager, fields, records)
+                if create_records:
+                    manager.bulk_create(create_records)
+                self._restore_m2m(m2m_values)
+
+        for record_id in values:
+            if record_id in existing_ids:
+                Logger.info(f"恢复成功: {self.database}@{self.table_name}.id={record_id}")
+            elif record_id in skipped_ids:
+                Logger.warning(
+                    f"记录已删除且归档数据不完整，跳过重新创建，请手动恢复: {self.database}@{self.table_name}.id={record_id}"
+                )
             else:
-                # 创建新数据
-                record = model(**archive_origin_value)
-                if self.pre_check_mode is False:
-                    record.save()
-                Logger.info(f"创建成功: {self.database}@{table_name}.id={record_id}")
+                Logger.info(f"创建成功: {self.database}@{self.table_name}.id={record_id}")
+        return len(values) - len(skipped_ids)
 
-            recover_count += 1
+    def _restore_records(self, manager, fields: tuple, records: list):
+        """
+        还原已存在的记录的指定字段 (在事务中调用)：
+        数据库支持时每批用一条 UPDATE ... FROM (VALUES ...) 还原，一次往返更新一批记录，归档中 auto_now 字段的值原样还原；
+        其他数据库使用 bulk_update，每批 100 条，限制 CASE WHEN 的大小 (记录多、字段多时 CASE WHEN 的编译非常慢)。
+        :param fields: 需要还原的字段名，不包括主键
+        """
+        connection = connections[manager.db]
+        if not self._values_update_supported(connection):
+            manager.bulk_update(records, list(fields), batch_size=100)
+            return
+        opts = self.target_model._meta
+        columns = [opts.pk] + [opts.get_field(name) for name in fields]
+        # 每批的参数个数不超过 32767 (PostgreSQL 服务端绑定参数的上限为 65535)
+        batch_size = max(
+            min(connection.ops.bulk_batch_size(columns, records), 32767 // len(columns)), 1
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(records), batch_size):
+                cursor.execute(
+                    *self._values_update_sql(connection, columns, records[start : start + batch_size])
+                )
 
-        # 归档文件上传到 oss
-        if recover_count > 0:
-            Logger.info(f"成功恢复：共 {recover_count} 条记录")
+    def _values_update_sql(self, connection, columns: list, records: list) -> (str, list):
+        """
+        按 VALUES 中的数据批量更新记录的 SQL
+        :param columns: 主键和需要更新的字段
+        :return: (sql, params)
+        """
+        qn = connection.ops.quote_name
+        table = qn(self.target_model._meta.db_table)
+        names = [qn(f.column) for f in columns]
+        params = [
+            f.get_db_prep_save(getattr(record, f.attname), connection)
+            for record in records
+            for f in columns
+        ]
+        if connection.vendor == "postgresql":
+            # VALUES 中的参数没有类型，按字段的类型转换
+            row = f"({', '.join(f'%s::{f.cast_db_type(connection)}' for f in columns)})"
         else:
-            Logger.info(f"未恢复任何数据")
+            row = f"({', '.join('%s' for _ in columns)})"
+
+        if connection.vendor == "mysql":
+            rows = ", ".join([f"ROW{row}"] * len(records))
+            sets = ", ".join(f"{table}.{name} = restored.{name}" for name in names[1:])
+            return (
+                f"UPDATE {table} JOIN (VALUES {rows}) AS restored ({', '.join(names)}) "
+                f"ON {table}.{names[0]} = restored.{names[0]} SET {sets}",
+                params,
+            )
+        rows = ", ".join([row] * len(records))
+        if connection.vendor == "sqlite":
+            # SQLite 的 VALUES 不能指定列名，依次为 column1、column2 ...
+            values_names = [f"column{i + 1}" for i in range(len(columns))]
+            alias = "restored"
+        else:
+            values_names = names
+            alias = f"restored ({', '.join(names)})"
+        sets = ", ".join(
+            f"{name} = restored.{value_name}" for name, value_name in zip(names[1:], values_names[1:])
+        )
+        return (
+            f"UPDATE {table} SET {sets} FROM (VALUES {rows}) AS {alias} "
+            f"WHERE {table}.{names[0]} = restored.{values_names[0]}",
+            params,
+        )
+
+    @staticmethod
+    def _values_update_supported(connection) -> bool:
+        """
+        数据库是否支持按 VALUES 批量更新：PostgreSQL、SQLite 3.33 及以上 (UPDATE ... FROM)、MySQL 8.0.19 及以上 (VALUES ROW())
+        """
+        if connection.vendor == "postgresql":
+            return True
+        if connection.vendor == "sqlite":
+            return connection.Database.sqlite_version_info >= (3, 33)
+        if connection.vendor == "mysql":
+            return not connection.mysql_is_mariadb and connection.mysql_version >= (8, 0, 19)
+        return False
+
+    def _restore_m2m(self, m2m_values: dict):
+        """
+        还原多对多关系：删除记录现有的关联，再批量写入归档的关联
+        :param m2m_values: record_id -> {多对多字段名: [关联 id, ...]}
+        """
+        for f in self.target_model._meta.many_to_many:
+            values = {
+                record_id: data[f.name]
+                for record_id, data in m2m_values.items()
+                if f.name in data
+            }
+            if not values:
+                continue
+            through = f.remote_field.through
+            if not through._meta.auto_created:
+                Logger.warning(f"多对多字段 {f.name} 使用了自定义中间表，请手动恢复: {list(values)}")
+                continue
+            source = through._meta.get_field(f.m2m_field_name()).attname
+            target = through._meta.get_field(f.m2m_reverse_field_name()).attname
+            manager = through.objects.db_manager(self.write_alias)
+            manager.filter(**{f"{source}__in": list(values)}).delete()
+            manager.bulk_create(
+                [
+                    through(**{source: record_id, target: target_id})
+                    for record_id, target_ids in values.items()
+                    for target_id in target_ids
+                ]
+            )
 
     def _zip_archive(self):
         """
@@ -672,7 +2897,15 @@ class ETLBase(unittest.TestCase):
             return
 
         Logger.info(f"开始打包目录 {src_dir} 为 {out_file}.zip")
-        shutil.make_archive(out_file, format="zip", root_dir=src_dir, base_dir=src_dir)
+        with zipfile.ZipFile(f"{out_file}.zip", "w", zipfile.ZIP_DEFLATED) as zf:
+            for root, _, files in os.walk(src_dir):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    # .gz 归档文件已压缩，直接存储，避免重复压缩
+                    compress_type = (
+                        zipfile.ZIP_STORED if is_compressed(path) else zipfile.ZIP_DEFLATED
+                    )
+                    zf.write(path, arcname=path, compress_type=compress_type)
 
         filesize = os.path.getsize(f"{out_file}.zip")
         filesize /= 1024  # kb
@@ -695,21 +2928,103 @@ class ETLBase(unittest.TestCase):
         if config.OssConfig.auto_upload_oss is not True:
             return
 
-        zip_file = self._zip_archive()
-        name = os.path.basename(zip_file)
+        if self.stream_upload:
+            with self._timed("upload"):
+                self._finish_stream_upload(scene)
+            return
+
+        with self._timed("zip"):
+            zip_file = self._zip_archive()
+        name = self._upload_key(scene, os.path.basename(zip_file))
+        # 上传到 oss，大文件分片并行上传，中断后重新运行时断点续传
+        try:
+            transport = self._upload_transport()
+            with self._timed("upload"):
+                transport.upload_file(name, zip_file)
+            Logger.info(f"归档文件 {name} 成功上传到 oss")
+            Logger.info(f"归档文件访问地址：{transport.url(name)}")
+        except Exception as e:
+            Logger.warning(f"归档文件上传到 OSS 异常: {e}")
+
+    def _upload_transport(self):
+        """
+        归档上传方式，默认上传到 OSS
+        """
+        if self.upload_transport is not None:
+            return self.upload_transport
+        return OssTransport(bucket, checkpoint_dir=f"{self.archive_dir}/.oss_checkpoint")
+
+    def _upload_key(self, scene: str, name: str) -> str:
+        """
+        归档文件上传后的对象 key
+        """
         user = os.getenv("USER") or "developer"
-        name = f"data_fix/archive-{datetime.now().strftime('%Y-%m-%d')}/{self.database}/{self.table_name}/{user}-{scene}-{name}"
-        # 上传到 oss
+        return f"data_fix/archive-{datetime.now().strftime('%Y-%m-%d')}/{self.database}/{self.table_name}/{user}-{scene}-{name}"
+
+    def _start_stream_upload(self, scene: str):
+        """
+        开启后台分片上传，清洗期间每页提交后上传已写满的分片
+        """
+        if not self.stream_upload or self.pre_check_mode:
+            return
+        if config.OssConfig.auto_upload_oss is not True:
+            return
+        self._archive_uploader = ArchiveUploader(
+            self._upload_transport(), self.upload_manifest_file, self.upload_part_size
+        )
+        for archive_file in (self.origin_file, self.change_field_file, self.changed_file):
+            self._archive_uploader.track(
+                archive_file, self._upload_key(scene, os.path.basename(archive_file))
+            )
+
+    def _stop_stream_upload(self):
+        """
+        停止后台上传线程，未完成的上传记录在上传清单中，之后根据清单继续
+        """
+        uploader = self._archive_uploader
+        self._archive_uploader = None
+        if uploader is not None:
+            uploader.close()
+
+    def _finish_stream_upload(self, scene: str):
+        """
+        上传归档文件剩余的内容并完成分片上传，索引、断点等小文件整体上传
+        """
+        uploader = self._archive_uploader
+        self._archive_uploader = None
         try:
-            result = bucket.put_object_from_file(name, zip_file)
-            if result.status != 200:
-                Logger.warning(
-                    f"归档文件 {name} 上传到 oss 失败: {result.request_id} {result.status}"
-                )
-            else:
-                Logger.info(f"归档文件 {name} 成功上传到 oss")
-                Logger.info(
-                    f"归档文件访问地址：https://oss.console.aliyun.com/bucket/oss-cn-hangzhou/express-image/object?path=data_fix%2F"
+            if uploader is None:
+                # 未开启后台上传或后台上传已中断，根据上传清单继续
+                uploader = ArchiveUploader(
+                    self._upload_transport(), self.upload_manifest_file, self.upload_part_size
                 )
+            archive_files = (
+                self.origin_file,
+                self.change_field_file,
+                self.changed_file,
+                self.recovered_file,
+            )
+            for archive_file in archive_files:
+                if os.path.exists(archive_file):
+                    uploader.track(
+                        archive_file, self._upload_key(scene, os.path.basename(archive_file))
+                    )
+            keys = uploader.finish()
+
+            for name in sorted(os.listdir(self.database_archive_dir)):
+                path = f"{self.database_archive_dir}/{name}"
+                if (
+                    path in archive_files
+                    or path == self.upload_manifest_file
+                    or name.endswith(".tmp")
+                    or not os.path.isfile(path)
+                ):
+                    continue
+                key = self._upload_key(scene, name)
+                uploader.transport.upload_file(key, path)
+                keys.append(key)
+
+            for key in keys:
+                Logger.info(f"归档文件成功上传到 oss：{uploader.transport.url(key)}")
         except Exception as e:
             Logger.warning(f"归档文件上传到 OSS 异常: {e}")
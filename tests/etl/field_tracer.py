@@ -0,0 +1,143 @@
+import threading
+from contextlib import contextmanager
+
+from tests.etl import Logger
+from tests.etl.snapshot import ModelSnapshot
+
+# 可原地修改的字段类型，原地修改不会替换属性值，无法追踪，始终对比
+MUTABLE_FIELD_TYPES = ("JSONField", "ArrayField", "HStoreField")
+
+# 记录的 __dict__ 中没有该属性 (如延迟加载的字段)
+_MISSING = object()
+
+
+class FieldTracer:
+    """
+    清洗规则写入字段的追踪器：执行清洗规则前后，按对象标识对比记录各字段属性的值，得到写入的字段，
+    不修改记录的类，也不创建额外的模型
+    预热 warmup 条记录时仍对比所有字段，同时学习写入的字段 (以及未替换属性值就发生变更的字段)，
+    预热之后只对比学习到的字段；之后出现新的写入字段时，扩大对比范围，不会遗漏变更。
+    多对多字段、GenericForeignKey 等私有字段、可原地修改的字段和 auto_now 字段始终对比。
+    """
+
+    def __init__(self, model, fields: tuple = None, warmup: int = 100):
+        """
+        :param fields: 快照包含的字段名，None 表示所有字段，参照 ModelSnapshot.of()
+        :param warmup: 预热的记录数
+        """
+        self.model = model
+        self.fields = fields
+        self.warmup = warmup
+        snapshot = ModelSnapshot.of(model, fields)
+        opts = model._meta
+        # 属性名 (包括外键的 xxx_id) -> 字段名
+        self._names = {}
+        for f in opts.concrete_fields:
+            if f.name in snapshot.names:
+                self._names[f.name] = f.name
+                self._names[f.attname] = f.name
+        # 追踪时对比的属性名，外键只对比 xxx_id
+        self._attnames = tuple(
+            f.attname for f in opts.concrete_fields if f.name in snapshot.names
+        )
+        self._always = {f.name for f in snapshot.m2m_fields}
+        self._always.update(f.name for f in opts.private_fields if f.name in snapshot.names)
+        self._always.update(f.name for f in snapshot.auto_now_fields)
+        self._always.update(
+            f.name
+            for f in opts.concrete_fields
+            if f.name in snapshot.names and f.get_internal_type() in MUTABLE_FIELD_TYPES
+        )
+        self._learned = set()  # 学习到的写入字段
+        self._count = 0  # 已预热的记录数
+        self._narrowed = None  # (对比用的快照器, 在完整快照中的下标)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, records: list):
+        """
+        追踪清洗规则对 records 的写入：执行前后按对象标识对比记录 __dict__ 中各字段属性的值，
+        重新赋值的属性即为写入的字段 (赋值为同一个对象时值不变，不影响对比结果)
+        :return: 与 records 一一对应的写入字段名集合，退出时填充；记录不是 model 类型 (无法追踪) 时为 None
+        """
+        attnames = self._attnames
+        before = [
+            tuple(record.__dict__.get(name, _MISSING) for name in attnames)
+            if isinstance(record, self.model)
+            else None
+            for record in records
+        ]
+        writes = [None] * len(records)
+        try:
+            yield writes
+        finally:
+            for i, (record, values) in enumerate(zip(records, before)):
+                if values is None:
+                    continue
+                current = record.__dict__
+                writes[i] = {
+                    self._names[name]
+                    for name, value in zip(attnames, values)
+                    if current.get(name, _MISSING) is not value
+                }
+
+    def narrowed(self, written: set):
+        """
+        预热之后，对比使用的快照器
+        :param written: 本条记录写入的字段，None 表示无法追踪
+        :return: (快照器, 快照器各字段在完整快照中的下标)，预热期间或无法追踪时为 None (对比所有字段)
+        """
+        if written is None:
+            return None
+        with self._lock:
+            if self._count < self.warmup:
+                return None
+            unknown = written - self._learned
+            if unknown:
+                Logger.warning(f"清洗规则写入了预热阶段未出现的字段 {sorted(unknown)}，扩大对比范围")
+                self._learned.update(unknown)
+                self._narrowed = None
+            if self._narrowed is None:
+                self._narrowed = self._compile()
+            return self._narrowed
+
+    def observe(self, written: set, changed_fields: list):
+        """
+        对比所有字段后，学习写入和变更的字段
+        :param written: 本条记录写入的字段，None 表示无法追踪
+        :param changed_fields: 本条记录变更的字段
+        """
+        with self._lock:
+            if written is not None:
+                self._learned.update(written)
+            # 没有替换属性值的变更 (如原地修改)，之后始终对比
+            untraced = set(changed_fields) - self._learned
+            if untraced:
+                self._learned.update(untraced)
+                self._narrowed = None
+            if written is None or self._count >= self.warmup:
+                return
+            self._count += 1
+            if self._count == self.warmup:
+                Logger.info(
+                    f"字段追踪预热完成：清洗规则写入的字段 {sorted(self._learned)}，之后只对比这些字段 (以及 {sorted(self._always)})"
+                )
+
+    def update_fields(self, changed_fields: list) -> list:
+        """
+        逐条提交时 save(update_fields) 的字段：变更的字段加上 auto_now 字段，多对多字段不在本表中
+        """
+        snapshot = ModelSnapshot.of(self.model)
+        update_fields = [name for name in changed_fields if name in snapshot.concrete_names]
+        update_fields.extend(
+            f.name for f in snapshot.auto_now_fields if f.name not in update_fields
+        )
+        return update_fields
+
+    def _compile(self) -> tuple:
+        snapshot = ModelSnapshot.of(self.model, self.fields)
+        names = self._learned | self._always
+        narrowed = ModelSnapshot.of(
+            self.model, tuple(name for name in snapshot.names if name in names)
+        )
+        return narrowed, tuple(snapshot.names.index(name) for name in narrowed.names)
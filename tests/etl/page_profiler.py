@@ -0,0 +1,175 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from tests.etl import Logger
+
+# 剖析方式：cprofile 确定性剖析，sample 采样剖析
+MODES = ("cprofile", "sample")
+
+
+class PageProfiler:
+    """
+    按页的性能剖析：每 every 页剖析一页，或剖析时间窗口内开始的所有页，每页的结果写入一个文件
+    cprofile：cProfile 记录每个函数的调用次数和耗时，写入 .prof 文件 (pstats 格式，可用 snakeviz 等工具查看)；
+    sample：后台线程每隔 interval 秒采集一次处理该页的线程的调用栈，开销低，
+    写入 .collapsed 文件 (折叠调用栈格式，可用 flamegraph.pl、speedscope 生成火焰图)。
+    同一时间只剖析一页，流水线模式下其他线程同时处理的页不剖析。
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        file_prefix: str,
+        every: int = 10,
+        window: tuple = None,
+        interval: float = 0.005,
+        rule_codes: tuple = (),
+    ):
+        """
+        :param file_prefix: 剖析结果文件的前缀，文件名为 {file_prefix}_page{页码}_{最小 id}-{最大 id}.prof
+        :param every: 每隔多少页剖析一页，从第 1 页开始
+        :param window: (开始秒数, 结束秒数)，相对于创建剖析器的时间，设置后不再按 every 选取
+        :param interval: 采样间隔 (秒)
+        :param rule_codes: 清洗规则的代码对象，用于统计清洗规则的耗时占比
+        """
+        self.mode = mode
+        self.file_prefix = file_prefix
+        self.every = every
+        self.window = window
+        self.interval = interval
+        self.rule_codes = frozenset(rule_codes)
+        self._started = time.time()
+        self._active = False  # 是否有页正在剖析
+        self._lock = threading.Lock()
+
+    def selected(self, page_no: int) -> bool:
+        """
+        第 page_no 页 (从 1 开始) 是否需要剖析
+        """
+        if self.window is not None:
+            start, end = self.window
+            return start <= time.time() - self._started < end
+        return (page_no - 1) % self.every == 0
+
+    @contextmanager
+    def page(self, page_no: int):
+        """
+        剖析一页，代码块内设置 page["ids"] = (最小 id, 最大 id)，未设置 (如空页) 时不写入结果
+        :return: 本页的信息 (dict)
+        """
+        page = {}
+        with self._lock:
+            profiled = not self._active and self.selected(page_no)
+            if profiled:
+                self._active = True
+        if not profiled:
+            yield page
+            return
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+        else:
+            profiler = _Sampler(threading.get_ident(), self.interval, self.rule_codes)
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # 已有其他剖析器 (如外部运行的 cProfile) 时无法开启，本页不剖析
+            Logger.warning(f"第 {page_no} 页的性能剖析无法开启: {e}")
+            with self._lock:
+                self._active = False
+            yield page
+            return
+        started = time.perf_counter()
+        try:
+            yield page
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self._active = False
+            if "ids" in page:
+                self._save(profiler, page_no, page["ids"], seconds)
+
+    def _save(self, profiler, page_no: int, ids: tuple, seconds: float):
+        file = f"{self.file_prefix}_page{page_no}_{ids[0]}-{ids[1]}"
+        try:
+            if self.mode == "cprofile":
+                file += ".prof"
+                profiler.dump_stats(file)
+                rule_seconds = self._rule_seconds(profiler)
+            else:
+                file += ".collapsed"
+                profiler.dump(file)
+                rule_seconds = profiler.rule_ratio() * seconds
+        except Exception as e:
+            # 剖析结果写入失败不影响清洗
+            Logger.warning(f"第 {page_no} 页的性能剖析结果写入失败: {e}")
+            return
+        Logger.info(
+            f"性能剖析：第 {page_no} 页 (id 范围 [{ids[0]}, {ids[1]}]) 耗时 {seconds:.3f}s，"
+            f"清洗规则约 {rule_seconds:.3f}s ({rule_seconds / seconds if seconds > 0 else 0:.0%})，"
+            f"剖析结果：{file}"
+        )
+
+    def _rule_seconds(self, profiler: cProfile.Profile) -> float:
+        """
+        清洗规则的累计耗时，rule_batch 等可能调用 rule，取最大值避免重复计算
+        """
+        keys = {(c.co_filename, c.co_firstlineno, c.co_name) for c in self.rule_codes}
+        stats = pstats.Stats(profiler).stats
+        return max((stats[key][3] for key in keys if key in stats), default=0.0)
+
+
+class _Sampler:
+    """
+    采样剖析器：后台线程定期采集目标线程的调用栈，按调用栈计数
+    """
+
+    def __init__(self, ident: int, interval: float, rule_codes: frozenset):
+        self.ident = ident  # 目标线程
+        self.interval = interval
+        self.rule_codes = rule_codes
+        self.stacks = Counter()  # 调用栈 (a;b;c) -> 采样次数
+        self.samples = 0
+        self.rule_samples = 0  # 位于清洗规则中的采样次数
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread = threading.Thread(target=self._run, name="etl-profile-sampler", daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def rule_ratio(self) -> float:
+        return self.rule_samples / self.samples if self.samples else 0.0
+
+    def dump(self, file: str):
+        with open(file, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+            frames = []
+            in_rule = False
+            while frame is not None:
+                code = frame.f_code
+                in_rule = in_rule or code in self.rule_codes
+                name = os.path.basename(code.co_filename)
+                frames.append(f"{code.co_name} ({name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.reverse()
+            self.stacks[";".join(frames)] += 1
+            self.samples += 1
+            self.rule_samples += in_rule
@@ -0,0 +1,60 @@
+from tests.etl import Logger
+
+
+class PageSizeTuner:
+    """
+    自适应分页尺寸：根据每页的耗时和数据量，在 [min_size, max_size] 范围内调整分页尺寸，使每页耗时接近 target_seconds
+    吞吐量取指数平滑后的值，每次最多放大 2 倍或缩小一半，变化不足 10% 时不调整，避免抖动。
+    """
+
+    def __init__(
+        self,
+        page_size: int,
+        min_size: int,
+        max_size: int,
+        target_seconds: float,
+        max_bytes: int = None,
+    ):
+        self.page_size = min(max(page_size, min_size), max_size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes  # 每页数据的大致上限 (字节)，None 表示不限制
+        self._rows_per_second = None  # 平滑后的吞吐量 (条/秒)
+        self._bytes_per_row = None  # 平滑后的每条记录大小 (字节)
+
+    def update(self, rows: int, seconds: float, payload_bytes: int, fetch_seconds: float) -> int:
+        """
+        一页处理完成后，根据本页的耗时调整分页尺寸
+        :param rows: 本页的记录数
+        :param seconds: 本页的总耗时 (查询、清洗、提交)
+        :param payload_bytes: 本页数据的大致大小
+        :param fetch_seconds: 本页的查询耗时
+        :return: 下一页的分页尺寸
+        """
+        # 最后一页不足一页时，耗时不具有参考价值
+        if rows < self.page_size or rows == 0 or seconds <= 0:
+            return self.page_size
+
+        self._rows_per_second = self._smooth(self._rows_per_second, rows / seconds)
+        self._bytes_per_row = self._smooth(self._bytes_per_row, payload_bytes / rows)
+
+        size = self._rows_per_second * self.target_seconds
+        if self.max_bytes and self._bytes_per_row:
+            size = min(size, self.max_bytes / self._bytes_per_row)
+        size = min(max(size, self.page_size / 2), self.page_size * 2)
+        size = int(min(max(size, self.min_size), self.max_size))
+
+        if abs(size - self.page_size) >= self.page_size * 0.1:
+            Logger.info(
+                f"分页尺寸调整: {self.page_size} -> {size}，上一页耗时 {seconds:.2f}s (查询 {fetch_seconds:.2f}s)，"
+                f"{self._rows_per_second:.0f} 条/s，约 {payload_bytes / 1024:.0f} KB/页"
+            )
+            self.page_size = size
+        return self.page_size
+
+    @staticmethod
+    def _smooth(value: float, sample: float) -> float:
+        if value is None:
+            return sample
+        return value * 0.7 + sample * 0.3
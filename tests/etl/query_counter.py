@@ -0,0 +1,91 @@
+import threading
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+# 查询来源：框架 (抽取、归档、提交) 和清洗规则
+SOURCES = ("framework", "rule")
+
+
+class QueryCounter:
+    """
+    SQL 查询计数：通过 connection.execute_wrapper 统计执行的 SQL，按页和来源 (框架、清洗规则) 分别计数
+    数据库连接是线程独立的，每个执行查询的线程都需要调用 install()；
+    查询所属的页和来源由当前线程的 scope() 决定，流水线模式下各线程同时处理不同的页，计数互不影响。
+    """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(SOURCES, 0)
+        self._pages = {}  # 页的标识 -> {来源: 查询数}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def install(self):
+        """
+        当前线程的所有数据库连接开始计数
+        """
+        if getattr(self._local, "installed", False):
+            yield
+            return
+        self._local.installed = True
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(self._execute))
+                yield
+        finally:
+            self._local.installed = False
+
+    @contextmanager
+    def scope(self, page=None, source: str = None):
+        """
+        设置当前线程执行的查询所属的页和来源，None 表示沿用外层的设置
+        """
+        local = self._local
+        saved = (getattr(local, "page", None), getattr(local, "source", "framework"))
+        if page is not None:
+            local.page = page
+        if source is not None:
+            local.source = source
+        try:
+            yield
+        finally:
+            local.page, local.source = saved
+
+    def current_page(self):
+        """
+        当前线程查询所属的页
+        """
+        return getattr(self._local, "page", None)
+
+    def move(self, page, target_page):
+        """
+        查询前无法确定页的标识时 (如分页查询)，将计数合并到新的标识下
+        """
+        with self._lock:
+            counts = self._pages.pop(page, None)
+            if counts is None:
+                return
+            target = self._pages.setdefault(target_page, dict.fromkeys(SOURCES, 0))
+            for source, count in counts.items():
+                target[source] += count
+
+    def pop(self, page) -> dict:
+        """
+        取出一页的查询数
+        :return: {来源: 查询数}
+        """
+        with self._lock:
+            return self._pages.pop(page, None) or dict.fromkeys(SOURCES, 0)
+
+    def _execute(self, execute, sql, params, many, context):
+        page = getattr(self._local, "page", None)
+        source = getattr(self._local, "source", "framework")
+        with self._lock:
+            self.totals[source] += 1
+            counts = self._pages.get(page)
+            if counts is None:
+                counts = self._pages[page] = dict.fromkeys(SOURCES, 0)
+            counts[source] += 1
+        return execute(sql, params, many, context)
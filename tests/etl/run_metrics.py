@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from tests.etl import Logger
+
+# 每页统计的阶段
+PHASES = ("fetch", "rule", "diff", "archive", "db_write", "zip", "upload", "throttle")
+
+
+class RunMetrics:
+    """
+    运行指标：各阶段耗时、每页耗时、SQL 查询数、吞吐量和预计剩余时间，定期写入 JSON 报告和 Prometheus textfile
+    各阶段耗时为所有线程的累计值，流水线模式下各阶段并行，累计耗时可能超过总耗时。
+    """
+
+    def __init__(
+        self,
+        scene: str,
+        database: str,
+        table_name: str,
+        report_file: str,
+        prom_file: str,
+        waiting_count: int = None,
+        interval: float = 5.0,
+    ):
+        self.scene = scene
+        self.database = database
+        self.table_name = table_name
+        self.report_file = report_file  # JSON 报告
+        self.prom_file = prom_file  # Prometheus textfile，可由 node_exporter 的 textfile collector 采集
+        self.waiting_count = waiting_count  # 待处理的记录数，None 表示未知，无法估算剩余时间
+        self.interval = interval  # 报告的写入间隔 (秒)
+        self.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.pages = 0
+        self.rows = 0  # 本次运行处理的记录数
+        self.changes = 0  # 本次运行变更的记录数
+        self.scanned = 0  # 已处理的记录数，断点续跑时包含之前运行的记录
+        self.queries = {"framework": 0, "rule": 0}  # SQL 查询数，按来源区分
+        self.max_page_queries = 0  # 单页最多的 SQL 查询数
+        self._started = time.time()
+        self._page_started = self._started
+        self._phases = dict.fromkeys(PHASES, 0.0)
+        self._page_phases = dict.fromkeys(PHASES, 0.0)
+        self._recent_pages = deque(maxlen=100)  # 最近的页
+        self._reported = self._started
+        self._lock = threading.Lock()
+
+    def copy(self, report_file: str, prom_file: str) -> "RunMetrics":
+        """
+        相同场景的新指标，分片进程单独统计
+        """
+        return RunMetrics(
+            self.scene,
+            self.database,
+            self.table_name,
+            report_file,
+            prom_file,
+            interval=self.interval,
+        )
+
+    def add(self, phase: str, seconds: float):
+        """
+        累计阶段耗时
+        """
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+            self._page_phases[phase] = self._page_phases.get(phase, 0.0) + seconds
+
+    def page_done(
+        self,
+        rows: int,
+        changes: int,
+        scanned: int = None,
+        queries: dict = None,
+        **extra,
+    ):
+        """
+        一页处理完成
+        :param rows: 本页的记录数
+        :param changes: 本页变更的记录数
+        :param scanned: 已处理的记录数 (包括之前运行的记录)，默认为本次运行的累计值
+        :param queries: 本页的 SQL 查询数 {来源: 查询数}，参照 QueryCounter.pop()
+        :param extra: 本页的其他信息，如 id 范围
+        """
+        now = time.time()
+        with self._lock:
+            page = dict(
+                page_no=self.pages,
+                rows=rows,
+                changes=changes,
+                seconds=round(now - self._page_started, 4),
+                phases={k: round(v, 4) for k, v in self._page_phases.items() if v},
+                **extra,
+            )
+            if queries is not None:
+                page["queries"] = queries
+                for source, count in queries.items():
+                    self.queries[source] = self.queries.get(source, 0) + count
+                self.max_page_queries = max(self.max_page_queries, sum(queries.values()))
+            self._recent_pages.append(page)
+            self._page_phases = dict.fromkeys(self._page_phases, 0.0)
+            self._page_started = now
+            self.pages += 1
+            self.rows += rows
+            self.changes += changes
+            self.scanned = self.rows if scanned is None else scanned
+        if now - self._reported >= self.interval:
+            self.report()
+
+    def merge(self, summary: dict):
+        """
+        汇总分片进程的指标，参照 summary()
+        """
+        with self._lock:
+            self.pages += summary["pages"]
+            self.rows += summary["rows"]
+            self.changes += summary["changes"]
+            self.scanned += summary["rows"]
+            for phase, seconds in summary["phases"].items():
+                self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+            for source, count in summary["queries"].items():
+                self.queries[source] = self.queries.get(source, 0) + count
+            self.max_page_queries = max(self.max_page_queries, summary["max_page_queries"])
+
+    def summary(self, finished: bool = False) -> dict:
+        """
+        当前的指标
+        """
+        with self._lock:
+            elapsed = time.time() - self._started
+            rows_per_second = self.rows / elapsed if elapsed > 0 else 0.0
+            eta_seconds = None
+            if self.waiting_count is not None and rows_per_second > 0:
+                eta_seconds = max(self.waiting_count - self.scanned, 0) / rows_per_second
+            if finished:
+                eta_seconds = 0.0
+            return dict(
+                scene=self.scene,
+                database=self.database,
+                table_name=self.table_name,
+                started_at=self.started_at,
+                updated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                finished=finished,
+                elapsed_seconds=round(elapsed, 3),
+                pages=self.pages,
+                rows=self.rows,
+                changes=self.changes,
+                scanned=self.scanned,
+                waiting_count=self.waiting_count,
+                rows_per_second=round(rows_per_second, 2),
+                changes_per_second=round(self.changes / elapsed if elapsed > 0 else 0.0, 2),
+                eta_seconds=None if eta_seconds is None else round(eta_seconds, 1),
+                phases={k: round(v, 4) for k, v in self._phases.items()},
+                queries=dict(self.queries),
+                max_page_queries=self.max_page_queries,
+                recent_pages=list(self._recent_pages),
+            )
+
+    def report(self, finished: bool = False) -> dict:
+        """
+        写入 JSON 报告和 Prometheus textfile
+        """
+        summary = self.summary(finished)
+        self._reported = time.time()
+        self._write(self.report_file, json.dumps(summary, ensure_ascii=False, indent=2, default=str))
+        self._write(self.prom_file, self._prometheus(summary))
+
+        progress = f"{summary['scanned']}"
+        if summary["waiting_count"] is not None:
+            progress += f"/{summary['waiting_count']}"
+        eta = ""
+        if summary["eta_seconds"] is not None and not finished:
+            eta = f"，预计剩余 {self._format_seconds(summary['eta_seconds'])}"
+        Logger.info(
+            f"运行指标：已处理 {progress} 条，变更 {summary['changes']} 条，"
+            f"{summary['rows_per_second']} 条/s{eta}，耗时 {self._format_seconds(summary['elapsed_seconds'])}"
+        )
+        return summary
+
+    def _prometheus(self, summary: dict) -> str:
+        labels = f'database="{self.database}",table="{self.table_name}",scene="{self.scene}"'
+        metrics = [
+            ("etl_rows_total", "counter", "已处理的记录数", summary["rows"]),
+            ("etl_changes_total", "counter", "变更的记录数", summary["changes"]),
+            ("etl_pages_total", "counter", "已处理的页数", summary["pages"]),
+            ("etl_elapsed_seconds", "gauge", "运行耗时", summary["elapsed_seconds"]),
+            ("etl_rows_per_second", "gauge", "每秒处理的记录数", summary["rows_per_second"]),
+            ("etl_changes_per_second", "gauge", "每秒变更的记录数", summary["changes_per_second"]),
+            ("etl_eta_seconds", "gauge", "预计剩余时间", summary["eta_seconds"]),
+            ("etl_finished", "gauge", "是否已完成", int(summary["finished"])),
+            ("etl_max_page_queries", "gauge", "单页最多的 SQL 查询数", summary["max_page_queries"]),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{{{labels}}} {value}")
+        lines.append("# HELP etl_phase_seconds_total 各阶段的累计耗时")
+        lines.append("# TYPE etl_phase_seconds_total counter")
+        for phase, seconds in summary["phases"].items():
+            lines.append(f'etl_phase_seconds_total{{{labels},phase="{phase}"}} {seconds}')
+        lines.append("# HELP etl_queries_total SQL 查询数，按来源区分 (框架、清洗规则)")
+        lines.append("# TYPE etl_queries_total counter")
+        for source, count in summary["queries"].items():
+            lines.append(f'etl_queries_total{{{labels},source="{source}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(file: str, content: str):
+        """
+        先写临时文件再替换，避免读取到不完整的报告
+        """
+        tmp_file = f"{file}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write(content)
+        os.replace(tmp_file, file)
+
+    @staticmethod
+    def _format_seconds(seconds: float) -> str:
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,93 @@
+from itertools import chain
+from operator import attrgetter
+
+from django.db import models
+from django.db.models import Field
+
+
+class ModelSnapshot:
+    """
+    模型快照器：按模型预先编译字段列表，快照为元组，对比时一次遍历返回变更字段的下标
+    每个模型 (及字段组合) 只编译一次，通过 ModelSnapshot.of(model, fields) 获取。
+    """
+
+    _cache = {}  # (模型, 字段) -> ModelSnapshot
+
+    @classmethod
+    def of(cls, model, fields: tuple = None) -> "ModelSnapshot":
+        """
+        :param fields: 快照包含的字段名，None 表示所有字段
+        """
+        key = (model, fields)
+        snapshot = cls._cache.get(key)
+        if snapshot is None:
+            snapshot = cls(model, fields)
+            cls._cache[key] = snapshot
+        return snapshot
+
+    def __init__(self, model, fields: tuple = None):
+        opts = model._meta
+        selected = (lambda f: True) if fields is None else (lambda f: f.name in fields)
+        concrete_fields = [f for f in opts.concrete_fields if selected(f)]
+        fields = concrete_fields + [f for f in opts.private_fields if selected(f)]
+        self.m2m_fields = tuple(f for f in opts.many_to_many if selected(f))
+        # 快照中各字段的名称，多对多字段排在最后
+        self.names = tuple(f.name for f in chain(fields, self.m2m_fields))
+        self.concrete_names = frozenset(f.name for f in concrete_fields)
+        self.name_set = frozenset(self.names)
+        # 允许为空的字段名，归档字段变更时校验目标值，避免每次变更都查找字段
+        self.nullable_names = frozenset(
+            f.name for f in chain(fields, self.m2m_fields) if getattr(f, "null", False)
+        )
+        self.auto_now_fields = tuple(
+            f for f in concrete_fields if getattr(f, "auto_now", False) is True
+        )
+        # auto_now 字段在快照中的下标
+        self.auto_now_indexes = frozenset(
+            i for i, f in enumerate(fields) if getattr(f, "auto_now", False) is True
+        )
+
+        # 大部分字段的 value_from_object 就是读取 attname 属性，用 attrgetter 一次读取所有属性
+        simple = [
+            getattr(type(f), "value_from_object", None) is Field.value_from_object
+            for f in fields
+        ]
+        if len(fields) > 1 and all(simple):
+            self._getter = attrgetter(*(f.attname for f in fields))
+        else:
+            getters = [
+                attrgetter(f.attname) if is_simple else f.value_from_object
+                for f, is_simple in zip(fields, simple)
+            ]
+            self._getter = lambda obj: tuple(getter(obj) for getter in getters)
+
+    def capture(self, obj: models.Model) -> tuple:
+        """
+        记录的快照，与 names 一一对应，多对多字段为关联 id 列表
+        """
+        values = self._getter(obj)
+        if self.m2m_fields:
+            values += tuple(
+                [i.id for i in f.value_from_object(obj)] for f in self.m2m_fields
+            )
+        return values
+
+    @staticmethod
+    def diff(origin_values: tuple, changed_values: tuple) -> list:
+        """
+        对比两个快照
+        :return: 发生变更的字段下标
+        """
+        return [
+            i
+            for i, (origin_value, changed_value) in enumerate(
+                zip(origin_values, changed_values)
+            )
+            if origin_value != changed_value
+        ]
+
+    def to_dict(self, values: tuple) -> dict:
+        """
+        快照转为字段名到字段值的字典
+        """
+        return dict(zip(self.names, values))
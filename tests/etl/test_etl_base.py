@@ -0,0 +1,1065 @@
+"""
+ETLBase 的回归测试，使用基准测试的 Django 配置和合成数据 (临时目录中的 sqlite 文件)
+
+运行方式：python -m pytest tests/etl/test_etl_base.py
+         python -m unittest tests.etl.test_etl_base
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from django.apps import apps
+from django.db import DatabaseError, connection
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Trim
+from django.test.utils import CaptureQueriesContext
+
+from tests.benchmark import bench_etl, setup
+
+_work_dir = tempfile.mkdtemp(prefix="test_etl_base-")
+_database = bench_etl.database_config(None, _work_dir)
+# 分片进程并发写入 sqlite：事务开始时即获取写锁，其他进程等待而不是报 database is locked
+_database["OPTIONS"] = {"transaction_mode": "IMMEDIATE", "timeout": 60}
+setup(_database)
+
+from django.conf import settings  # noqa: E402
+
+# 从库别名，与主库是同一个数据库，测试中在主库上修改数据模拟从库延迟
+settings.DATABASES["replica"] = dict(settings.DATABASES["default"])
+
+from tests.benchmark.models import bench_model  # noqa: E402
+from tests.etl import Logger, etl_base  # noqa: E402
+from tests.etl.archive_index import ArchiveIndex  # noqa: E402
+from tests.etl.archive_uploader import LocalTransport  # noqa: E402
+from tests.etl.archive_writer import ArchiveWriter  # noqa: E402
+from tests.etl.throttle import MySQLReplicaLag, ThrottleController  # noqa: E402
+
+
+def tearDownModule():
+    shutil.rmtree(_work_dir, ignore_errors=True)
+
+
+class ETLTestCase(unittest.TestCase):
+    """
+    每个测试重建基准测试的表，生成 rows 条记录，其中 change_ratio 比例为脏数据
+    """
+
+    rows = 400
+    width = 1
+    change_ratio = 1.0
+    auto_now = True  # 模型是否有 auto_now 字段
+
+    def setUp(self):
+        self.level = Logger.level
+        Logger.setLevel(logging.ERROR)
+        self.archive_dir = tempfile.mkdtemp(dir=_work_dir)
+        self.model = bench_model(self.width, auto_now=self.auto_now)
+        bench_etl.create_tables(self.model)
+        args = bench_etl.parse_args(
+            ["--rows", str(self.rows), "--width", str(self.width), "--fanout", "0"]
+            + ["--change-ratio", str(self.change_ratio)]
+        )
+        self.dirty = bench_etl.generate(self.model, args)
+
+    def tearDown(self):
+        Logger.setLevel(self.level)
+
+    def etl(self, page_size: int = 50, **settings):
+        """
+        基准测试的 ETL 实例：去掉 name_0 前后的空格，并将 count_0 加 1
+        """
+        return bench_etl.etl_class(self.model, self.archive_dir, page_size, settings)()
+
+    def dirty_count(self) -> int:
+        return bench_etl.dirty_count(self.model)
+
+    def rows_data(self) -> dict:
+        """
+        :return: record_id -> 完整数据
+        """
+        return {record.id: etl_base.to_origin_dict(record) for record in self.model.objects.all()}
+
+
+class PipelineFailureTest(ETLTestCase):
+    def test_transform_exception_outside_rule(self):
+        """
+        转换线程在逐条清洗之外异常 (查询完整数据失败) 时，不能丢弃该页后继续，也不能记录为清洗完成
+        """
+
+        def full_rows(etl, records):
+            if records[0].id == 101:
+                raise Exception("查询完整数据失败")
+            return etl_base.ETLBase._full_rows(etl, records)
+
+        etl = self.etl(
+            pipeline_mode=True,
+            worker=2,
+            fields=("name_0", "count_0"),
+            _full_rows=full_rows,
+        )
+        with self.assertRaisesRegex(Exception, "查询完整数据失败"):
+            etl.start()
+
+        # 异常页之前的两页已提交，之后的数据保持不变
+        self.assertEqual(self.dirty_count(), self.dirty - 100)
+        with open(etl.checkpoint_file) as f:
+            progress = json.load(f)
+        self.assertFalse(progress["finished"])
+        self.assertEqual(progress["next_id"], 101)
+
+    def test_resume_after_transform_exception(self):
+        """
+        异常页修复后，断点续跑清洗剩余的数据
+        """
+        failing = {"page": 201}
+
+        def full_rows(etl, records):
+            if records[0].id == failing["page"]:
+                raise Exception("查询完整数据失败")
+            return etl_base.ETLBase._full_rows(etl, records)
+
+        settings = dict(pipeline_mode=True, worker=2, fields=("name_0", "count_0"))
+        with self.assertRaises(Exception):
+            self.etl(_full_rows=full_rows, **settings).start()
+        failing["page"] = None
+        self.etl(_full_rows=full_rows, resume_mode=True, **settings).start()
+        self.assertEqual(self.dirty_count(), 0)
+
+
+class ResumeTest(ETLTestCase):
+    change_ratio = 0.1
+
+    def increment(self, **settings):
+        """
+        不幂等的清洗规则：每条记录的 count_0 加 1，重复清洗时结果错误
+        """
+
+        def rule(etl, record):
+            record.count_0 += 1
+
+        return self.etl(page_size=self.rows, rule=rule, resume_mode=True, **settings)
+
+    def test_resume_inside_page(self):
+        """
+        一页中途退出时，续跑从最后一个提交的事务之后继续，已提交的记录不会重新清洗和归档
+        """
+        before = self.rows_data()
+        etl = self.increment()
+        save_changed = etl._save_changed
+
+        def interrupted(record, *args):
+            if record.id == 21:
+                raise KeyboardInterrupt()
+            return save_changed(record, *args)
+
+        with mock.patch.object(etl, "_save_changed", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                etl.start()
+        with open(etl.checkpoint_file) as f:
+            self.assertEqual(json.load(f)["next_id"], 21)
+
+        etl = self.increment()
+        etl.start()
+        after = self.rows_data()
+        for record_id, data in before.items():
+            self.assertEqual(after[record_id]["count_0"], data["count_0"] + 1)
+        for archive_file in (etl.origin_file, etl.changed_file):
+            record_ids = [meta["record_id"] for meta in etl._archive_iter(archive_file)]
+            self.assertEqual(sorted(record_ids), sorted(before))
+        with open(etl.checkpoint_file) as f:
+            progress = json.load(f)
+        self.assertTrue(progress["finished"])
+        self.assertEqual(progress["data_count"], self.rows)
+        self.assertEqual(progress["scanned_count"], self.rows)
+
+    def test_resume_with_different_range(self):
+        """
+        未完成的断点与传入的 id 范围不一致时报错，已完成的断点与传入的 id 范围不一致时重新清洗
+        """
+        etl = self.increment(commit_size=10)
+        with mock.patch.object(etl, "_save_changed", side_effect=KeyboardInterrupt()):
+            with self.assertRaises(KeyboardInterrupt):
+                etl.start(1, 100)
+        with self.assertRaisesRegex(Exception, "不一致"):
+            self.increment().start(1, 200)
+
+        self.increment().start(1, 100)
+        self.assertEqual(self.model.objects.get(id=100).count_0, 101)
+        self.assertEqual(self.model.objects.get(id=101).count_0, 101)
+        # 相同的参数，已完成时不再清洗
+        self.increment().start(1, 100)
+        self.assertEqual(self.model.objects.get(id=100).count_0, 101)
+
+        self.increment().start(101, 200)
+        self.assertEqual(self.model.objects.get(id=101).count_0, 102)
+
+
+class ArchiveTransactionTest(ETLTestCase):
+    change_ratio = 0.1
+
+    def run_start(self, **settings) -> list:
+        """
+        :return: 清洗过程中的事件：("flush", 归档文件, 是否同步到磁盘)、("commit",)
+        """
+        events = []
+        flush_file = ArchiveWriter._flush_file
+        commit = connection._commit
+
+        def _flush_file(writer, archive_file, lines, fsync):
+            events.append(("flush", archive_file, fsync and archive_file not in writer._no_fsync))
+            return flush_file(writer, archive_file, lines, fsync)
+
+        def _commit():
+            events.append(("commit",))
+            return commit()
+
+        self.etl_instance = etl = self.etl(**settings)
+        with mock.patch.object(ArchiveWriter, "_flush_file", _flush_file), mock.patch.object(
+            connection, "_commit", _commit
+        ), CaptureQueriesContext(connection) as queries:
+            etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.begins = sum(query["sql"].startswith("BEGIN") for query in queries.captured_queries)
+        return events
+
+    def assert_synced_before_commit(self, events: list):
+        """
+        每次提交之前，本次事务写入的归档文件都已同步到磁盘
+        """
+        etl = self.etl_instance
+        archive_files = {etl.origin_file, etl.change_field_file, etl.changed_file}
+        synced = set()
+        for event in events:
+            if event[0] == "commit":
+                self.assertEqual(synced, archive_files)
+                synced = set()
+            elif event[1] in archive_files:
+                self.assertTrue(event[2], f"{event[1]} 提交前未同步到磁盘")
+                synced.add(event[1])
+
+    def test_transaction_per_changed_record(self):
+        """
+        逐条提交时只为变更的记录开启事务，未变更的记录不单独开启事务，也不单独刷盘
+        """
+        events = self.run_start()
+        commits = [event for event in events if event[0] == "commit"]
+        self.assertEqual(len(commits), self.dirty)
+        self.assertEqual(self.begins, self.dirty)
+        self.assert_synced_before_commit(events)
+        flushes = [event for event in events if event[1:2] == (self.etl_instance.origin_file,)]
+        # 每次提交刷盘一次，每页结束刷盘一次
+        self.assertLessEqual(len(flushes), self.dirty + self.rows // 50)
+
+    def test_commit_size_counts_changed_records(self):
+        """
+        commit_size 按变更的记录计数
+        """
+        events = self.run_start(commit_size=5, page_size=self.rows)
+        commits = [event for event in events if event[0] == "commit"]
+        self.assertEqual(len(commits), -(-self.dirty // 5))
+        self.assert_synced_before_commit(events)
+
+    def test_bulk_update_mode(self):
+        """
+        批量提交时每页一个事务
+        """
+        events = self.run_start(bulk_update_mode=True)
+        commits = [event for event in events if event[0] == "commit"]
+        self.assertEqual(len(commits), self.rows // 50)
+        self.assert_synced_before_commit(events)
+
+
+class ChangeFieldNullTest(ETLTestCase):
+    """
+    归档字段变更时，目标值为 None 只允许用于可为空的字段
+    """
+
+    change_ratio = 0.1
+
+    def start(self, field_name: str):
+        def rule(etl, record):
+            name = record.name_0.strip()
+            if name != record.name_0:
+                record.name_0 = name
+                setattr(record, field_name, None)
+
+        etl = self.etl(rule=rule)
+        etl.start()
+        return etl
+
+    def test_nullable_field(self):
+        etl = self.start("note_0")
+        self.assertEqual(self.dirty_count(), 0)
+        changes = [
+            meta for meta in etl._archive_iter(etl.change_field_file) if meta["field_name"] == "note_0"
+        ]
+        self.assertTrue(changes)
+        self.assertTrue(all(meta["target_value"] is None for meta in changes))
+
+    def test_not_null_field(self):
+        """
+        不允许为空的字段归档失败，清洗在该记录停止，数据保持不变
+        """
+        with self.assertLogs(Logger, logging.WARNING) as logs:
+            self.start("count_0")
+        self.assertTrue([line for line in logs.output if "count_0 字段不允许为空" in line])
+        self.assertEqual(self.dirty_count(), self.dirty)
+
+
+class FieldTracerTest(ETLTestCase):
+    """
+    trace_fields：预热期间对比所有字段并学习写入的字段，之后只对比学习到的字段
+    """
+
+    change_ratio = 0.5
+    warmup = 20
+
+    def etl(self, page_size: int = 50, **settings):
+        return super().etl(page_size, trace_fields=True, trace_warmup=self.warmup, **settings)
+
+    def test_trace(self):
+        """
+        按对象标识对比写入的属性，不修改记录的类，也不注册额外的模型
+        """
+        etl = self.etl()
+        models = dict(apps.all_models[self.model._meta.app_label])
+        records = list(self.model.objects.order_by("id")[:3])
+        with etl._field_tracer.trace(records + [object()]) as writes:
+            records[0].name_0 = f" {records[0].name_0}"
+            records[1].count_0 = records[1].count_0 + 1
+            # 赋值为同一个对象，值不变
+            records[2].name_0 = records[2].name_0
+            self.assertTrue(all(type(record) is self.model for record in records))
+        self.assertEqual(writes, [{"name_0"}, {"count_0"}, set(), None])
+        self.assertEqual(dict(apps.all_models[self.model._meta.app_label]), models)
+
+    def test_warmup(self):
+        etl = self.etl()
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        tracer = etl._field_tracer
+        self.assertEqual(tracer._count, self.warmup)
+        self.assertEqual(tracer._learned, {"name_0", "count_0"})
+
+    def test_narrowing(self):
+        """
+        预热之后只对比写入的字段，以及可原地修改的字段和 auto_now 字段
+        """
+        etl = self.etl()
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        snapshot, indexes = etl._field_tracer._narrowed
+        self.assertEqual(set(snapshot.names), {"name_0", "count_0", "extra_0", "updated"})
+        full = etl._snapshot()
+        self.assertEqual([full.names[i] for i in indexes], list(snapshot.names))
+
+    def test_new_field_after_warmup(self):
+        """
+        预热之后写入新的字段时，扩大对比范围，不遗漏变更
+        """
+
+        def rule(etl, record):
+            name = record.name_0.strip()
+            if name != record.name_0:
+                record.name_0 = name
+                record.count_0 += 1
+                if record.id > 200:
+                    record.note_0 = "late"
+
+        etl = self.etl(rule=rule)
+        with self.assertLogs(Logger, logging.WARNING) as logs:
+            etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.assertTrue([line for line in logs.output if "预热阶段未出现的字段 ['note_0']" in line])
+        self.assertIn("note_0", etl._field_tracer._narrowed[0].names)
+        late = set(
+            self.model.objects.filter(id__gt=200, note_0="late").values_list("id", flat=True)
+        )
+        archived = {
+            meta["record_id"]
+            for meta in etl._archive_iter(etl.change_field_file)
+            if meta["field_name"] == "note_0"
+        }
+        self.assertTrue(late)
+        self.assertEqual(archived, late)
+
+
+class RuleColumnsTest(ETLTestCase):
+    change_ratio = 0.2
+
+    def test_hooks_not_implemented(self):
+        etl = bench_etl.etl_class(self.model, self.archive_dir, 50, {})()
+        for hook, args in (
+            (etl_base.ETLBase.rule, (None,)),
+            (etl_base.ETLBase.rule_batch, ([],)),
+            (etl_base.ETLBase.rule_columns, ({},)),
+            (etl_base.ETLBase.pushdown_updates, ()),
+        ):
+            with self.assertRaises(NotImplementedError):
+                hook(etl, *args)
+
+    @unittest.skipIf(etl_base.numpy is None, "需要安装 numpy")
+    def test_numpy_mixed_column(self):
+        """
+        字符串与整数混合的列保持为 object 数组，未修改的列写回时类型不变 (1 不会变成 "1")
+        """
+        numpy = etl_base.numpy
+        for record in self.model.objects.all():
+            record.extra_0 = record.id if record.id % 2 else f"v{record.id}"
+            record.save(update_fields=["extra_0"])
+        seen = {}
+
+        def rule_columns(etl, columns):
+            seen["extra_0"] = columns["extra_0"].dtype
+            names = columns["name_0"]
+            stripped = numpy.char.strip(names.astype(str))
+            changed = stripped != names
+            columns["name_0"] = stripped
+            columns["count_0"] = numpy.where(changed, columns["count_0"] + 1, columns["count_0"])
+
+        etl = self.etl(rule_mode="columns", rule_columns_numpy=True, rule_columns=rule_columns)
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.assertEqual(seen["extra_0"], object)
+        fields = {meta["field_name"] for meta in etl._archive_iter(etl.change_field_file)}
+        self.assertEqual(fields - {"updated"}, {"name_0", "count_0"})
+        for record_id, extra in self.model.objects.values_list("id", "extra_0"):
+            self.assertEqual(extra, record_id if record_id % 2 else f"v{record_id}")
+
+
+class ReplicaLagTest(ETLTestCase):
+    """
+    主从延迟超过上限时暂停清洗，每次重新检查都输出警告，超过 max_replica_lag_wait 时报错停止
+    """
+
+    change_ratio = 0.2
+
+    def test_warn_on_every_retry(self):
+        probe = mock.Mock(side_effect=[10.0, 10.0, 10.0, 1.0])
+        controller = ThrottleController(lag_probe=probe, max_lag=5.0, lag_interval=0, max_lag_wait=None)
+        with mock.patch("tests.etl.throttle.time.sleep"), self.assertLogs(Logger, logging.INFO) as logs:
+            controller.throttle(1, 1, 0.0)
+        self.assertEqual(probe.call_count, 4)
+        self.assertEqual(len([line for line in logs.output if "仍超过上限" in line]), 2)
+        self.assertIn("主从延迟已恢复", logs.output[-1])
+
+    def test_max_wait(self):
+        """
+        暂停超时后报错停止，已提交的页不回退，延迟恢复后断点续跑
+        """
+        settings = dict(
+            replica_lag_interval=0, max_replica_lag_wait=0, resume_mode=True, throttle_max_pause=0
+        )
+        etl = self.etl(replica_lag_probe=mock.Mock(return_value=10.0), **settings)
+        with self.assertRaisesRegex(Exception, "持续超过上限"):
+            etl.start()
+        with open(etl.checkpoint_file) as f:
+            self.assertEqual(json.load(f)["next_id"], 51)
+        self.assertLess(self.dirty_count(), self.dirty)
+
+        self.etl(replica_lag_probe=mock.Mock(return_value=0.0), **settings).start()
+        self.assertEqual(self.dirty_count(), 0)
+
+    def test_mysql_fallback_cursor(self):
+        """
+        SHOW REPLICA STATUS 失败时 (MySQL 8.0.22 之前)，用新的游标执行 SHOW SLAVE STATUS
+        """
+        cursors = []
+
+        def cursor():
+            cursor = mock.MagicMock()
+            cursor.__enter__.return_value = cursor
+            if not cursors:
+                cursor.execute.side_effect = DatabaseError("语法错误")
+            cursor.fetchone.return_value = (3,)
+            cursor.description = [("Seconds_Behind_Master",)]
+            cursors.append(cursor)
+            return cursor
+
+        replica = mock.Mock(cursor=cursor)
+        with mock.patch("tests.etl.throttle.connections", {"replica": replica}):
+            self.assertEqual(MySQLReplicaLag("replica")(), 3.0)
+        self.assertEqual(len(cursors), 2)
+        cursors[0].execute.assert_called_once_with("SHOW REPLICA STATUS")
+        cursors[0].__exit__.assert_called_once()
+        cursors[1].execute.assert_called_once_with("SHOW SLAVE STATUS")
+
+
+class ReadReplicaTest(ETLTestCase):
+    """
+    从从库查询时，提交前在主库上校验有变更的记录
+    """
+
+    change_ratio = 0.2
+
+    def start(self, before_verify):
+        """
+        :param before_verify: 第一次在主库上校验前调用，参数为本次校验的清洗结果，修改主库上的数据；返回 False 时在下一次校验前再调用
+        """
+        etl = self.etl(read_alias="replica")
+        verify = etl._verify_on_primary
+        called = []
+
+        def _verify_on_primary(items):
+            if not called and before_verify(items) is not False:
+                called.append(True)
+            return verify(items)
+
+        etl._verify_on_primary = _verify_on_primary
+        etl.start()
+        self.assertTrue(called)
+        return etl
+
+    def origin_archived(self, etl, record_id: int) -> list:
+        return [meta for meta in etl._archive_iter(etl.origin_file) if meta["record_id"] == record_id]
+
+    def test_reclean_stale(self):
+        """
+        主库上的数据与从库不一致时，基于主库的数据重新清洗
+        """
+        stale = {}
+
+        def before_verify(items):
+            record = next(item[0] for item in items if item[3])
+            stale["id"], stale["count"] = record.id, self.model.objects.get(id=record.id).count_0
+            self.model.objects.using("default").filter(id=record.id).update(name_0=" stale ")
+
+        with self.assertLogs(Logger, logging.INFO) as logs:
+            etl = self.start(before_verify)
+        self.assertTrue([line for line in logs.output if "基于主库的数据重新清洗" in line])
+        self.assertEqual(self.dirty_count(), 0)
+        record = self.model.objects.get(id=stale["id"])
+        self.assertEqual((record.name_0, record.count_0), ("stale", stale["count"] + 1))
+        archived = self.origin_archived(etl, stale["id"])
+        self.assertEqual([meta["origin_value"]["name_0"] for meta in archived], [" stale "])
+
+    def test_skip_missing(self):
+        """
+        主库上已不存在的记录跳过，不归档也不提交
+        """
+        missing = {}
+
+        def before_verify(items):
+            missing["id"] = next(item[0] for item in items if item[3]).id
+            self.model.objects.using("default").filter(id=missing["id"]).delete()
+
+        with self.assertLogs(Logger, logging.WARNING) as logs:
+            etl = self.start(before_verify)
+        self.assertTrue([line for line in logs.output if "已不符合查询条件，跳过" in line])
+        self.assertEqual(self.dirty_count(), 0)
+        self.assertFalse(self.origin_archived(etl, missing["id"]))
+
+    def test_unchanged_not_verified(self):
+        """
+        在从库上清洗后没有变更的记录不在主库上校验，主库上之后变脏的记录被漏掉，结束时输出未校验的记录数
+        """
+
+        def before_verify(items):
+            unchanged = [item[0] for item in items if not item[3]]
+            if not unchanged:
+                return False
+            self.model.objects.using("default").filter(id=unchanged[0].id).update(name_0=" late ")
+
+        with self.assertLogs(Logger, logging.WARNING) as logs:
+            self.start(before_verify)
+        self.assertEqual(self.dirty_count(), 1)
+        reports = [line for line in logs.output if "未在主库上校验" in line]
+        self.assertEqual(len(reports), 1)
+        self.assertIn(f"{self.rows - self.dirty} 条记录", reports[0])
+
+
+class PushdownTest(ETLTestCase):
+    change_ratio = 0.3
+
+    def pushdown(self, **settings):
+        """
+        与基准测试的清洗规则一致的 SQL 下推：去掉 name_0 前后的空格，并将变更记录的 count_0 加 1
+        """
+
+        def pushdown_updates(etl):
+            dirty = Q(name_0__startswith=" ") | Q(name_0__endswith=" ")
+            return {
+                "name_0": Trim("name_0"),
+                "count_0": Case(When(dirty, then=F("count_0") + 1), default=F("count_0")),
+            }
+
+        return self.etl(pushdown_mode=True, pushdown_updates=pushdown_updates, **settings)
+
+    def run_pushdown(self) -> list:
+        """
+        :return: 清洗时执行的 SQL
+        """
+        self.before = self.rows_data()
+        self.etl_instance = etl = self.pushdown()
+        with CaptureQueriesContext(connection) as queries:
+            etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        return [query["sql"] for query in queries.captured_queries]
+
+    def assert_cleaned(self):
+        """
+        数据和归档与逐条清洗一致，auto_now 字段只对变更的记录刷新
+        """
+        etl = self.etl_instance
+        after = self.rows_data()
+        dirty_ids = {
+            record_id for record_id, data in self.before.items() if data["name_0"].startswith(" ")
+        }
+        self.assertEqual(len(dirty_ids), self.dirty)
+        for record_id, data in self.before.items():
+            expected, actual = dict(data), dict(after[record_id])
+            if record_id in dirty_ids:
+                expected.update(name_0=data["name_0"].strip(), count_0=data["count_0"] + 1)
+                self.assertGreater(actual.pop("updated"), expected.pop("updated"))
+            self.assertEqual(actual, expected)
+
+        changes = {
+            (meta["record_id"], meta["field_name"])
+            for meta in etl._archive_iter(etl.change_field_file)
+        }
+        self.assertEqual(changes, {(i, name) for i in dirty_ids for name in ("name_0", "count_0")})
+        origin_ids = [meta["record_id"] for meta in etl._archive_iter(etl.origin_file)]
+        self.assertEqual(sorted(origin_ids), sorted(self.before))
+        changed = {meta["record_id"]: meta for meta in etl._archive_iter(etl.changed_file)}
+        self.assertEqual(set(changed), dirty_ids)
+        for record_id, meta in changed.items():
+            # 归档的清洗后数据包含刷新后的 auto_now 字段
+            self.assertEqual(meta["target_value"]["updated"], str(after[record_id]["updated"]))
+
+    def test_update_returning(self):
+        """
+        支持 UPDATE ... RETURNING 时，清洗后的数据由 UPDATE 直接返回
+        """
+        sqls = self.run_pushdown()
+        self.assertEqual(len([sql for sql in sqls if "RETURNING" in sql]), self.rows // 50)
+        self.assert_cleaned()
+
+    def test_update_reselect(self):
+        """
+        不支持 RETURNING 时，在同一个事务中重新查询清洗后的数据
+        """
+        with mock.patch.object(etl_base.ETLBase, "_update_returning_supported", return_value=False):
+            sqls = self.run_pushdown()
+        self.assertFalse([sql for sql in sqls if "RETURNING" in sql])
+        self.assert_cleaned()
+
+    def test_auto_now_refreshed_for_changed_records(self):
+        """
+        auto_now 字段只对变更的记录刷新，每页一条 UPDATE
+        """
+        sqls = self.run_pushdown()
+        refreshes = [sql for sql in sqls if sql.startswith("UPDATE") and "RETURNING" not in sql]
+        self.assertEqual(len(refreshes), self.rows // 50)
+        self.assertTrue(all('SET "updated"' in sql for sql in refreshes))
+        self.assert_cleaned()
+
+    def test_pre_check(self):
+        """
+        预检查模式下不执行 UPDATE，也不锁定记录，计算的变更与正式运行一致
+        """
+        before = self.rows_data()
+        etl = self.pushdown(pre_check_mode=True)
+        with mock.patch.object(
+            etl, "_save_change_field", wraps=etl._save_change_field
+        ) as save_change_field, CaptureQueriesContext(connection) as queries:
+            etl.start()
+        sqls = [query["sql"] for query in queries.captured_queries]
+        self.assertFalse([sql for sql in sqls if not sql.startswith("SELECT")])
+        self.assertFalse([sql for sql in sqls if "FOR UPDATE" in sql])
+        self.assertEqual(self.rows_data(), before)
+        previewed = {
+            (call.args[0].id, call.kwargs["field_name"], call.kwargs["target_value"])
+            for call in save_change_field.call_args_list
+        }
+
+        self.run_pushdown()
+        etl = self.etl_instance
+        changes = {
+            (meta["record_id"], meta["field_name"], meta["target_value"])
+            for meta in etl._archive_iter(etl.change_field_file)
+        }
+        self.assertEqual(previewed, changes)
+
+
+class FailingTransport(LocalTransport):
+    """
+    记录上传的分片，failing_part 指定的分片上传失败
+    """
+
+    def __init__(self, root: str, failing_part: int = None):
+        super().__init__(root)
+        self.failing_part = failing_part
+        self.parts = []  # [(对象 key, 分片序号), ...]
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        if part_number == self.failing_part:
+            raise Exception("分片上传失败")
+        self.parts.append((key, part_number))
+        return super().upload_part(key, upload_id, part_number, data)
+
+
+class StreamUploadTest(ETLTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(etl_base.config.OssConfig, "auto_upload_oss", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 分片重试不等待
+        patcher = mock.patch("tests.etl.archive_uploader.time.sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.transport = FailingTransport(tempfile.mkdtemp(dir=_work_dir))
+
+    def upload_etl(self):
+        return self.etl(
+            stream_upload=True, upload_transport=self.transport, upload_part_size=2048
+        )
+
+    def manifest(self, etl) -> dict:
+        with open(etl.upload_manifest_file) as f:
+            return json.load(f)
+
+    def assert_uploaded(self, etl):
+        """
+        归档文件上传完成，上传后的对象与归档文件一致，后台上传线程已停止
+        """
+        manifest = self.manifest(etl)
+        for archive_file in (etl.origin_file, etl.change_field_file, etl.changed_file):
+            upload = manifest[archive_file]
+            self.assertTrue(upload["completed"])
+            with open(archive_file, "rb") as f, open(
+                self.transport.url(upload["key"]), "rb"
+            ) as uploaded:
+                self.assertEqual(uploaded.read(), f.read())
+        self.assertFalse([t for t in threading.enumerate() if t.name == "ArchiveUploader"])
+
+    def test_thread_stopped_after_upload(self):
+        """
+        清洗结束后后台上传线程退出
+        """
+        etl = self.upload_etl()
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.assertGreater(len(self.transport.parts), 10)
+        self.assert_uploaded(etl)
+
+    def test_thread_stopped_after_failure(self):
+        """
+        清洗中途停止时，后台上传线程同样退出
+        """
+
+        def rule(etl, record):
+            if record.id == 201:
+                raise Exception("清洗规则异常")
+            if record.name_0 != record.name_0.strip():
+                record.name_0 = record.name_0.strip()
+                record.count_0 += 1
+
+        etl = self.etl(
+            stream_upload=True, upload_transport=self.transport, upload_part_size=2048, rule=rule
+        )
+        etl.start()
+        self.assertEqual(self.dirty_count(), self.dirty - 200)
+        self.assertTrue(self.transport.parts)
+        self.assertFalse([t for t in threading.enumerate() if t.name == "ArchiveUploader"])
+
+    def test_failed_part(self):
+        """
+        分片上传失败时停止后台上传，不影响清洗，清单中保留已上传的分片
+        """
+        self.transport.failing_part = 3
+        etl = self.upload_etl()
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.assertFalse([t for t in threading.enumerate() if t.name == "ArchiveUploader"])
+        upload = self.manifest(etl)[etl.origin_file]
+        self.assertFalse(upload["completed"])
+        self.assertEqual([part[0] for part in upload["parts"]], [1, 2])
+        self.assertEqual(upload["size"], 2 * 2048)
+
+    def test_resume_from_manifest(self):
+        """
+        上传失败后再次上传，从清单中已上传的分片继续
+        """
+        self.transport.failing_part = 3
+        etl = self.upload_etl()
+        etl.start()
+        key = self.manifest(etl)[etl.origin_file]["key"]
+
+        self.transport.failing_part = None
+        self.transport.parts = []
+        etl = self.upload_etl()
+        etl._archive_to_oss(etl_base.ArchiveSceneEnum.data_fix.value)
+        parts = [number for part_key, number in self.transport.parts if part_key == key]
+        self.assertEqual(parts[0], 3)
+        self.assertEqual(parts, list(range(3, parts[-1] + 1)))
+        self.assert_uploaded(etl)
+
+
+class ArchiveIndexTest(ETLTestCase):
+    """
+    基于记录偏移索引的逆序读取和按 id 查找，块大小调小以覆盖跨块的行
+    """
+
+    change_ratio = 0.2
+    archive_format = "txt"
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("tests.etl.archive_index.READ_BLOCK_SIZE", 100)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 两次清洗，部分记录在归档文件中有两条历史
+        self.etl(archive_format=self.archive_format).start()
+        self.model.objects.filter(id__in=range(1, 400, 40)).update(name_0=" again ")
+        self.etl_instance = self.etl(archive_format=self.archive_format)
+        self.etl_instance.start()
+        self.origin_file = self.etl_instance.origin_file
+        self.forward = list(self.etl_instance._archive_iter(self.origin_file))
+
+    def test_reverse_order(self):
+        reverse = list(self.etl_instance._archive_iter(self.origin_file, reverse=True))
+        self.assertTrue(self.forward)
+        self.assertEqual(reverse, self.forward[::-1])
+
+    def test_rebuild_stale_index(self):
+        """
+        索引文件缺少最后一次刷盘的行时视为过期，重新扫描归档文件构建
+        """
+        index = ArchiveIndex(self.origin_file)
+        with open(index.index_file, "rb") as f:
+            lines = f.readlines()
+        last_end = lines[-1].split()[2]
+        with open(index.index_file, "wb") as f:
+            f.writelines(line for line in lines if line.split()[2] != last_end)
+        self.assertFalse(index.is_valid())
+
+        etl = self.etl(archive_format=self.archive_format)
+        reverse = list(etl._archive_iter(self.origin_file, reverse=True))
+        self.assertEqual(reverse, self.forward[::-1])
+        self.assertTrue(index.is_valid())
+        with open(index.index_file, "rb") as f:
+            rebuilt = [line.split()[:2] for line in f]
+        self.assertEqual(rebuilt, [line.split()[:2] for line in lines])
+
+    def test_archive_history(self):
+        for record_id in (1, 2, 41):
+            expected = [meta for meta in self.forward if meta["record_id"] == record_id]
+            history = self.etl_instance._archive_history(self.origin_file, record_id)
+            self.assertEqual(history, expected)
+        history = self.etl_instance._archive_history(self.origin_file, 1)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[-1]["origin_value"]["name_0"], " again ")
+
+
+class CompressedArchiveIndexTest(ArchiveIndexTest):
+    """
+    压缩归档文件，位置为 (gzip 块的字节偏移, 块内行号)
+    """
+
+    archive_format = "gz"
+
+
+class ShardTest(ETLTestCase):
+    """
+    多进程分片清洗和恢复，分片进程的归档文件按分片顺序合并到归档文件
+    """
+
+    change_ratio = 0.5
+    auto_now = False  # 两次生成的数据一致，用于对比分片和单进程清洗的归档
+    shard_count = 3
+
+    def archived(self, etl, archive_file: str) -> list:
+        return [
+            (meta["record_id"], meta["field_name"], meta["origin_value"], meta["target_value"])
+            for meta in etl._archive_iter(archive_file)
+        ]
+
+    def assert_merged(self, etl):
+        for archive_file in (etl.origin_file, etl.change_field_file, etl.changed_file):
+            self.assertEqual(etl._archive_files(archive_file), [archive_file])
+            self.assertTrue(ArchiveIndex(archive_file).is_valid())
+        self.assertFalse([name for name in os.listdir(etl.database_archive_dir) if ".recover" in name])
+
+    def test_clean(self):
+        """
+        分片清洗的归档与单进程清洗一致，按 id 顺序排列
+        """
+        etl = self.etl(shard_count=self.shard_count)
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.assert_merged(etl)
+        sharded = {
+            name: self.archived(etl, getattr(etl, name))
+            for name in ("origin_file", "change_field_file", "changed_file")
+        }
+
+        self.setUp()
+        etl = self.etl()
+        etl.start()
+        for name, archived in sharded.items():
+            self.assertEqual(archived, self.archived(etl, getattr(etl, name)))
+            self.assertEqual([item[0] for item in archived], sorted(item[0] for item in archived))
+
+    def test_merge_skips_duplicate_change_fields(self):
+        """
+        合并分片归档时，已归档的字段变更不重复写入
+        """
+        etl = self.etl()
+        etl.start()
+        archived = self.archived(etl, etl.change_field_file)
+        shard_file = etl._shard_file(etl.change_field_file, 1)
+        shutil.copy(etl.change_field_file, shard_file)
+        etl._merge_shard_archives()
+        self.assertFalse(os.path.exists(shard_file))
+        self.assertEqual(self.archived(etl, etl.change_field_file), archived)
+
+    def test_partition_archive(self):
+        """
+        归档行按 record_id 取模拆分到各分片，分片内保持读取顺序
+        """
+        etl = self.etl()
+        etl.start()
+        for reverse in (False, True):
+            lines = [
+                json.dumps(meta, ensure_ascii=False)
+                for meta in etl._archive_iter(etl.origin_file, reverse=reverse)
+            ]
+            etl.shard_count = self.shard_count
+            part_files = etl._partition_archive(etl.origin_file, reverse=reverse)
+            self.assertEqual(len(part_files), self.shard_count)
+            for index, part_file in enumerate(part_files):
+                metas = list(etl._archive_file_iter(part_file, etl._archive_lines(part_file), False))
+                expected = [
+                    line for line in lines if json.loads(line)["record_id"] % self.shard_count == index
+                ]
+                self.assertEqual([json.dumps(meta, ensure_ascii=False) for meta in metas], expected)
+                os.remove(part_file)
+
+    def recover(self, method: str):
+        """
+        清洗后分片恢复，数据还原为清洗前
+        """
+        before = self.rows_data()
+        self.etl().start()
+        self.assertEqual(self.dirty_count(), 0)
+        etl = self.etl(shard_count=self.shard_count)
+        getattr(etl, method)()
+        self.assert_merged(etl)
+        after = self.rows_data()
+        for record_id, data in before.items():
+            data.pop("updated", None)
+            after[record_id].pop("updated", None)
+        self.assertEqual(after, before)
+        self.assertEqual(self.dirty_count(), self.dirty)
+        return etl
+
+    def test_recover_change_field(self):
+        etl = self.recover("_recover_change_field")
+        recovered = self.archived(etl, etl.recovered_file)
+        self.assertEqual(len({item[0] for item in recovered}), self.dirty)
+
+    def test_recover_origin(self):
+        self.recover("_recover_origin")
+
+
+class RecoverOriginTest(ETLTestCase):
+    def recover_origin(self, **settings) -> list:
+        """
+        清洗后删除部分记录，再基于原始数据恢复
+        :return: 恢复时执行的 SQL
+        """
+        before = self.rows_data()
+        etl = self.etl(**settings)
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.model.objects.filter(id__in=range(5, 15)).delete()
+        with CaptureQueriesContext(connection) as queries:
+            etl._recover_origin()
+
+        after = self.rows_data()
+        self.assertEqual(set(after), set(before))
+        for record_id, data in before.items():
+            if record_id in range(5, 15):
+                # 重新创建的记录，auto_now 字段为创建时间
+                data = {k: v for k, v in data.items() if k != "updated"}
+                after[record_id] = {k: v for k, v in after[record_id].items() if k != "updated"}
+            self.assertEqual(after[record_id], data)
+        return [query["sql"] for query in queries.captured_queries]
+
+    def test_restore_with_values(self):
+        """
+        每批已存在的记录用一条 UPDATE ... FROM (VALUES ...) 还原，包括 auto_now 字段，不使用 bulk_update 的 CASE WHEN
+        """
+        sqls = self.recover_origin(recover_chunk_size=100)
+        updates = [sql for sql in sqls if sql.startswith("UPDATE")]
+        self.assertEqual(len(updates), self.rows // 100)
+        self.assertTrue(all("FROM (VALUES" in sql for sql in updates))
+        self.assertFalse([sql for sql in sqls if "CASE WHEN" in sql])
+
+    def test_restore_with_bulk_update(self):
+        """
+        不支持按 VALUES 批量更新的数据库，使用每批 100 条的 bulk_update
+        """
+        with mock.patch.object(etl_base.ETLBase, "_values_update_supported", return_value=False):
+            sqls = self.recover_origin()
+        updates = [sql for sql in sqls if sql.startswith("UPDATE")]
+        self.assertEqual(len(updates), self.rows // 100)
+        self.assertTrue(all("CASE WHEN" in sql for sql in updates))
+
+    def test_skip_deleted_with_projected_archive(self):
+        """
+        只归档 fields 中的字段时，已删除的记录不能用部分字段重新创建，已存在的记录只还原归档的字段
+        """
+        before = self.rows_data()
+        etl = self.etl(fields=("name_0", "count_0"), archive_full_row=False)
+        etl.start()
+        self.assertEqual(self.dirty_count(), 0)
+        self.model.objects.filter(id__in=range(5, 15)).delete()
+        with self.assertLogs(Logger, logging.WARNING) as logs:
+            etl._recover_origin()
+
+        after = self.rows_data()
+        self.assertEqual(set(after), set(before) - set(range(5, 15)))
+        for record_id, data in after.items():
+            # UPDATE 不刷新 auto_now 字段
+            data.pop("updated", None)
+            before[record_id].pop("updated", None)
+            self.assertEqual(data, before[record_id])
+        skipped = [line for line in logs.output if "跳过重新创建" in line]
+        self.assertEqual(len(skipped), 10)
+
+    def test_failed_recover_reports_unfinished(self):
+        """
+        恢复异常退出时，运行指标报告不能记录为已完成
+        """
+        etl = self.etl()
+        etl.start()
+        report_file = f"{etl.metrics_file_prefix}_data_recover.json"
+        with mock.patch.object(
+            etl, "_recover_record_chunk", side_effect=Exception("恢复失败")
+        ), self.assertRaisesRegex(Exception, "恢复失败"):
+            etl._recover_origin()
+        with open(report_file) as f:
+            self.assertFalse(json.load(f)["finished"])
+
+        etl._recover_origin()
+        with open(report_file) as f:
+            self.assertTrue(json.load(f)["finished"])
+
+
+class PlainRecoverOriginTest(RecoverOriginTest):
+    """
+    没有 auto_now 字段的模型
+    """
+
+    auto_now = False
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import time
+
+from django.db import DatabaseError, connections
+
+from tests.etl import Logger
+
+MIN_PAUSE = 0.1  # 页间暂停的最小值 (秒)，低于该值时取消暂停
+
+
+class ThrottleController:
+    """
+    限流：每页提交后，根据本页写入数据库的耗时和主从延迟调整页间暂停或分页尺寸，并按每秒记录数、每秒查询数的上限等待
+    写入耗时超过目标或主从延迟超过上限时，分页尺寸减半 (不低于下限)，已是最小分页尺寸时页间暂停加倍；
+    写入耗时低于目标的一半且主从延迟正常时，先逐步缩短暂停，再逐步恢复分页尺寸。
+    主从延迟超过上限时，暂停清洗，直到延迟恢复；超过 max_lag_wait 秒仍未恢复时报错停止。
+    """
+
+    def __init__(
+        self,
+        write_seconds: float = None,
+        lag_probe=None,
+        max_lag: float = 5.0,
+        lag_interval: float = 5.0,
+        max_lag_wait: float = 600.0,
+        max_rows_per_second: float = None,
+        max_queries_per_second: float = None,
+        max_pause: float = 30.0,
+        page_size: int = None,
+        min_page_size: int = 1,
+    ):
+        """
+        :param write_seconds: 每页写入耗时的目标 (秒)，None 表示不根据写入耗时调整
+        :param lag_probe: 主从延迟探针，调用后返回延迟秒数，None 表示未知，参照 MySQLReplicaLag
+        :param max_lag: 主从延迟的上限 (秒)
+        :param lag_interval: 检查主从延迟的最小间隔 (秒)
+        :param max_lag_wait: 主从延迟超过上限时暂停清洗的最长时间 (秒)，None 表示一直等待
+        :param max_pause: 页间暂停的上限 (秒)
+        :param page_size: 调整分页尺寸时的初始 (也是最大) 分页尺寸，None 表示只调整页间暂停
+        """
+        self.write_seconds = write_seconds
+        self.lag_probe = lag_probe
+        self.max_lag = max_lag
+        self.lag_interval = lag_interval
+        self.max_lag_wait = max_lag_wait
+        self.max_rows_per_second = max_rows_per_second
+        self.max_queries_per_second = max_queries_per_second
+        self.max_pause = max_pause
+        self.page_size = page_size  # 当前的分页尺寸
+        self.max_page_size = page_size
+        self.min_page_size = min_page_size
+        self.pause = 0.0  # 当前的页间暂停 (秒)
+        self._lag = None  # 最近一次检查的主从延迟
+        self._lag_checked = None  # 最近一次检查主从延迟的时间
+        self._probe_failed = False
+        self._page_started = time.monotonic()  # 本页的开始时间 (上一页等待结束的时间)
+
+    def share(self, ratio: float):
+        """
+        多进程分片时，每个分片进程按比例分配每秒记录数和每秒查询数的上限
+        """
+        if self.max_rows_per_second is not None:
+            self.max_rows_per_second *= ratio
+        if self.max_queries_per_second is not None:
+            self.max_queries_per_second *= ratio
+
+    def throttle(self, rows: int, queries: int, write_seconds: float) -> float:
+        """
+        一页提交后调整限流参数并等待
+        :param rows: 本页的记录数
+        :param queries: 本页的 SQL 查询数
+        :param write_seconds: 本页写入数据库的耗时
+        :return: 等待的秒数
+        """
+        lag = self._replica_lag()
+        reasons = []
+        relaxed = True
+        if self.write_seconds is not None:
+            if write_seconds > self.write_seconds:
+                reasons.append(f"写入耗时 {write_seconds:.2f}s 超过目标 {self.write_seconds}s")
+            relaxed = write_seconds < self.write_seconds / 2
+        if lag is not None and lag > self.max_lag:
+            reasons.append(f"主从延迟 {lag:.1f}s 超过上限 {self.max_lag}s")
+        if reasons:
+            self._slow_down("，".join(reasons))
+        elif relaxed:
+            self._speed_up()
+
+        # 每秒记录数、每秒查询数的上限：本页从开始到结束等待至少需要的时间
+        wait = self.pause
+        elapsed = time.monotonic() - self._page_started
+        for count, limit in ((rows, self.max_rows_per_second), (queries, self.max_queries_per_second)):
+            if limit:
+                wait = max(wait, count / limit - elapsed)
+
+        started = time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        if lag is not None and lag > self.max_lag:
+            self._wait_for_replica(lag)
+        self._page_started = time.monotonic()
+        return self._page_started - started
+
+    def _wait_for_replica(self, lag: float):
+        """
+        暂停清洗，每 lag_interval 秒重新检查一次主从延迟，直到延迟恢复 (或无法检查)
+        超过 max_lag_wait 秒仍未恢复时报错，本页已提交，断点续跑时从下一页继续
+        """
+        Logger.warning(f"主从延迟 {lag:.1f}s 超过上限 {self.max_lag}s，暂停清洗，直到延迟恢复")
+        started = time.monotonic()
+        while lag is not None and lag > self.max_lag:
+            waited = time.monotonic() - started
+            if self.max_lag_wait is not None and waited >= self.max_lag_wait:
+                raise Exception(
+                    f"主从延迟 {lag:.1f}s 持续超过上限 {self.max_lag}s，已暂停 {waited:.0f}s (max_lag_wait={self.max_lag_wait}s)，停止清洗，延迟恢复后可以断点续跑"
+                )
+            time.sleep(self.lag_interval)
+            lag = self._replica_lag(force=True)
+            if lag is not None and lag > self.max_lag:
+                Logger.warning(
+                    f"主从延迟 {lag:.1f}s 仍超过上限 {self.max_lag}s，已暂停 {time.monotonic() - started:.0f}s"
+                )
+        Logger.info(f"主从延迟已恢复，继续清洗")
+
+    def _slow_down(self, reason: str):
+        if self.page_size is not None and self.page_size > self.min_page_size:
+            self.page_size = max(self.min_page_size, self.page_size // 2)
+            Logger.info(f"限流：{reason}，分页尺寸调整为 {self.page_size}")
+            return
+        pause = min(self.max_pause, max(self.pause * 2, MIN_PAUSE))
+        if pause != self.pause:
+            self.pause = pause
+            Logger.info(f"限流：{reason}，页间暂停调整为 {self.pause:.2f}s")
+
+    def _speed_up(self):
+        if self.pause > 0:
+            self.pause = self.pause / 2 if self.pause / 2 >= MIN_PAUSE else 0.0
+            if self.pause == 0:
+                Logger.info(f"限流：负载已恢复，取消页间暂停")
+            return
+        if self.page_size is not None and self.page_size < self.max_page_size:
+            self.page_size = min(self.max_page_size, max(self.page_size + 1, int(self.page_size * 1.25)))
+
+    def _replica_lag(self, force: bool = False) -> float:
+        """
+        主从延迟，每 lag_interval 秒最多检查一次
+        """
+        if self.lag_probe is None:
+            return None
+        now = time.monotonic()
+        if not force and self._lag_checked is not None and now - self._lag_checked < self.lag_interval:
+            return self._lag
+        self._lag_checked = now
+        try:
+            self._lag = self.lag_probe()
+            self._probe_failed = False
+        except Exception as e:
+            # 检查失败时不限流，只提示一次
+            if not self._probe_failed:
+                Logger.warning(f"主从延迟检查失败，暂不根据主从延迟限流: {e}")
+            self._probe_failed = True
+            self._lag = None
+        return self._lag
+
+
+class MySQLReplicaLag:
+    """
+    MySQL 主从延迟探针：在从库上执行 SHOW REPLICA STATUS (MySQL 8.0.22 之前为 SHOW SLAVE STATUS)，
+    返回 Seconds_Behind_Source，复制线程未运行时为 None
+    """
+
+    def __init__(self, alias: str = "replica"):
+        self.alias = alias  # 从库在 DATABASES 中的别名
+
+    def __call__(self) -> float:
+        try:
+            status = self._status("SHOW REPLICA STATUS")
+        except DatabaseError:
+            # 失败的游标可能还有未读取的结果或错误状态，旧版本的语句使用新的游标执行
+            status = self._status("SHOW SLAVE STATUS")
+        if status is None:
+            return None
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    def _status(self, sql: str) -> dict:
+        """
+        :return: 复制状态 {列名: 值}，不是从库时为 None
+        """
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+
+class PostgreSQLReplicaLag:
+    """
+    PostgreSQL 主从延迟探针：在主库上查询 pg_stat_replication，返回所有从库中最大的回放延迟 (replay_lag)
+    """
+
+    def __init__(self, alias: str = "default"):
+        self.alias = alias  # 主库在 DATABASES 中的别名
+
+    def __call__(self) -> float:
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication"
+            )
+            return float(cursor.fetchone()[0])